@@ -1,86 +1,145 @@
+"""
+统计DATA0329配时数据中各小时的数据量和不同inter_id、nds_id的数量，并保存16时的完整数据
+
+一次按小时分组聚合得到所有统计量，结果写入data/analysis_results.txt和机器可读的data/analysis_stats.json。
+    python analyze_traffic_data.py                # 精确统计
+    python analyze_traffic_data.py --approx       # 分块读取，不同值的数量用HyperLogLog近似统计（见hyperloglog.py）
+    python analyze_traffic_data.py --plot         # 同时绘制各小时的分布图（需要matplotlib）
+"""
+import argparse
+import json
+
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-
-# 设置中文字体
-plt.rcParams['font.sans-serif'] = ['SimHei']  # 用来正常显示中文标签
-plt.rcParams['axes.unicode_minus'] = False  # 用来正常显示负号
-
-# 读取数据，所有列都以字符串形式读取
-df = pd.read_csv('data/filtered_DATA0329.txt', sep='\t', dtype=str)
-
-# 统计总共有多少不同的inter_id
-unique_inter_id = df['inter_id'].nunique()
-print(f"总共有{unique_inter_id}个不同的inter_id")
-
-# 统计总共有多少不同的nds_id
-unique_nds_id = df['nds_id'].nunique()
-print(f"总共有{unique_nds_id}个不同的nds_id")
-
-# 统计每个小时的数据数量
-hour_counts = df['hour'].value_counts()
-# 将小时转换为整数并排序
-hour_counts.index = hour_counts.index.astype(int)
-hour_counts = hour_counts.sort_index()
-most_common_hour = hour_counts.idxmax()
-print(f"\n数据最多的hour是: {most_common_hour}点，共有{hour_counts[most_common_hour]}条数据")
-
-# 把16时数据保存到traffic_light_16.txt
-df_16 = df[df['hour'] == '16']
-df_16.to_csv('traffic_light_16.txt', index=False, sep='\t')
-
-# 统计每个小时对应的不同inter_id数量
-unique_inter_per_hour = df.groupby('hour')['inter_id'].nunique()
-# 将小时转换为整数并排序
-unique_inter_per_hour.index = unique_inter_per_hour.index.astype(int)
-unique_inter_per_hour = unique_inter_per_hour.sort_index()
-most_inter_hour = unique_inter_per_hour.idxmax()
-print(f"\n{most_inter_hour}点对应的不同inter_id数量最多，共有{unique_inter_per_hour[most_inter_hour]}个不同的inter_id")
-
-# 统计每个小时对应的不同nds_id数量
-unique_nds_per_hour = df.groupby('hour')['nds_id'].nunique()
-# 将小时转换为整数并排序
-unique_nds_per_hour.index = unique_nds_per_hour.index.astype(int)
-unique_nds_per_hour = unique_nds_per_hour.sort_index()
-most_nds_hour = unique_nds_per_hour.idxmax()
-print(f"\n{most_nds_hour}点对应的不同nds_id数量最多，共有{unique_nds_per_hour[most_nds_hour]}个不同的nds_id")
-
-# 绘制小时分布图
-plt.figure(figsize=(10, 6))
-hour_counts.plot(kind='bar')
-plt.title('各小时数据分布')
-plt.xlabel('小时')
-plt.ylabel('数据数量')
-plt.tight_layout()
-plt.savefig('data/hour_distribution.png', dpi=300, bbox_inches='tight')
-plt.close()
-
-# 绘制每个小时对应的不同inter_id数量图
-plt.figure(figsize=(10, 6))
-unique_inter_per_hour.plot(kind='bar', color='orange')
-plt.title('各小时对应的不同inter_id数量')
-plt.xlabel('小时')
-plt.ylabel('不同inter_id数量')
-plt.tight_layout()
-plt.savefig('data/unique_inter_per_hour.png', dpi=300, bbox_inches='tight')
-plt.close()
-
-# 绘制每个小时对应的不同nds_id数量图
-plt.figure(figsize=(10, 6))
-unique_nds_per_hour.plot(kind='bar', color='green')
-plt.title('各小时对应的不同nds_id数量')
-plt.xlabel('小时')
-plt.ylabel('不同nds_id数量')
-plt.tight_layout()
-plt.savefig('data/unique_nds_per_hour.png', dpi=300, bbox_inches='tight')
-plt.close()
-
-# 保存统计结果
-with open('data/analysis_results.txt', 'w', encoding='utf-8') as f:
-    f.write(f"总共有{unique_inter_id}个不同的inter_id\n")
-    f.write(f"数据最多的hour: {most_common_hour}点\n")
-    f.write(f"数据数量: {hour_counts[most_common_hour]}条\n\n")
-    f.write(f"{most_nds_hour}点对应的不同nds_id数量最多\n")
-    f.write(f"不同nds_id数量: {unique_nds_per_hour[most_nds_hour]}个\n\n")
-    f.write(f"{most_inter_hour}点对应的不同inter_id数量最多\n")
-    f.write(f"不同inter_id数量: {unique_inter_per_hour[most_inter_hour]}个") 
\ No newline at end of file
+
+from data_schema import read_timing
+from hyperloglog import DEFAULT_PRECISION, GroupedHyperLogLog
+
+# 统计不同值数量的列
+DISTINCT_COLUMNS = ['inter_id', 'nds_id']
+HOURS_PER_DAY = 24
+HOUR_16_FILE = 'traffic_light_16.txt'
+
+
+def exact_statistics(df: pd.DataFrame):
+    """
+    一次分组聚合得到各小时的数据量和不同值的数量
+    返回(全部数据的不同值数量, 各小时的统计)，各小时的统计按小时排序，列为records和DISTINCT_COLUMNS
+    """
+    per_hour = df.groupby('hour', observed=True, sort=True).agg(
+        records=('hour', 'size'), **{col: (col, 'nunique') for col in DISTINCT_COLUMNS})
+    totals = {col: int(df[col].nunique()) for col in DISTINCT_COLUMNS}
+    return totals, per_hour
+
+
+def approximate_statistics(chunks, precision: int = DEFAULT_PRECISION, hour_16_file: str = None):
+    """
+    分块统计，各小时的数据量为精确值，不同值的数量用HyperLogLog近似
+    hour_16_file不为None时把16时的数据逐块写入该文件
+    返回值与exact_statistics相同
+    """
+    # 第HOURS_PER_DAY组为hour缺失的数据，只计入全部数据的统计
+    counters = {col: GroupedHyperLogLog(HOURS_PER_DAY + 1, precision) for col in DISTINCT_COLUMNS}
+    records = np.zeros(HOURS_PER_DAY + 1, dtype=np.int64)
+    header = True
+    for chunk in chunks:
+        groups = chunk['hour'].fillna(HOURS_PER_DAY).to_numpy(dtype=np.int64)
+        records += np.bincount(groups, minlength=HOURS_PER_DAY + 1)
+        for col, counter in counters.items():
+            valid = chunk[col].notna().to_numpy()
+            counter.add(groups[valid], chunk[col].to_numpy()[valid])
+        if hour_16_file is not None:
+            chunk[chunk['hour'] == 16].to_csv(hour_16_file, index=False, sep='\t', mode='w' if header else 'a',
+                                              header=header)
+            header = False
+
+    hours = np.flatnonzero(records[:HOURS_PER_DAY])
+    per_hour = pd.DataFrame({'records': records[hours]}, index=pd.Index(hours, name='hour'))
+    totals = {}
+    for col, counter in counters.items():
+        per_hour[col] = np.rint(counter.estimate()[hours]).astype(np.int64)
+        total = counter.estimate(counter.registers.max(axis=0, keepdims=True))[0]
+        totals[col] = int(np.rint(total))
+    return totals, per_hour
+
+
+def plot_statistics(per_hour: pd.DataFrame):
+    """绘制各小时的数据量和不同inter_id、nds_id数量的柱状图"""
+    import matplotlib.pyplot as plt
+
+    # 设置中文字体
+    plt.rcParams['font.sans-serif'] = ['SimHei']  # 用来正常显示中文标签
+    plt.rcParams['axes.unicode_minus'] = False  # 用来正常显示负号
+
+    figures = [
+        ('records', 'C0', '各小时数据分布', '数据数量', 'data/hour_distribution.png'),
+        ('inter_id', 'orange', '各小时对应的不同inter_id数量', '不同inter_id数量', 'data/unique_inter_per_hour.png'),
+        ('nds_id', 'green', '各小时对应的不同nds_id数量', '不同nds_id数量', 'data/unique_nds_per_hour.png'),
+    ]
+    for column, color, title, ylabel, path in figures:
+        plt.figure(figsize=(10, 6))
+        per_hour[column].plot(kind='bar', color=color)
+        plt.title(title)
+        plt.xlabel('小时')
+        plt.ylabel(ylabel)
+        plt.tight_layout()
+        plt.savefig(path, dpi=300, bbox_inches='tight')
+        plt.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='统计配时数据各小时的数据量和不同inter_id、nds_id的数量')
+    parser.add_argument('--input', default='data/filtered_DATA0329.txt', help='配时数据文件')
+    parser.add_argument('--stats-output', default='data/analysis_stats.json', help='机器可读的统计结果')
+    parser.add_argument('--approx', action='store_true',
+                        help='分块读取，不同值的数量用HyperLogLog近似统计，适用于很大的输入')
+    parser.add_argument('--precision', type=int, default=DEFAULT_PRECISION,
+                        help='HyperLogLog的精度，每组2^precision个寄存器')
+    parser.add_argument('--chunksize', type=int, default=1000000, help='--approx时每块的行数')
+    parser.add_argument('--plot', action='store_true', help='绘制各小时的分布图')
+    args = parser.parse_args()
+
+    # 读取数据，列类型见data_schema.TIMING_DTYPES（需要保存16时的完整数据，因此读取所有列）
+    if args.approx:
+        totals, per_hour = approximate_statistics(read_timing(args.input, chunksize=args.chunksize),
+                                                  args.precision, HOUR_16_FILE)
+    else:
+        df = read_timing(args.input)
+        totals, per_hour = exact_statistics(df)
+        # 把16时数据保存到traffic_light_16.txt
+        df[df['hour'] == 16].to_csv(HOUR_16_FILE, index=False, sep='\t')
+
+    print(f"总共有{totals['inter_id']}个不同的inter_id")
+    print(f"总共有{totals['nds_id']}个不同的nds_id")
+    most_common_hour = per_hour['records'].idxmax()
+    print(f"\n数据最多的hour是: {most_common_hour}点，共有{per_hour['records'][most_common_hour]}条数据")
+    most_inter_hour = per_hour['inter_id'].idxmax()
+    print(f"\n{most_inter_hour}点对应的不同inter_id数量最多，共有{per_hour['inter_id'][most_inter_hour]}个不同的inter_id")
+    most_nds_hour = per_hour['nds_id'].idxmax()
+    print(f"\n{most_nds_hour}点对应的不同nds_id数量最多，共有{per_hour['nds_id'][most_nds_hour]}个不同的nds_id")
+
+    # 保存统计结果
+    with open('data/analysis_results.txt', 'w', encoding='utf-8') as f:
+        f.write(f"总共有{totals['inter_id']}个不同的inter_id\n")
+        f.write(f"数据最多的hour: {most_common_hour}点\n")
+        f.write(f"数据数量: {per_hour['records'][most_common_hour]}条\n\n")
+        f.write(f"{most_nds_hour}点对应的不同nds_id数量最多\n")
+        f.write(f"不同nds_id数量: {per_hour['nds_id'][most_nds_hour]}个\n\n")
+        f.write(f"{most_inter_hour}点对应的不同inter_id数量最多\n")
+        f.write(f"不同inter_id数量: {per_hour['inter_id'][most_inter_hour]}个")
+
+    stats = {
+        'approximate': args.approx,
+        'totals': totals,
+        'hours': [{'hour': int(hour), **{col: int(value) for col, value in row.items()}}
+                  for hour, row in per_hour.iterrows()],
+    }
+    with open(args.stats_output, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, ensure_ascii=False, indent=2)
+
+    if args.plot:
+        plot_statistics(per_hour)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,90 +1,114 @@
-import pandas as pd
+"""
+补全各小时的配时数据
+
+某个小时缺少的(nds_id, dir)使用其他小时中离该小时最近的一行配时数据补充。
+离目标小时h的距离取到h时和h+1时的距离中较小的一个，按24小时循环计算（23时与0时相差1小时），
+距离相同时取文件中靠前的行。每个键只记录各小时的第一行（键 × 24的表），
+用24 × 24的小时距离表为每个目标小时选出最近的小时，不再对每个缺失的键扫描全部数据。
+
+    python complete_16h_data.py                 # 输出16时的data/complete_16h_data.txt和全天的data/complete_24h_data.txt
+    python complete_16h_data.py --hour 8 --output data/complete_8h_data.txt
+
+complete_16h_data.txt不再输出原先补充数据时遗留的time_diff列（merged_16h_timing_data.txt因此同样没有这一列），
+其他列与原先相同，hour列为数据实际所在的小时，由它即可得到补充数据的来源；
+complete_24h_data.txt包含0-23时的完整配时表，hour列为补全的目标小时，数据实际所在的小时记录在source_hour列中。
+"""
+import argparse
+
 import numpy as np
+import pandas as pd
 
-# 读取数据
-df = pd.read_csv('data/filtered_DATA0329.txt', sep='\t', dtype=str)
-
-# 输出不同的nds_id数量
-print(f"原始数据中的不同的nds_id数量: {df['nds_id'].nunique()}")
-
-# 获取16时的数据作为基准
-df_16 = df[df['hour'] == '16'].copy()
-
-# 获取其他时间的数据
-df_other = df[df['hour'] != '16'].copy()
-
-# 将hour转换为整数，处理可能的NaN值
-df_other['hour'] = pd.to_numeric(df_other['hour'], errors='coerce')
-df_other = df_other.dropna(subset=['hour'])  # 删除hour为NaN的行
-df_other['hour'] = df_other['hour'].astype(int)
-# 输出删除hour为NaN的行后的nds_id数量
-print(f"删除hour为NaN的行后的nds_id数量: {df_other['nds_id'].nunique()}")
-
-# 创建一个唯一标识符，用于匹配数据
-df_16['unique_key'] = df_16['nds_id'] + '_' + df_16['dir']
-df_other['unique_key'] = df_other['nds_id'] + '_' + df_other['dir']
-
-# 获取16时数据中所有唯一的标识符
-unique_keys_16 = set(df_16['unique_key'])
-
-# 获取其他时间数据中所有唯一的标识符
-unique_keys_other = set(df_other['unique_key'])
-
-# 找出16时缺失的标识符
-missing_keys = unique_keys_other - unique_keys_16
-
-# 创建一个新的DataFrame来存储补充的数据
-supplemental_data = []
-
-# 对于每个缺失的标识符，找到最接近16时的数据
-for key in missing_keys:
-    # 获取包含这个标识符的所有数据
-    matching_data = df_other[df_other['unique_key'] == key].copy()
-    
-    if len(matching_data) > 0:
-        # 计算每个时间点与16时和17时的差距
-        time_diff_16 = abs(matching_data['hour'] - 16)
-        time_diff_17 = abs(matching_data['hour'] - 17)
-        
-        # 取最小值作为时间差
-        matching_data['time_diff'] = pd.DataFrame({'diff16': time_diff_16, 'diff17': time_diff_17}).min(axis=1)
-        
-        # 找到最接近16时或17时的数据
-        closest_data = matching_data.loc[matching_data['time_diff'].idxmin()]
-        
-        # 添加到补充数据中
-        supplemental_data.append(closest_data)
-
-# 将补充数据转换为DataFrame
-if supplemental_data:
-    df_supplement = pd.DataFrame(supplemental_data)
-    # 合并原始16时数据和补充数据
-    df_complete = pd.concat([df_16, df_supplement], ignore_index=True)
-else:
-    df_complete = df_16
-
-# 输出不同的nds_id数量
-print(f"原始16时数据中的不同的nds_id数量: {df_16['nds_id'].nunique()}")
-print(f"补充数据中的不同的nds_id数量: {df_supplement['nds_id'].nunique()}")
-print(f"完整数据中的不同的nds_id数量: {df_complete['nds_id'].nunique()}")
-
-# 删除临时列
-df_complete = df_complete.drop(['unique_key'], axis=1)
-
-# 将nds_id转换为数值类型以便正确排序
-df_complete['nds_id'] = pd.to_numeric(df_complete['nds_id'], errors='coerce')
-df_complete = df_complete.dropna(subset=['nds_id'])  # 删除nds_id为NaN的行
-
-# 按照inter_id和nds_id排序
-df_complete = df_complete.sort_values(['inter_id', 'nds_id'])
-
-# 将nds_id转回字符串类型
-df_complete['nds_id'] = df_complete['nds_id'].astype(str)
-
-# 保存完整的数据
-df_complete.to_csv('data/complete_16h_data.txt', sep='\t', index=False)
-
-# 打印统计信息
-print(f"原始16时数据条数: {len(df_16)}")
-print(f"补充的数据条数: {len(supplemental_data)}")
-print(f"完整数据总条数: {len(df_complete)}")
\ No newline at end of file
+from data_schema import read_timing
+
+HOURS_PER_DAY = 24
+
+
+def hour_distance(hours, target_hours):
+    """小时hours到目标小时（即[target, target + 1]时段）的循环距离，参数可广播"""
+    def circular(diff):
+        diff = np.abs(diff) % HOURS_PER_DAY
+        return np.minimum(diff, HOURS_PER_DAY - diff)
+    hours = np.asarray(hours, dtype=np.int64)
+    target_hours = np.asarray(target_hours, dtype=np.int64)
+    return np.minimum(circular(hours - target_hours), circular(hours - target_hours - 1))
+
+
+def complete_hours(df: pd.DataFrame, target_hours=range(HOURS_PER_DAY)) -> pd.DataFrame:
+    """
+    补全每个目标小时的配时数据
+    该小时已有的(nds_id, dir)保留所有行，其他小时出现过但该小时缺失的(nds_id, dir)取最近的一行（见hour_distance）
+    返回的数据在原有列之外增加target_hour列，hour列仍为数据实际所在的小时，按target_hour排列，同一小时内先是该小时已有的行（原顺序），再是补充的行
+    """
+    # hour或nds_id缺失的行无法参与补全
+    df = df[df['hour'].notna() & df['nds_id'].notna()]
+    keys = pd.factorize(df['nds_id'].astype(str) + '_' + df['dir'].astype(str))[0]
+    hours = df['hour'].to_numpy(dtype=np.int64)
+
+    # 每个(键, 小时)第一行的位置，该小时没有数据时为-1
+    first_rows = np.full((keys.max(initial=-1) + 1, HOURS_PER_DAY), -1, dtype=np.int64)
+    first = np.flatnonzero(~pd.DataFrame({'key': keys, 'hour': hours}).duplicated().to_numpy())
+    first_rows[keys[first], hours[first]] = first
+    present = first_rows >= 0
+    # distances[t, h]为h时到目标小时t的距离；按(距离, 行)取最小，距离相同时取靠前的行
+    all_hours = np.arange(HOURS_PER_DAY)
+    distances = hour_distance(all_hours[None, :], all_hours[:, None])
+
+    # 按小时排列的行（同一小时内保持原顺序）
+    by_hour = np.argsort(hours, kind='stable')
+    hour_bounds = np.searchsorted(hours[by_hour], np.arange(HOURS_PER_DAY + 1))
+
+    rows, row_targets = [], []
+    for target in target_hours:
+        # 该小时已有的行全部保留，缺少的键按键第一次出现的顺序补充最近的一行
+        existing = by_hour[hour_bounds[target]:hour_bounds[target + 1]]
+        missing = np.flatnonzero(~present[:, target])
+        cost = np.where(present[missing], distances[target] * len(df) + first_rows[missing], np.iinfo(np.int64).max)
+        nearest = first_rows[missing, np.argmin(cost, axis=1)]
+        rows.append(np.concatenate([existing, nearest]))
+        row_targets.append(np.full(len(rows[-1]), target))
+    return df.iloc[np.concatenate(rows)].assign(target_hour=np.concatenate(row_targets)).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用最近小时的配时数据补全各小时缺失的(nds_id, dir)')
+    parser.add_argument('--input', default='data/filtered_DATA0329.txt', help='配时数据文件')
+    parser.add_argument('--hour', type=int, default=16, help='单独输出的小时')
+    parser.add_argument('--output', default='data/complete_16h_data.txt', help='该小时补全后的配时数据')
+    parser.add_argument('--all-day-output', default='data/complete_24h_data.txt',
+                        help='0-23时补全后的配时数据，为空时不输出')
+    args = parser.parse_args()
+
+    # 读取数据，列类型见data_schema.TIMING_DTYPES
+    df = read_timing(args.input)
+
+    # 输出不同的nds_id数量
+    print(f"原始数据中的不同的nds_id数量: {df['nds_id'].nunique()}")
+    print(f"删除hour为NaN的行后的nds_id数量: {df.loc[df['hour'].notna(), 'nds_id'].nunique()}")
+
+    complete = complete_hours(df)
+
+    # 单独输出的小时：除time_diff列外与原先的格式相同，先该小时原有的行再补充的行，按照inter_id和nds_id稳定排序
+    df_complete = complete[complete['target_hour'] == args.hour].drop(columns='target_hour')
+    df_complete = df_complete.sort_values(['inter_id', 'nds_id'], kind='stable')
+    supplemented = (df_complete['hour'] != args.hour).to_numpy()
+    df_complete.to_csv(args.output, sep='\t', index=False)
+
+    print(f"原始{args.hour}时数据中的不同的nds_id数量: {df_complete.loc[~supplemented, 'nds_id'].nunique()}")
+    print(f"补充数据中的不同的nds_id数量: {df_complete.loc[supplemented, 'nds_id'].nunique()}")
+    print(f"完整数据中的不同的nds_id数量: {df_complete['nds_id'].nunique()}")
+    print(f"原始{args.hour}时数据条数: {int((~supplemented).sum())}")
+    print(f"补充的数据条数: {int(supplemented.sum())}")
+    print(f"完整数据总条数: {len(df_complete)}")
+
+    # 全天的完整配时表：hour为目标小时，source_hour为数据实际所在的小时
+    if args.all_day_output:
+        all_day = complete.rename(columns={'hour': 'source_hour'})
+        all_day.insert(all_day.columns.get_loc('source_hour'), 'hour', all_day.pop('target_hour'))
+        all_day = all_day.sort_values(['hour', 'inter_id', 'nds_id'], kind='stable')
+        all_day.to_csv(args.all_day_output, sep='\t', index=False)
+        print(f"全天完整数据总条数: {len(all_day)}，其中补充的数据条数: "
+              f"{int((all_day['hour'] != all_day['source_hour']).sum())}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+由车辆离开时间估计信号周期（频谱方法）
+
+车辆在绿灯期间成批离开，离开时间序列以信号周期为周期变化。
+把每个转向的离开时间按bin_size秒分箱得到车辆数序列，去掉均值后补零做FFT，
+在[min_cycle, max_cycle]对应的频率范围内，把基频及其谐波的功率相加（谐波求和），
+功率最大的频率即为估计的周期，再用峰值两侧的点做抛物线插值细化。
+每个转向的功率除以车辆数（没有周期性时各频率功率的期望约为1），
+同一路口各转向的功率相加后可以得到路口的估计周期，车辆少的转向也能借助同路口的数据。
+
+    python cycle_estimation.py                # 输出 data/estimated_cycle_lengths.txt
+估计结果与配时数据中的cycle_time放在一起，相差超过--tolerance时标记cycle_mismatch。
+"""
+import argparse
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from data_schema import read_timing
+from infer_traffic_light_method1 import map_exit_turn_to_dir
+from movement_store import load_movements
+from timing_index import timing_index
+
+DEFAULT_OUTPUT_FILE = 'data/estimated_cycle_lengths.txt'
+
+# 周期的搜索范围（秒）
+DEFAULT_MIN_CYCLE = 30
+DEFAULT_MAX_CYCLE = 240
+# 参与求和的谐波个数（含基频）
+DEFAULT_HARMONICS = 3
+# 补零倍数，提高频率分辨率
+DEFAULT_PADDING = 8
+# 车辆数少于此值的转向不单独估计
+DEFAULT_MIN_VEHICLES = 10
+# 每块FFT矩阵的最大元素数，限制内存占用
+DEFAULT_MAX_CELLS = 4 * 1024 * 1024
+
+
+class CycleSpectra:
+    """
+    各转向在周期搜索范围内的谐波求和功率
+    scores[i, j]对应频率下标indices[j]（频率为indices[j] / (n_fft * bin_size)），
+    两端各多保留一个下标用于抛物线插值
+    """
+
+    def __init__(self, scores: np.ndarray, indices: np.ndarray, n_fft: int, bin_size: float):
+        self.scores = scores
+        self.indices = indices
+        self.n_fft = n_fft
+        self.bin_size = bin_size
+
+    def peak_cycles(self, scores: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        每行功率最大处对应的周期，返回(估计周期, 峰值与搜索范围内功率中位数之比)
+        没有数据的行为nan
+        """
+        if scores is None:
+            scores = self.scores
+        inner = scores[:, 1:-1]
+        best = np.argmax(inner, axis=1) + 1
+        rows = np.arange(len(scores))
+        left, peak, right = scores[rows, best - 1], scores[rows, best], scores[rows, best + 1]
+        # 抛物线插值得到峰值位置的小数部分
+        curvature = left - 2 * peak + right
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.where(curvature < 0, 0.5 * (left - right) / curvature, 0.0)
+            cycles = self.n_fft * self.bin_size / (self.indices[best] + np.clip(delta, -0.5, 0.5))
+            ratios = peak / np.median(inner, axis=1)
+        empty = ~(peak > 0)
+        cycles[empty] = np.nan
+        ratios[empty] = np.nan
+        return cycles, ratios
+
+
+def _search_indices(n_fft: int, bin_size: float, min_cycle: float, max_cycle: float) -> np.ndarray:
+    """周期在[min_cycle, max_cycle]内的频率下标，两端各多一个"""
+    low = int(np.floor(n_fft * bin_size / max_cycle))
+    high = int(np.ceil(n_fft * bin_size / min_cycle))
+    return np.arange(max(low - 1, 1), high + 2)
+
+
+def _binned_series(offsets, exit_seconds, rows, n_fft, bin_size):
+    """每行一个转向：从该转向最早的离开时间起按bin_size分箱的车辆数，减去有效范围内的均值，之后补零"""
+    n = offsets[rows + 1] - offsets[rows]
+    m = len(rows)
+    point_rows = np.repeat(np.arange(m), n)
+    rank = np.arange(len(point_rows)) - np.repeat(np.cumsum(n) - n, n)
+    times = exit_seconds[np.repeat(offsets[rows], n) + rank].astype(np.int64)
+    first = np.full(m, np.iinfo(np.int64).max)
+    np.minimum.at(first, point_rows, times)
+    bins = ((times - first[point_rows]) // bin_size).astype(np.int64)
+    series = np.bincount(point_rows * n_fft + bins, minlength=m * n_fft).reshape(m, n_fft).astype(float)
+    # 有效范围：最早到最晚离开时间所在的箱
+    lengths = np.zeros(m, dtype=np.int64)
+    np.maximum.at(lengths, point_rows, bins + 1)
+    valid = np.arange(n_fft)[None, :] < lengths[:, None]
+    series -= np.where(valid, (n / lengths)[:, None], 0.0)
+    return series, n
+
+
+def movement_spectra(offsets: np.ndarray, exit_seconds: np.ndarray, bin_size: float = 1,
+                     min_cycle: float = DEFAULT_MIN_CYCLE, max_cycle: float = DEFAULT_MAX_CYCLE,
+                     harmonics: int = DEFAULT_HARMONICS, padding: int = DEFAULT_PADDING,
+                     max_cells: int = DEFAULT_MAX_CELLS) -> CycleSpectra:
+    """
+    计算每个转向的谐波求和功率
+    offsets/exit_seconds: CSR方式保存的各转向离开时间（北京时间当天的秒数，见movement_store.py）
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_rows = len(offsets) - 1
+    # 所有转向使用相同的FFT长度，使频率下标一致
+    spans = np.zeros(n_rows, dtype=np.int64)
+    nonempty = np.flatnonzero(np.diff(offsets) > 0)
+    if len(nonempty):
+        spans[nonempty] = (np.maximum.reduceat(exit_seconds, offsets[nonempty])
+                           - np.minimum.reduceat(exit_seconds, offsets[nonempty]))
+    n_bins = int(spans.max(initial=0) // bin_size) + 1
+    n_fft = 1 << int(np.ceil(np.log2(max(padding * n_bins, 2 * max_cycle / bin_size))))
+    indices = _search_indices(n_fft, bin_size, min_cycle, max_cycle)
+
+    scores = np.zeros((n_rows, len(indices)))
+    block_rows = max(1, max_cells // n_fft)
+    for begin in range(0, n_rows, block_rows):
+        rows = np.arange(begin, min(begin + block_rows, n_rows))
+        rows = rows[offsets[rows + 1] > offsets[rows]]
+        if len(rows) == 0:
+            continue
+        series, counts = _binned_series(offsets, exit_seconds, rows, n_fft, bin_size)
+        power = np.abs(np.fft.rfft(series, axis=1)) ** 2 / counts[:, None]
+        # 基频和谐波的功率相加，超出范围的谐波不计
+        for harmonic in range(1, harmonics + 1):
+            harmonic_indices = indices * harmonic
+            inside = harmonic_indices < power.shape[1]
+            scores[rows[:, None], np.flatnonzero(inside)[None, :]] += power[:, harmonic_indices[inside]]
+    return CycleSpectra(scores, indices, n_fft, bin_size)
+
+
+def estimate_cycle_lengths(offsets: np.ndarray, exit_seconds: np.ndarray, groups: Optional[np.ndarray] = None,
+                           min_vehicles: int = DEFAULT_MIN_VEHICLES, **kwargs) -> pd.DataFrame:
+    """
+    估计每个转向的周期，groups为每个转向所属的路口（缺失值表示不属于任何路口）
+    返回每个转向一行：estimated_cycle、cycle_peak_ratio，
+    给定groups时还有inter_estimated_cycle（同一路口所有转向的功率相加后的估计）
+    其余参数见movement_spectra
+    """
+    spectra = movement_spectra(offsets, exit_seconds, **kwargs)
+    counts = np.diff(np.asarray(offsets, dtype=np.int64))
+    cycles, ratios = spectra.peak_cycles()
+    few = counts < min_vehicles
+    cycles[few] = np.nan
+    ratios[few] = np.nan
+    result = pd.DataFrame({'vehicle_count': counts, 'estimated_cycle': cycles, 'cycle_peak_ratio': ratios})
+    if groups is not None:
+        codes, _ = pd.factorize(pd.Series(groups))
+        valid = codes >= 0
+        group_scores = np.zeros((codes.max(initial=-1) + 1, spectra.scores.shape[1]))
+        np.add.at(group_scores, codes[valid], spectra.scores[valid])
+        group_counts = np.bincount(codes[valid], weights=counts[valid], minlength=len(group_scores))
+        group_cycles, _ = spectra.peak_cycles(group_scores)
+        group_cycles[group_counts < min_vehicles] = np.nan
+        result['inter_estimated_cycle'] = np.where(valid, group_cycles[np.maximum(codes, 0)], np.nan)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='由车辆离开时间的频谱估计信号周期，并与配时数据中的周期比较')
+    parser.add_argument('--input', default='data/clustered_trajectory.npz', help='按转向聚合的轨迹数据')
+    parser.add_argument('--timing', default='data/merged_16h_timing_data.txt', help='合并后的配时数据')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT_FILE, help='输出文件')
+    parser.add_argument('--min-cycle', type=float, default=DEFAULT_MIN_CYCLE, help='周期搜索范围下限（秒）')
+    parser.add_argument('--max-cycle', type=float, default=DEFAULT_MAX_CYCLE, help='周期搜索范围上限（秒）')
+    parser.add_argument('--bin-size', type=float, default=1, help='离开时间分箱的宽度（秒）')
+    parser.add_argument('--min-vehicles', type=int, default=DEFAULT_MIN_VEHICLES, help='参与估计的最少车辆数')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='估计周期与配时周期的相对差超过此值时标记为不一致')
+    args = parser.parse_args()
+
+    movements = load_movements(args.input)
+    cycle_data = read_timing(args.timing, columns=['inter_id', 'nds_id', 'dir', 'cycle_time'], merged=True)
+
+    # 每个转向对应的配时数据：路口按nds_id查找，周期按(nds_id, dir)查找
+    columns = movements.columns
+    table = pd.DataFrame({
+        'nds_id': columns['nds_id'],
+        'next_nds_id': columns['next_nds_id'],
+        'dir': pd.Series([map_exit_turn_to_dir(exit_turn) for exit_turn in columns['exit_turn']], dtype=object),
+    })
+    inter_by_nds = cycle_data.drop_duplicates('nds_id').set_index('nds_id')['inter_id']
+    table.insert(0, 'inter_id', table['nds_id'].map(inter_by_nds))
+    positions = timing_index(cycle_data).positions(table)
+    cycle_times = cycle_data['cycle_time'].to_numpy(dtype=float)
+    table['cycle_time'] = np.where(positions >= 0, cycle_times[np.maximum(positions, 0)], np.nan)
+
+    estimates = estimate_cycle_lengths(movements.offsets, movements.exit_seconds, table['inter_id'].to_numpy(),
+                                       min_vehicles=args.min_vehicles, bin_size=args.bin_size,
+                                       min_cycle=args.min_cycle, max_cycle=args.max_cycle)
+    table = pd.concat([table, estimates], axis=1)
+    # 优先用路口的估计与配时周期比较
+    estimated = table['inter_estimated_cycle'].fillna(table['estimated_cycle'])
+    table['cycle_mismatch'] = (estimated - table['cycle_time']).abs() > args.tolerance * table['cycle_time']
+    table.to_csv(args.output, sep='\t', index=False)
+
+    compared = table['cycle_time'].notna() & estimated.notna()
+    print(f"转向数量: {len(table)}，有估计周期的转向: {estimated.notna().sum()}")
+    print(f"与配时周期比较的转向: {compared.sum()}，不一致: {table['cycle_mismatch'].sum()}")
+    print(f"结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
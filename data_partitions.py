@@ -0,0 +1,98 @@
+"""
+按日期分区的数据目录和增量处理记录
+
+原始数据按天存放在同一个目录下：
+    data/raw/trajectory_20250329.txt
+    data/raw/trajectory_20250330.txt
+各阶段的按天输出放在输出目录的day=YYYYMMDD子目录中，
+已处理的日期记录在输出目录的_processed_days.json里，每次只处理新到的日期。
+后续的推测阶段一次只处理一天（copy_day_output把选定日期的输出复制到固定路径）。
+"""
+import datetime
+import json
+import os
+import re
+import shutil
+from typing import Dict, Iterable, List, Optional
+
+TRAJECTORY_FILE_PATTERN = re.compile(r'^trajectory_(\d{8})\.txt$')
+DAY_PARTITION_COLUMN = 'day'
+DAY_DIR_PATTERN = re.compile(r'^day=(\d{8})$')
+MANIFEST_NAME = '_processed_days.json'
+
+
+def discover_days(data_dir: str) -> List[str]:
+    """列出数据目录中所有原始轨迹文件对应的日期（YYYYMMDD），按日期排序"""
+    days = []
+    for name in os.listdir(data_dir):
+        match = TRAJECTORY_FILE_PATTERN.match(name)
+        if match:
+            days.append(match.group(1))
+    return sorted(days)
+
+
+def discover_partition_days(root_dir: str) -> List[str]:
+    """列出目录下所有day=YYYYMMDD分区对应的日期，按日期排序"""
+    if not os.path.isdir(root_dir):
+        return []
+    days = []
+    for name in os.listdir(root_dir):
+        match = DAY_DIR_PATTERN.match(name)
+        if match and os.path.isdir(os.path.join(root_dir, name)):
+            days.append(match.group(1))
+    return sorted(days)
+
+
+def trajectory_file(data_dir: str, day: str) -> str:
+    """某一天的原始轨迹文件路径"""
+    return os.path.join(data_dir, f'trajectory_{day}.txt')
+
+
+def day_dir(root_dir: str, day: str) -> str:
+    """某一天的分区目录"""
+    return os.path.join(root_dir, f'{DAY_PARTITION_COLUMN}={day}')
+
+
+def reset_day_dir(root_dir: str, day: str) -> str:
+    """清空并重新创建某一天的分区目录，避免残留上次中断的输出"""
+    path = day_dir(root_dir, day)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    return path
+
+
+def load_manifest(root_dir: str) -> Dict[str, Dict[str, dict]]:
+    """读取已处理日期记录：{阶段名: {日期: 处理信息}}"""
+    path = os.path.join(root_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def pending_days(root_dir: str, stage: str, days: Iterable[str]) -> List[str]:
+    """返回某阶段还没有处理过的日期"""
+    processed = load_manifest(root_dir).get(stage, {})
+    return [day for day in days if day not in processed]
+
+
+def mark_day_processed(root_dir: str, stage: str, day: str, info: Optional[dict] = None):
+    """记录某阶段已处理完某一天，写入临时文件后替换，避免记录文件损坏"""
+    manifest = load_manifest(root_dir)
+    entry = dict(info or {})
+    entry['processed_at'] = datetime.datetime.now().isoformat(timespec='seconds')
+    manifest.setdefault(stage, {})[day] = entry
+    path = os.path.join(root_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def copy_day_output(root_dir: str, name: str, output_file: str, day: str):
+    """
+    把某一天分区中名为name的输出复制为output_file，供后续阶段读取
+    各天的exit_seconds都是当天的秒数，后续阶段一次只处理一天，不把多天的输出拼接在一起
+    """
+    shutil.copyfile(os.path.join(day_dir(root_dir, day), name), output_file)
@@ -0,0 +1,210 @@
+"""
+轨迹数据和DATA0329信号灯配时数据的列定义与紧凑类型
+
+各脚本通过read_trajectory/read_timing读取数据时声明自己需要的列，
+只解析这些列，并直接得到合适宽度的类型，不再用dtype=str读取后再pd.to_numeric。
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# 原始轨迹文件的列名
+TRAJECTORY_COLUMNS = ['adcode', 'nds_id', 'enter_time', 'exit_turn', 'travel_time', 'stop_time',
+                      'link_length', 'road_class', 'cover_percent', 'no_stop_speed', 'avg_speed',
+                      'traffic_kmph', 'stop_length', 'next_nds_id', 'ds_code', 'user_id', 'device_id',
+                      'start_time', 'intersection_time', 'new_route_flag', 'offset_info', 'stop_info',
+                      'match_points_info', 'pre_nds_id', 'link_width', 'formway', 'ownership_type',
+                      'navi_info', 'flag', 'province', 'ds']
+
+# 筛选后的轨迹文件在原始列之后增加exit_seconds：离开时间在北京时间当天的秒数
+FILTERED_TRAJECTORY_COLUMNS = TRAJECTORY_COLUMNS + ['exit_seconds']
+
+# 轨迹数据的列类型，未列出的列按字符串读取
+TRAJECTORY_DTYPES = {
+    'adcode': 'int32',
+    'nds_id': 'int64',
+    'next_nds_id': 'Int64',    # 可能缺失，筛选时与0一样视为没有下一路段
+    'pre_nds_id': 'Int64',
+    'enter_time': 'int64',     # UTC时间戳（秒）
+    'travel_time': 'Int32',    # 秒，可能缺失（缺失时无法得到离开时间，见trajectory_filters.exit_epoch_seconds）
+    'stop_time': 'Int32',      # 秒，可能缺失
+    # 以下数值会写回筛选结果或参与求均值，保持float64，避免输出中出现float32的舍入误差
+    'exit_turn': 'float64',
+    'link_length': 'float64',
+    'cover_percent': 'float64',
+    'no_stop_speed': 'float64',
+    'avg_speed': 'float64',
+    'traffic_kmph': 'float64',
+    'stop_length': 'float64',
+}
+
+# 筛选后的轨迹文件中enter_time已转换为北京时间字符串，next_nds_id为空的行已被筛去
+FILTERED_TRAJECTORY_DTYPES = dict(TRAJECTORY_DTYPES, enter_time='str', exit_seconds='int32', next_nds_id='int64')
+
+# DATA0329信号灯配时数据的列类型，未列出的列由pandas推断
+TIMING_DTYPES = {
+    # 编号可能缺失，使用可空整数类型，由各步骤决定是否删除缺失的行
+    'inter_id': 'Int64',
+    'f_rid': 'Int64',
+    'nds_id': 'Int64',
+    'node_id': 'Int64',
+    'dir': 'category',         # 取值为整数编码，见CATEGORY_CODE_DTYPE
+    'way': 'category',
+    'hour': 'Int8',
+    'red_time': 'Int32',       # 秒
+    'green_time': 'Int32',     # 秒
+    'cycle_time': 'Int32',     # 秒
+}
+
+# 分类列先按整数解析再转换为category，避免得到字符串类别
+CATEGORY_CODE_DTYPE = 'Int8'
+
+# 时长可能带小数：先按float64解析，再向下取整为上面声明的整数类型（见_floor_durations），
+# 个别带小数的行不会使整个文件读取失败
+DURATION_COLUMNS = ['travel_time', 'stop_time', 'red_time', 'green_time', 'cycle_time']
+
+# 合并后的配时数据（merged_16h_timing_data.txt）中时长为均值，保持float64，与合并前的输出一致
+MERGED_TIMING_DTYPES = dict(TIMING_DTYPES, hour='int8', red_time='float64',
+                            green_time='float64', cycle_time='float64')
+
+
+def _dtypes_for(dtypes: Dict[str, str], columns: Optional[List[str]], default: Optional[str]) -> Dict[str, str]:
+    if columns is None:
+        return dict(dtypes)
+    result = {}
+    for col in columns:
+        if col in dtypes:
+            result[col] = dtypes[col]
+        elif default is not None:
+            result[col] = default
+    return result
+
+
+def _parse_dtypes(dtypes: Dict[str, str]) -> Dict[str, str]:
+    """read_csv使用的类型：整数时长按float64解析"""
+    return {col: 'float64' if col in DURATION_COLUMNS else dtype for col, dtype in dtypes.items()}
+
+
+def _floor_durations(df: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+    """将按float64解析的整数时长向下取整，转换为dtypes中的类型（缺失值保持缺失）"""
+    for col in DURATION_COLUMNS:
+        if col in df.columns and dtypes.get(col, 'float64') != 'float64':
+            df[col] = np.floor(df[col]).astype(dtypes[col])
+    return df
+
+
+def _read_tsv(path, dtypes: Dict[str, str], chunksize: Optional[int], finish=None, **kwargs):
+    """按dtypes读取TSV，每块（或整个表）读取后取整时长，再执行finish，给定chunksize时返回迭代器"""
+    def finish_frame(df):
+        df = _floor_durations(df, dtypes)
+        return finish(df) if finish is not None else df
+    reader = pd.read_csv(path, sep='\t', dtype=_parse_dtypes(dtypes), chunksize=chunksize, **kwargs)
+    if chunksize is None:
+        return finish_frame(reader)
+    return (finish_frame(chunk) for chunk in reader)
+
+
+def trajectory_dtypes(columns: Optional[List[str]] = None, filtered: bool = False) -> Dict[str, str]:
+    """返回指定轨迹列的类型"""
+    dtypes = FILTERED_TRAJECTORY_DTYPES if filtered else TRAJECTORY_DTYPES
+    if columns is None:
+        columns = TRAJECTORY_COLUMNS
+    return _dtypes_for(dtypes, columns, default='str')
+
+
+def read_trajectory(path, columns: Optional[List[str]] = None, chunksize: Optional[int] = None,
+                    has_header: bool = True):
+    """读取原始轨迹文件（或其中一段字节），只解析columns中的列"""
+    return _read_tsv(path,
+                     trajectory_dtypes(columns),
+                     chunksize,
+                     header=0 if has_header else None,
+                     names=TRAJECTORY_COLUMNS,
+                     usecols=columns,
+                     low_memory=False)
+
+
+def read_filtered_trajectory(path: str, columns: Optional[List[str]] = None, chunksize: Optional[int] = None):
+    """读取筛选后的轨迹文件（带表头，enter_time为北京时间字符串，exit_seconds为当天秒数）"""
+    return _read_tsv(path,
+                     trajectory_dtypes(columns, filtered=True),
+                     chunksize,
+                     usecols=columns,
+                     low_memory=False)
+
+
+# 二进制配时表中每列缺失值掩码的后缀
+TIMING_MASK_SUFFIX = '__mask'
+
+
+def save_timing_table(df: pd.DataFrame, path: str):
+    """
+    把配时数据保存为带类型的二进制表（npz）：每列一个数组，另存列名和类型，有缺失值的列另存掩码
+    category列保存类别的值，读取时不需要再解析文本和转换类型
+    """
+    arrays = {'__columns__': np.array(df.columns, dtype=str),
+              '__dtypes__': np.array([str(dtype) for dtype in df.dtypes], dtype=str)}
+    for col in df.columns:
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(values.cat.categories.dtype)
+        mask = values.isna().to_numpy()
+        if values.dtype == object or isinstance(values.dtype, pd.StringDtype):
+            data = values.astype(str).to_numpy(dtype=str)
+        elif isinstance(values.dtype, pd.api.extensions.ExtensionDtype):
+            data = values.to_numpy(dtype=values.dtype.numpy_dtype, na_value=0)
+        else:
+            data = values.to_numpy()
+        arrays[col] = data
+        if mask.any():
+            arrays[col + TIMING_MASK_SUFFIX] = mask
+    np.savez(path, **arrays)
+
+
+def read_timing_table(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """读取save_timing_table保存的二进制配时表，只读取columns中的列（与read_csv的usecols相同，按表中的顺序）"""
+    with np.load(path) as data:
+        dtypes = dict(zip(data['__columns__'].tolist(), data['__dtypes__'].tolist()))
+        frame = {}
+        missing = set(columns or []) - set(dtypes)
+        if missing:
+            raise ValueError(f"{path}中没有列: {sorted(missing)}")
+        for col in (col for col in dtypes if columns is None or col in columns):
+            dtype = dtypes[col]
+            values = pd.Series(data[col])
+            if dtype == 'category':
+                values = values.astype(CATEGORY_CODE_DTYPE)
+            elif dtype != 'object':
+                values = values.astype(dtype)
+            else:
+                values = values.astype(object)
+            if col + TIMING_MASK_SUFFIX in data.files:
+                values = values.mask(data[col + TIMING_MASK_SUFFIX])
+            if dtype == 'category':
+                values = values.astype('category')
+            frame[col] = values
+    return pd.DataFrame(frame)
+
+
+def _categorize(df: pd.DataFrame, category_columns: List[str]) -> pd.DataFrame:
+    for col in category_columns:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    return df
+
+
+def read_timing(path: str, columns: Optional[List[str]] = None, merged: bool = False,
+                chunksize: Optional[int] = None):
+    """
+    读取信号灯配时数据，merged为True时按合并后的配时数据类型读取
+    .npz文件为save_timing_table保存的二进制配时表，已经带有类型
+    给定chunksize时（仅TSV）返回每次chunksize行的迭代器
+    """
+    if path.endswith('.npz'):
+        return read_timing_table(path, columns)
+    dtypes = _dtypes_for(MERGED_TIMING_DTYPES if merged else TIMING_DTYPES, columns, default=None)
+    category_columns = [col for col, dtype in dtypes.items() if dtype == 'category']
+    for col in category_columns:
+        dtypes[col] = CATEGORY_CODE_DTYPE
+    return _read_tsv(path, dtypes, chunksize, lambda df: _categorize(df, category_columns), usecols=columns)
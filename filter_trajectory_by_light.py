@@ -1,12 +1,12 @@
-import pandas as pd
+from data_schema import read_filtered_trajectory, read_timing
 
 # 读取DATA0329数据
-data0329 = pd.read_csv('data/merged_16h_timing_data.txt', sep='\t')
-nds_ids = set(data0329['nds_id'].unique())
+data0329 = read_timing('data/merged_16h_timing_data.txt', columns=['nds_id'], merged=True)
+nds_ids = set(data0329['nds_id'].dropna().unique())
 print(f"DATA0329数据包含 {len(nds_ids)} 个唯一的nds_id")
 
 # 读取轨迹数据
-trajectory_data = pd.read_csv('data/filtered_trajectory_matched_16_17_method1.txt', sep='\t')
+trajectory_data = read_filtered_trajectory('data/filtered_trajectory_matched_16_17_method1.txt')
 print(f"轨迹数据包含 {len(trajectory_data)} 条记录")
 trajectory_data_nds_ids = set(trajectory_data['nds_id'].unique())
 print(f"轨迹数据包含 {len(trajectory_data_nds_ids)} 个唯一的nds_id")
@@ -1,80 +1,90 @@
-# 方法1：
-# 1. 筛选出16:00-17:00之间的数据
-# 2. 筛去等待时间小于1或大于300的数据
-# 3. 筛去next_nds_id为0的数据
-# 4. 筛去stop_time等于travel_time的数据
-
-# 方法2：
-# 1. 筛选出16:00-17:00之间的数据
-# 2. 筛去next_nds_id为0的数据
-# 3. 筛去stop_time等于travel_time的数据
-
-import pandas as pd
-from datetime import datetime, timedelta
+# 按离开时间窗口筛选轨迹数据，方法1和方法2的筛选条件见trajectory_filters.FILTER_PROFILES
+# 用法：
+#   python filter_trajectory_by_time.py --method method1
+#   python filter_trajectory_by_time.py --method method2 --start 16:00:00 --end 17:00:00
+#   python filter_trajectory_by_time.py --method method1 --workers 32
+
+import argparse
 import os
+from functools import partial
+
+from data_schema import FILTERED_TRAJECTORY_COLUMNS, TRAJECTORY_COLUMNS, read_trajectory
+from trajectory_filters import FILTER_PROFILES, exit_seconds_of_day, filter_mask, parse_clock, to_local_datetime
+
+
+def default_output_file(profile, window_start, window_end):
+    """根据时间窗口和筛选方案生成输出文件名，如data/filtered_trajectory_16_17_method1.txt"""
+    start_hour = window_start // 3600
+    end_hour = window_end // 3600
+    return f'data/filtered_trajectory_{start_hour}_{end_hour}{profile.output_suffix}.txt'
+
+
+def filter_chunk(chunk, profile, window_start, window_end):
+    """筛选一个数据块，返回(原始行数, 筛选结果)"""
+    filtered_chunk = chunk[filter_mask(chunk, profile, window_start, window_end)].copy()
+    # 离开时间换算为北京时间当天的秒数，后续步骤直接使用，不再解析时间字符串
+    filtered_chunk['exit_seconds'] = exit_seconds_of_day(filtered_chunk)
+
+    # 只对保留下来的数据转换时间格式 - 将UTC时间戳转换为北京时间
+    filtered_chunk['enter_time'] = to_local_datetime(filtered_chunk['enter_time'])
+    return len(chunk), filtered_chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按离开时间窗口筛选轨迹数据')
+    parser.add_argument('--method', choices=sorted(FILTER_PROFILES), default='method1', help='筛选方案')
+    parser.add_argument('--start', default='16:00:00', help='时间窗口起点（含）')
+    parser.add_argument('--end', default='17:00:00', help='时间窗口终点（含）')
+    parser.add_argument('--input', default='data/trajectory_20250329.txt', help='原始轨迹文件')
+    parser.add_argument('--dataset', default=None,
+                        help='Parquet数据集目录（见trajectory_store.py），指定后只读取窗口涉及的小时分区')
+    parser.add_argument('--output', default=None, help='输出文件，默认根据窗口和方案生成')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='每次读取的行数')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='并行解析原始文件的进程数（见parallel_reader.py），1为单进程')
+    args = parser.parse_args()
+
+    profile = FILTER_PROFILES[args.method]
+    window_start = parse_clock(args.start)
+    window_end = parse_clock(args.end)
+    output_file = args.output or default_output_file(profile, window_start, window_end)
+
+    # 如果输出文件已存在，先删除
+    if os.path.exists(output_file):
+        os.remove(output_file)
+
+    # 先写入表头
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write('\t'.join(FILTERED_TRAJECTORY_COLUMNS) + '\n')
+
+    process = partial(filter_chunk, profile=profile, window_start=window_start, window_end=window_end)
+    if args.dataset:
+        # 从Parquet数据集中只读取窗口涉及的小时分区
+        from trajectory_store import iter_trajectory_batches, window_hours
+        chunks = iter_trajectory_batches(args.dataset, columns=TRAJECTORY_COLUMNS,
+                                         hours=window_hours(window_start, window_end),
+                                         batch_size=args.chunk_size)
+        results = map(process, chunks)
+    elif args.workers > 1:
+        # 按字节范围切分原始文件，多进程解析和筛选，结果按文件顺序返回
+        from parallel_reader import parallel_map_ranges
+        results = parallel_map_ranges(args.input, process, workers=args.workers)
+    else:
+        # 使用pandas的chunk读取大文件，列类型见data_schema.TRAJECTORY_DTYPES
+        results = map(process, read_trajectory(args.input, chunksize=args.chunk_size))
+
+    for chunk_rows, filtered_chunk in results:
+        # 将筛选后的数据追加到输出文件
+        filtered_chunk.to_csv(output_file,
+                              mode='a',
+                              header=False,
+                              index=False,
+                              sep='\t')
+
+        print(f"已处理 {chunk_rows} 行数据，找到 {len(filtered_chunk)} 条符合条件的记录")
+
+    print(f"数据处理完成！结果已保存到 {output_file}")
+
 
-def parse_time(time_str):
-    """将UFC格式的时间字符串转换为datetime对象"""
-    return datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S')
-
-def is_time_in_range(enter_time, travel_time):
-    """检查离开时间是否严格在16:00-17:00之间"""
-    end_time = enter_time + timedelta(seconds=travel_time)
-    # 检查是否在16:00:00到17:00:00之间
-    return (end_time.hour == 16 and end_time.minute >= 0 and end_time.second >= 0) or \
-           (end_time.hour == 17 and end_time.minute == 0 and end_time.second == 0)
-
-# 读取文件
-chunk_size = 100000  # 每次读取的行数
-output_file = 'data/filtered_trajectory_16_17_method1.txt'
-#output_file = 'data/filtered_trajectory_16_17.txt'
-
-# 如果输出文件已存在，先删除
-if os.path.exists(output_file):
-    os.remove(output_file)
-
-# 定义列名
-column_names = ['adcode', 'nds_id', 'enter_time', 'exit_turn', 'travel_time', 'stop_time', 
-                'link_length', 'road_class', 'cover_percent', 'no_stop_speed', 'avg_speed',
-                'traffic_kmph', 'stop_length', 'next_nds_id', 'ds_code', 'user_id', 'device_id',
-                'start_time', 'intersection_time', 'new_route_flag', 'offset_info', 'stop_info',
-                'match_points_info', 'pre_nds_id', 'link_width', 'formway', 'ownership_type',
-                'navi_info', 'flag', 'province', 'ds']
-
-# 先写入表头
-with open(output_file, 'w', encoding='utf-8') as f:
-    f.write('\t'.join(column_names) + '\n')
-
-# 使用pandas的chunk读取大文件
-for chunk in pd.read_csv('data/trajectory_20250329.txt', 
-                        sep='\t',  # 使用制表符分隔
-                        chunksize=chunk_size,
-                        header=0,  # 第一行是表头
-                        names=column_names,
-                        dtype={'enter_time': 'int64'},  # 指定enter_time为整数类型
-                        low_memory=False):  # 避免混合类型警告
-    
-    # 转换时间格式 - 将UTC时间戳转换为datetime
-    chunk['enter_time'] = pd.to_datetime(chunk['enter_time'], unit='s', utc=True).dt.tz_convert('Asia/Shanghai')
-    
-    # 筛选条件：
-    # 1. next_nds_id不为空
-    # 2. 离开时间严格在16:00:00到17:00:00之间
-    # 3. 通过时间不能等于等待时间
-    # 5. 筛去等待时间小于1或大于600的数据
-    filtered_chunk = chunk[
-        (chunk['next_nds_id']!=0) & (chunk['stop_time'] != chunk['travel_time']) &
-        chunk.apply(lambda x: is_time_in_range(x['enter_time'], x['travel_time']), axis=1) &
-        (chunk['stop_time'] > 1) & (chunk['stop_time'] < 600)
-    ]
-    
-    # 将筛选后的数据追加到输出文件
-    filtered_chunk.to_csv(output_file, 
-                         mode='a', 
-                         header=False, 
-                         index=False, 
-                         sep='\t')
-    
-    print(f"已处理 {len(chunk)} 行数据，找到 {len(filtered_chunk)} 条符合条件的记录")
-
-print("数据处理完成！") 
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+# 单次扫描完成轨迹数据的三步筛选：
+# 1. 时间窗口和方法条件（同filter_trajectory_by_time.py）
+# 2. nds_id在filtered_links_cleaned.json中（同filter_trajectory_by_link.py）
+# 3. nds_id在merged_16h_timing_data.txt中（同filter_trajectory_by_light.py）
+# 原始文件只解析一次，中间结果不再落盘。
+# 用法：
+#   python filter_trajectory_pipeline.py --method method1
+#   python filter_trajectory_pipeline.py --method method1 --workers 32
+#   python filter_trajectory_pipeline.py --method method1 --data-dir data/raw
+# 指定--data-dir时按天处理（见data_partitions.py）：只处理新到的日期，按天输出到data/days/day=YYYYMMDD/，
+# 再把其中一天（--day，默认为最新的日期）的输出复制到data/下的同名文件，后续脚本不需要修改。
+# 各天的exit_seconds都是当天的秒数，后续的推测阶段一次只支持一天的数据，不把多天的输出拼接在一起。
+# 筛选条件、源码或路段、配时文件变化后，所有日期都会重新处理（见stage_key）。
+
+import argparse
+import json
+import os
+from functools import partial
+
+from data_partitions import (copy_day_output, discover_days, discover_partition_days, mark_day_processed,
+                             pending_days, reset_day_dir, trajectory_file)
+from data_schema import FILTERED_TRAJECTORY_COLUMNS, TRAJECTORY_COLUMNS, read_timing, read_trajectory
+from pipeline_stages import FileHashCache, Stage, stage_fingerprint
+from trajectory_filters import FILTER_PROFILES, exit_seconds_of_day, filter_mask, parse_clock, to_local_datetime
+
+
+def load_link_ids(links_file):
+    """读取filtered_links_cleaned.json中的所有nds_id"""
+    with open(links_file, 'r', encoding='utf-8') as f:
+        links_data = json.load(f)
+    return {int(link['nds_id']) for link in links_data}
+
+
+def load_light_ids(timing_file):
+    """读取信号灯配时数据中的所有nds_id"""
+    timing_data = read_timing(timing_file, columns=['nds_id'], merged=True)
+    return set(timing_data['nds_id'].dropna().unique())
+
+
+def output_files(profile, window_start, window_end, output_dir='data'):
+    """生成保留数据和被筛除数据的输出文件名，与分步脚本的输出保持一致"""
+    window = f'{window_start // 3600}_{window_end // 3600}'
+    suffix = profile.output_suffix
+    return {
+        'kept': os.path.join(output_dir, f'filtered_trajectory_{window}_by_light{suffix}.txt'),
+        'removed_by_link': os.path.join(output_dir, f'filtered_trajectory_{window}_removed_by_link{suffix}.txt'),
+        'removed_by_light': os.path.join(output_dir, f'filtered_trajectory_{window}_removed_by_light{suffix}.txt'),
+    }
+
+
+def _to_output(rows):
+    """增加exit_seconds并将enter_time转换为北京时间，与分步脚本的输出格式一致"""
+    rows = rows.copy()
+    rows['exit_seconds'] = exit_seconds_of_day(rows)
+    rows['enter_time'] = to_local_datetime(rows['enter_time'])
+    return rows
+
+
+def split_chunk(chunk, profile, window_start, window_end, link_ids, light_ids):
+    """对一个数据块执行三步筛选，返回(原始行数, 时间窗口内行数, 保留, 按路段筛除, 按信号灯筛除)"""
+    in_window = chunk[filter_mask(chunk, profile, window_start, window_end)]
+    link_mask = in_window['nds_id'].isin(link_ids).to_numpy()
+    light_mask = in_window['nds_id'].isin(light_ids).to_numpy()
+
+    kept = _to_output(in_window[link_mask & light_mask])
+    removed_by_link = _to_output(in_window[~link_mask])
+    removed_by_light = _to_output(in_window[link_mask & ~light_mask])
+    return len(chunk), len(in_window), kept, removed_by_link, removed_by_light
+
+
+def read_chunks(input_file, chunk_size, dataset_dir=None, hours=None, day=None):
+    """分块读取轨迹数据，指定dataset_dir时从Parquet数据集读取对应的小时分区（和日期分区）"""
+    if dataset_dir:
+        from trajectory_store import iter_trajectory_batches
+        return iter_trajectory_batches(dataset_dir, columns=TRAJECTORY_COLUMNS, hours=hours,
+                                       batch_size=chunk_size, days=[day] if day else None)
+    return read_trajectory(input_file, chunksize=chunk_size)
+
+
+def run_pipeline(input_file, outputs, profile, window_start, window_end,
+                 link_ids, light_ids, chunk_size=100000, dataset_dir=None, workers=1, day=None):
+    """流式执行三步筛选，返回各步骤的统计数量"""
+    process = partial(split_chunk, profile=profile, window_start=window_start, window_end=window_end,
+                      link_ids=link_ids, light_ids=light_ids)
+    if dataset_dir:
+        from trajectory_store import window_hours
+        results = map(process, read_chunks(input_file, chunk_size, dataset_dir,
+                                           window_hours(window_start, window_end), day))
+    elif workers > 1:
+        # 按字节范围切分原始文件，多进程解析和筛选，结果按文件顺序返回
+        from parallel_reader import parallel_map_ranges
+        results = parallel_map_ranges(input_file, process, workers=workers)
+    else:
+        results = map(process, read_chunks(input_file, chunk_size))
+
+    stats = {'total': 0, 'in_window': 0, 'removed_by_link': 0, 'removed_by_light': 0, 'kept': 0}
+    handles = {key: open(path, 'w', encoding='utf-8') for key, path in outputs.items()}
+    try:
+        for f in handles.values():
+            f.write('\t'.join(FILTERED_TRAJECTORY_COLUMNS) + '\n')
+
+        for chunk_rows, in_window_rows, kept, removed_by_link, removed_by_light in results:
+            kept.to_csv(handles['kept'], header=False, index=False, sep='\t')
+            removed_by_link.to_csv(handles['removed_by_link'], header=False, index=False, sep='\t')
+            removed_by_light.to_csv(handles['removed_by_light'], header=False, index=False, sep='\t')
+
+            stats['total'] += chunk_rows
+            stats['in_window'] += in_window_rows
+            stats['removed_by_link'] += len(removed_by_link)
+            stats['removed_by_light'] += len(removed_by_light)
+            stats['kept'] += len(kept)
+            print(f"已处理 {stats['total']} 行数据，保留 {stats['kept']} 条记录")
+    finally:
+        for f in handles.values():
+            f.close()
+    return stats
+
+
+def stage_key(args, profile, window_start, window_end):
+    """
+    按天处理记录中的阶段名，包含与run_pipeline.py相同的指纹（见pipeline_stages.py）：筛选条件、源码和输入文件（路段、配时）的内容
+    任何一项变化后阶段名随之变化，已处理的日期需要重新处理
+    """
+    stage = Stage(f'filter_{profile.name}_{window_start}_{window_end}', os.path.basename(__file__),
+                  inputs=[args.links, args.timing], outputs=[],
+                  args=['--method', profile.name, '--start', str(window_start), '--end', str(window_end)])
+    return f'{stage.name}_{stage_fingerprint(stage, FileHashCache())[:16]}'
+
+
+def run_new_days(args, profile, window_start, window_end, link_ids, light_ids):
+    """按天处理还没有处理过的日期，并把选定日期的输出写入data/下的同名文件"""
+    stage = stage_key(args, profile, window_start, window_end)
+    if args.dataset:
+        days = discover_partition_days(args.dataset)
+    else:
+        days = discover_days(args.data_dir)
+    os.makedirs(args.days_dir, exist_ok=True)
+    new_days = pending_days(args.days_dir, stage, days)
+    print(f"共 {len(days)} 天数据，其中 {len(new_days)} 天需要处理")
+
+    for day in new_days:
+        outputs = output_files(profile, window_start, window_end, reset_day_dir(args.days_dir, day))
+        stats = run_pipeline(trajectory_file(args.data_dir, day) if args.data_dir else None, outputs, profile,
+                             window_start, window_end, link_ids, light_ids, args.chunk_size, args.dataset,
+                             args.workers, day)
+        mark_day_processed(args.days_dir, stage, day, stats)
+        print(f"{day} 处理完成，保留 {stats['kept']} 条记录")
+
+    # 后续阶段一次只处理一天：把选定日期的输出复制到data/下的同名文件
+    processed_days = [day for day in days if day not in pending_days(args.days_dir, stage, days)]
+    day = args.day or (processed_days[-1] if processed_days else None)
+    if day not in processed_days:
+        raise ValueError(f'日期 {day} 没有处理过，已处理的日期: {processed_days}')
+    combined = output_files(profile, window_start, window_end)
+    for key, path in combined.items():
+        copy_day_output(args.days_dir, os.path.basename(path), path, day)
+    print(f"已将 {day} 的输出写入 {combined['kept']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='单次扫描完成轨迹数据的时间、路段、信号灯筛选')
+    parser.add_argument('--method', choices=sorted(FILTER_PROFILES), default='method1', help='筛选方案')
+    parser.add_argument('--start', default='16:00:00', help='时间窗口起点（含）')
+    parser.add_argument('--end', default='17:00:00', help='时间窗口终点（含）')
+    parser.add_argument('--input', default='data/trajectory_20250329.txt', help='原始轨迹文件')
+    parser.add_argument('--dataset', default=None,
+                        help='Parquet数据集目录（见trajectory_store.py），指定后只读取窗口涉及的小时分区')
+    parser.add_argument('--data-dir', default=None,
+                        help='按日期存放原始轨迹文件的目录（见data_partitions.py），指定后只处理新到的日期')
+    parser.add_argument('--days-dir', default='data/days', help='按天输出的目录')
+    parser.add_argument('--day', default=None,
+                        help='按天处理时写入data/下的日期（YYYYMMDD），默认为最新的日期')
+    parser.add_argument('--links', default='data/filtered_links_cleaned.json', help='路段筛选文件')
+    parser.add_argument('--timing', default='data/merged_16h_timing_data.txt', help='信号灯配时文件')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='每次读取的行数')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='并行解析原始文件的进程数（见parallel_reader.py），1为单进程')
+    args = parser.parse_args()
+
+    profile = FILTER_PROFILES[args.method]
+    window_start = parse_clock(args.start)
+    window_end = parse_clock(args.end)
+
+    link_ids = load_link_ids(args.links)
+    print(f"valid_nds_ids的数量: {len(link_ids)}")
+    light_ids = load_light_ids(args.timing)
+    print(f"信号灯数据包含 {len(light_ids)} 个唯一的nds_id")
+
+    if args.data_dir or (args.dataset and discover_partition_days(args.dataset)):
+        run_new_days(args, profile, window_start, window_end, link_ids, light_ids)
+        return
+
+    outputs = output_files(profile, window_start, window_end)
+    stats = run_pipeline(args.input, outputs, profile, window_start, window_end,
+                         link_ids, light_ids, args.chunk_size, args.dataset, args.workers)
+
+    print(f"\n原始数据: {stats['total']} 条")
+    print(f"时间窗口内: {stats['in_window']} 条")
+    print(f"按路段筛除: {stats['removed_by_link']} 条")
+    print(f"按信号灯筛除: {stats['removed_by_light']} 条")
+    print(f"处理完成！筛选后的数据包含 {stats['kept']} 条记录，已保存到 {outputs['kept']}")
+
+
+if __name__ == '__main__':
+    main()
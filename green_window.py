@@ -0,0 +1,218 @@
+"""
+在信号周期内搜索覆盖车辆最多的绿灯窗口
+
+车辆离开时间先换算为相对于周期的时间，窗口[start, (start + green_time) % cycle_length]
+在周期内按step滑动（窗口终点小于等于起点时跨越周期）。
+把相对时间排序后计算前缀和，每个起点覆盖的车辆数和覆盖点的时间之和都由
+窗口两端在排序数组中的位置直接得到，不再对每个起点重新遍历所有车辆，
+因此step取小于1秒的值时也只增加起点个数，不改变每个起点的计算量。
+
+覆盖数相同时的取舍与逐秒搜索的规则一致：
+覆盖数创新高的起点先被记录，之后覆盖数相同的起点中，
+选覆盖点的平均位置离窗口中心最近的一个（距离相同时取最早的）。
+
+find_green_start处理单个转向；find_green_starts把周期和绿灯时长相同的转向放在一起，
+所有转向共用同一组窗口，把每个转向的离开时间按窗口起点和终点划分为直方图并累加，
+以(转向 × 起点)矩阵一次算出所有转向的覆盖数和结果，两者结果相同。
+find_green_start_from_histogram的输入为周期内的直方图而不是每辆车的离开时间，
+用于只保存直方图的在线估计（见online_green_start.py）。
+"""
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+# 批量计算时每块矩阵的最大元素数，限制内存占用
+DEFAULT_MAX_CELLS = 4 * 1024 * 1024
+
+
+def _window_starts(cycle_length: float, step: float) -> np.ndarray:
+    # 步长小于1秒时去掉arange累积的浮点误差
+    return np.round(np.arange(0, cycle_length, step), 6)
+
+
+def _coverage(lo, hi, starts, ends, n_points, prefix_at, prefix_total, count_at=None):
+    """
+    由窗口两端的位置计算覆盖数和覆盖点的平均位置，prefix_at(i)为前i个点的时间之和
+    count_at(i)为前i个位置的车辆数，为None时每个位置一辆车（位置即为车辆的下标）
+    """
+    # 终点大于起点时窗口不跨越周期：[start, end]；否则覆盖[start, 周期末尾)和[0, end]，
+    # 终点等于起点时两段在起点处重合，只计一次；绿灯时长缺失时终点为nan，只覆盖[start, 周期末尾)
+    inside = ends > starts
+    hi = np.where(np.isnan(ends), 0, hi)
+    hi = np.where(inside, hi, np.minimum(hi, lo))
+    if count_at is None:
+        counts = np.where(inside, hi - lo, n_points - lo + hi)
+    else:
+        counts = np.where(inside, count_at(hi) - count_at(lo), n_points - count_at(lo) + count_at(hi))
+    sums = np.where(inside, prefix_at(hi) - prefix_at(lo), prefix_total - prefix_at(lo) + prefix_at(hi))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    return counts, means
+
+
+def window_coverage(relative_times: np.ndarray, cycle_length: float, green_time: float,
+                    step: float = 1) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    计算每个窗口起点覆盖的车辆数和覆盖点的平均位置
+    返回(起点, 覆盖数, 覆盖点平均位置)，没有覆盖点时平均位置为nan
+    """
+    times = np.sort(np.asarray(relative_times, dtype=np.float64))
+    prefix = np.concatenate(([0.0], np.cumsum(times)))
+    starts = _window_starts(cycle_length, step)
+    ends = (starts + green_time) % cycle_length
+
+    # 起点之前和终点及之前的车辆数
+    lo = np.searchsorted(times, starts, side='left')
+    hi = np.searchsorted(times, ends, side='right')
+    counts, means = _coverage(lo, hi, starts, ends, len(times), lambda i: prefix[i], prefix[-1])
+    return starts, counts, means
+
+
+def histogram_coverage(bin_counts: np.ndarray, bin_sums: np.ndarray, bin_width: float, cycle_length: float,
+                       green_time: float, step: float = 1) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    与window_coverage相同，但车辆按周期内的直方图给出：第k个箱为[k * bin_width, (k + 1) * bin_width)，
+    bin_counts为每个箱的车辆数，bin_sums为每个箱内车辆相对时间之和。
+    判断是否在窗口内时箱内的车辆按位于箱的左端处理，离开时间为整秒、周期为整数且箱宽为1秒时与window_coverage相同
+    """
+    edges = _window_starts(cycle_length, bin_width)[:len(bin_counts)]
+    count_prefix = np.concatenate(([0], np.cumsum(bin_counts)))
+    sum_prefix = np.concatenate(([0.0], np.cumsum(bin_sums)))
+    starts = _window_starts(cycle_length, step)
+    ends = (starts + green_time) % cycle_length
+
+    # 起点之前和终点及之前的箱数
+    lo = np.searchsorted(edges, starts, side='left')
+    hi = np.searchsorted(edges, ends, side='right')
+    counts, means = _coverage(lo, hi, starts, ends, count_prefix[-1], lambda i: sum_prefix[i], sum_prefix[-1],
+                              lambda i: count_prefix[i])
+    return starts, counts, means
+
+
+def _pick_starts(starts, counts, means, cycle_length, green_times):
+    """
+    按覆盖数和居中程度为每一行选出绿灯开始时间的下标
+    counts/means为(行数 × 起点数)矩阵，返回(起点下标, 覆盖数)
+    """
+    max_covered = counts.max(axis=1)
+    # 覆盖数第一次达到最大值的起点
+    first = counts.argmax(axis=1)
+    # 之后覆盖数相同的起点按覆盖点平均位置与窗口中心的循环距离取舍
+    ties = ((counts == max_covered[:, None]) & (np.arange(len(starts)) > first[:, None])
+            & (max_covered[:, None] > 0))
+    window_center = (starts[None, :] + green_times[:, None] / 2) % cycle_length
+    offset = np.abs(means - window_center)
+    distance = np.where(ties, np.minimum(offset, cycle_length - offset), np.inf)
+    best = np.where(ties.any(axis=1), np.argmin(distance, axis=1), first)
+    return best, max_covered
+
+
+def find_green_start(relative_times: np.ndarray, cycle_length: float, green_time: float,
+                     step: float = 1) -> Tuple[float, int]:
+    """返回(最佳绿灯开始时间, 覆盖的车辆数)"""
+    starts, counts, means = window_coverage(relative_times, cycle_length, green_time, step)
+    if len(starts) == 0:
+        return 0, 0
+    best, max_covered = _pick_starts(starts, counts[None, :], means[None, :], cycle_length,
+                                     np.asarray([green_time]))
+    return starts[best[0]], int(max_covered[0])
+
+
+def find_green_start_from_histogram(bin_counts: np.ndarray, bin_sums: np.ndarray, bin_width: float,
+                                    cycle_length: float, green_time: float, step: float = 1) -> Tuple[float, int]:
+    """按直方图（见histogram_coverage）返回(最佳绿灯开始时间, 覆盖的车辆数)"""
+    starts, counts, means = histogram_coverage(bin_counts, bin_sums, bin_width, cycle_length, green_time, step)
+    if len(starts) == 0:
+        return 0, 0
+    best, max_covered = _pick_starts(starts, counts[None, :], means[None, :], cycle_length,
+                                     np.asarray([green_time]))
+    return starts[best[0]], int(max_covered[0])
+
+
+def _start_positions(point_rows, point_values, starts, m):
+    """
+    各行中小于每个起点的点数：各行的起点相同，把点按起点划分为直方图后累加即可得到
+    """
+    bins = np.searchsorted(starts, point_values, side='right')
+    hist = np.bincount(point_rows * (len(starts) + 1) + bins, minlength=m * (len(starts) + 1))
+    return np.cumsum(hist.reshape(m, -1), axis=1)[:, :len(starts)]
+
+
+def _end_positions(point_rows, point_values, ends, m):
+    """
+    各行中小于等于每个终点的点数：各行的终点相同（但跨越周期处不递增），
+    先把终点排序，按排序后的终点划分直方图并累加，再还原为原来的顺序
+    """
+    order = np.argsort(ends, kind='stable')
+    bins = np.searchsorted(ends[order], point_values, side='left')
+    hist = np.bincount(point_rows * (len(ends) + 1) + bins, minlength=m * (len(ends) + 1))
+    positions = np.empty((m, len(ends)), dtype=np.int64)
+    positions[:, order] = np.cumsum(hist.reshape(m, -1), axis=1)[:, :len(ends)]
+    return positions
+
+
+def _block_green_starts(offsets, exit_seconds, rows, cycle_length, green_time, step):
+    """计算一块周期和绿灯时长都相同的转向的结果"""
+    n = offsets[rows + 1] - offsets[rows]
+    m = len(rows)
+    point_rows = np.repeat(np.arange(m), n)
+    rank = np.arange(len(point_rows)) - np.repeat(np.cumsum(n) - n, n)
+    times = exit_seconds[np.repeat(offsets[rows], n) + rank] % cycle_length
+    times = times[np.lexsort((times, point_rows))]
+
+    # 每行的前缀和（按行补零对齐），与单个转向的累加顺序相同
+    padded = np.zeros((m, n.max()))
+    padded[point_rows, rank] = times
+    prefix = np.zeros((m, padded.shape[1] + 1))
+    np.cumsum(padded, axis=1, out=prefix[:, 1:])
+    row_index = np.arange(m)[:, None]
+
+    # 起点和终点对所有行相同，覆盖数由直方图累加得到
+    starts = _window_starts(cycle_length, step)
+    ends = (starts + green_time) % cycle_length
+    lo = _start_positions(point_rows, times, starts, m)
+    hi = _end_positions(point_rows, times, ends, m)
+    counts, means = _coverage(lo, hi, starts[None, :], ends[None, :], n[:, None],
+                              lambda i: prefix[row_index, i], prefix[np.arange(m), n][:, None])
+    best, max_covered = _pick_starts(starts, counts, means, cycle_length, np.full(m, green_time))
+    return starts[best], max_covered
+
+
+def find_green_starts(offsets: np.ndarray, exit_seconds: np.ndarray, cycle_lengths: np.ndarray,
+                      green_times: np.ndarray, step: float = 1,
+                      max_cells: int = DEFAULT_MAX_CELLS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    批量推测多个转向的绿灯开始时间
+    offsets/exit_seconds: CSR方式保存的各转向离开时间（北京时间当天的秒数，见movement_store.py）
+    cycle_lengths/green_times: 每个转向的周期和绿灯时长
+    返回(最佳绿灯开始时间, 覆盖的车辆数)两个数组
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_rows = len(offsets) - 1
+    best_starts = np.zeros(n_rows)
+    max_covered = np.zeros(n_rows, dtype=np.int64)
+    sizes = np.diff(offsets)
+    # 周期和绿灯时长相同的转向共用同一组窗口
+    groups = pd.DataFrame({'cycle': cycle_lengths, 'green': green_times}).groupby(
+        ['cycle', 'green'], dropna=False, sort=False).indices
+    for group in groups.values():
+        cycle_length = cycle_lengths[group[0]]
+        green_time = green_times[group[0]]
+        n_starts = len(_window_starts(cycle_length, step))
+        if n_starts == 0:
+            continue
+        # 按车辆数排序后分块，减少前缀和矩阵的补零，每块的矩阵元素数不超过max_cells
+        group = group[np.argsort(sizes[group], kind='stable')]
+        width = np.maximum(sizes[group], n_starts)
+        begin = 0
+        while begin < len(group):
+            # 块内最后一行最宽，块的行数为max_cells除以最后一行的宽度
+            end = begin + 1
+            while end < len(group) and (end - begin + 1) * width[end] <= max_cells:
+                end += 1
+            rows = group[begin:end]
+            best_starts[rows], max_covered[rows] = _block_green_starts(
+                offsets, exit_seconds, rows, cycle_length, green_time, step)
+            begin = end
+    return best_starts, max_covered
@@ -0,0 +1,68 @@
+"""
+按组近似统计不同值的数量（HyperLogLog）
+
+每组保存2^precision个寄存器（每个1字节），值经64位哈希后，高precision位选择寄存器，
+寄存器记录其余位中第一个1出现的位置的最大值，由所有寄存器估计不同值的数量。
+内存只与组数和precision有关，与数据量无关，数据可以分块加入；多个组的寄存器逐个取最大值即为合并后的寄存器。
+precision为14时相对标准误差约为1.04 / sqrt(2^14) ≈ 0.8%。
+
+    counter = GroupedHyperLogLog(n_groups=25)
+    for chunk in chunks:
+        counter.add(chunk_groups, chunk['nds_id'].to_numpy())
+    per_group = counter.estimate()
+    total = counter.estimate(counter.registers.max(axis=0, keepdims=True))[0]
+"""
+from typing import Optional
+
+import numpy as np
+
+DEFAULT_PRECISION = 14
+
+
+def hash64(values: np.ndarray) -> np.ndarray:
+    """整数值的64位哈希（splitmix64），相同的值得到相同的哈希"""
+    x = np.asarray(values).astype(np.int64).view(np.uint64)
+    with np.errstate(over='ignore'):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    """uint64的有效位数，高低32位分别转换为浮点数，保证精确"""
+    high = (x >> np.uint64(32)).astype(np.float64)
+    low = (x & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, np.frexp(high)[1] + 32, np.frexp(low)[1])
+
+
+class GroupedHyperLogLog:
+    """
+    每组一个HyperLogLog
+    registers[g, k]为第g组第k个寄存器的值
+    """
+
+    def __init__(self, n_groups: int, precision: int = DEFAULT_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros((n_groups, 1 << precision), dtype=np.uint8)
+
+    def add(self, groups: np.ndarray, values: np.ndarray):
+        """加入一批值，groups为每个值所属的组（0 ~ n_groups-1）"""
+        hashes = hash64(values)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        # 其余位左移到最高位，最低处补1使位置不超过64 - precision + 1
+        rest = (hashes << np.uint64(self.precision)) | np.uint64(1 << (self.precision - 1))
+        rank = (65 - _bit_length(rest)).astype(np.uint8)
+        np.maximum.at(self.registers, (np.asarray(groups, dtype=np.int64), index), rank)
+
+    def estimate(self, registers: Optional[np.ndarray] = None) -> np.ndarray:
+        """每组不同值数量的估计，空寄存器较多时使用线性计数"""
+        if registers is None:
+            registers = self.registers
+        m = registers.shape[1]
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)), axis=1)
+        zeros = np.count_nonzero(registers == 0, axis=1)
+        with np.errstate(divide='ignore'):
+            linear = m * np.log(m / np.maximum(zeros, 1))
+        return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
@@ -1,12 +1,22 @@
-import pandas as pd
+import argparse
+
 import numpy as np
-from datetime import datetime
+import pandas as pd
 import matplotlib.pyplot as plt
 
+from data_schema import read_timing
+from green_window import find_green_start, find_green_starts
+from inter_shards import map_shards, split_by_inter_id
+from movement_store import load_movements
+from timing_index import timing_index
+
 # 设置中文字体
 plt.rcParams['font.sans-serif'] = ['SimHei']  # 用来正常显示中文标签
 plt.rcParams['axes.unicode_minus'] = False  # 用来正常显示负号
 
+# 本步骤需要的配时数据列
+TIMING_COLUMNS = ['inter_id', 'nds_id', 'dir', 'way', 'cycle_time', 'green_time']
+
 def map_exit_turn_to_dir(exit_turn):
     """
     将exit_turn映射到dir值
@@ -25,112 +35,161 @@ def map_exit_turn_to_dir(exit_turn):
     else:
         return None
 
-def analyze_light_cycle(trajectory_data, cycle_data):
+def match_cycle_data(trajectory_data, cycle_data):
+    """
+    为每个转向找到对应的信号灯周期数据（按(nds_id, dir)索引批量查找，取第一条匹配记录）
+    返回匹配到的转向：(转向下标, 结果中的基本字段)
     """
-    分析轨迹数据在信号周期内的分布
-    trajectory_data: 处理后的轨迹数据
+    columns = trajectory_data.columns
+    keys = pd.DataFrame({
+        'nds_id': columns['nds_id'],
+        'dir': pd.Series([map_exit_turn_to_dir(exit_turn) for exit_turn in columns['exit_turn']], dtype=object),
+    })
+    positions = timing_index(cycle_data).positions(keys)
+
+    matched = []
+    for i in np.flatnonzero(positions >= 0):
+        position = positions[i]
+        row = {
+            'inter_id': cycle_data['inter_id'].iloc[position],
+            'nds_id': columns['nds_id'][i],
+            'next_nds_id': columns['next_nds_id'][i],
+            'dir': keys['dir'][i],
+            'cycle_length': cycle_data['cycle_time'].iloc[position],
+            'green_time': cycle_data['green_time'].iloc[position],
+            'way': cycle_data['way'].iloc[position]
+        }
+        matched.append((int(i), row))
+    return matched
+
+def _result_row(row, best_start, max_covered, vehicle_count):
+    return {
+        'inter_id': row['inter_id'],
+        'nds_id': row['nds_id'],
+        'next_nds_id': row['next_nds_id'],
+        'dir': row['dir'],
+        'cycle_length': row['cycle_length'],
+        'inferred_green_start': best_start,
+        'green_time': row['green_time'],
+        'vehicle_count': vehicle_count,
+        'covered_vehicles': max_covered,
+        'coverage_rate': max_covered / vehicle_count,  # 覆盖率
+        'way': row['way']
+    }
+
+def analyze_light_cycle(trajectory_data, cycle_data, resolution=1):
+    """
+    分析轨迹数据在信号周期内的分布，逐个转向搜索
+    trajectory_data: 按转向聚合的轨迹数据（movement_store.MovementStore）
     cycle_data: 信号灯周期数据
+    resolution: 绿灯开始时间的搜索步长（秒），可以小于1
     """
-    # 将离开时间转换为秒数（相对于周期）
-    def get_relative_time(exit_times_str, cycle_length):
-        # 使用ISO8601格式解析时间
-        exit_times = pd.to_datetime(exit_times_str.split(','), format='ISO8601')
-        # 计算相对于周期的秒数
-        seconds = [(t.hour * 3600 + t.minute * 60 + t.second) % cycle_length for t in exit_times]
-        return seconds
-    
     results = []
-    for _, row in trajectory_data.iterrows():
-        nds_id = row['nds_id']
-        next_nds_id = row['next_nds_id']
-        dir_val = map_exit_turn_to_dir(row['exit_turn'])
+    for i, row in match_cycle_data(trajectory_data, cycle_data):
+        # 计算相对于周期的秒数，离开时间为北京时间当天的秒数
+        relative_times = trajectory_data.exit_seconds_of(i) % row['cycle_length']
         
-        # 获取对应的信号灯周期数据
-        cycle_info = cycle_data[(cycle_data['nds_id'] == nds_id) & 
-                              (cycle_data['dir'] == dir_val)]
-        
-        if not cycle_info.empty:
-            inter_id = cycle_info['inter_id'].iloc[0]
-            cycle_length = cycle_info['cycle_time'].iloc[0]
-            green_time = cycle_info['green_time'].iloc[0]
-            way = cycle_info['way'].iloc[0]
-            
-            # 计算相对时间
-            relative_times = get_relative_time(row['exit_time'], cycle_length)
-            
-            # 在周期内滑动窗口，寻找最佳绿灯开始时间
-            best_start = 0
-            max_covered = 0
-            best_distance = float('inf')  # 初始化为无穷大
-            
-            # 以0.1秒为步长滑动窗口
-            for start in np.arange(0, cycle_length, 1):
-                # 计算窗口结束时间（考虑周期循环）
-                end = (start + green_time) % cycle_length
-                
-                # 计算在窗口内的车辆数量
-                if end > start:
-                    # 正常情况：窗口不跨越周期
-                    covered = sum(1 for t in relative_times if start <= t <= end)
-                else:
-                    # 窗口跨越周期的情况
-                    covered = sum(1 for t in relative_times if t >= start or t <= end)
-                
-                if covered > max_covered:
-                    max_covered = covered
-                    best_start = start
-                    best_distance = float('inf')  # 重置为无穷大
-                elif covered == max_covered and covered > 0:
-                    # 如果覆盖度相同，则覆盖的数据点处于中间越好
-                    # 计算当前窗口内覆盖点的平均位置
-                    if end > start:
-                        # 正常情况：窗口不跨越周期
-                        covered_points = [t for t in relative_times if start <= t <= end]
-                    else:
-                        # 窗口跨越周期的情况
-                        covered_points = [t for t in relative_times if t >= start or t <= end]
-                    
-                    # 计算覆盖点的平均位置
-                    avg_position = np.mean(covered_points)
-                    # 计算窗口中心点
-                    window_center = (start + green_time/2) % cycle_length
-                    # 计算与窗口中心的距离
-                    distance_to_center = min(abs(avg_position - window_center), 
-                                          cycle_length - abs(avg_position - window_center))
-                    
-                    # 如果当前窗口的覆盖点更接近中心，则更新最佳起始时间
-                    if best_distance == float('inf') or distance_to_center < best_distance:
-                        best_distance = distance_to_center
-                        best_start = start
-            
-            # 计算覆盖率
-            coverage_rate = max_covered / len(relative_times)
-            
-            results.append({
-                'inter_id': inter_id,
-                'nds_id': nds_id,
-                'next_nds_id': next_nds_id,
-                'dir': dir_val,
-                'cycle_length': cycle_length,
-                'inferred_green_start': best_start,
-                'green_time': green_time,
-                'vehicle_count': len(relative_times),
-                'covered_vehicles': max_covered,
-                'coverage_rate': coverage_rate,
-                'way': way
-            })
+        # 在周期内滑动窗口，寻找最佳绿灯开始时间（见green_window.py）
+        best_start, max_covered = find_green_start(relative_times, row['cycle_length'], row['green_time'],
+                                                   resolution)
+        results.append(_result_row(row, best_start, max_covered, len(relative_times)))
     
     return pd.DataFrame(results)
 
+def _matched_movements(trajectory_data, matched):
+    """把匹配到的转向的离开时间按CSR方式重新排列，返回(车辆数, offsets, 离开时间, 周期, 绿灯时长)"""
+    indices = np.array([i for i, _ in matched], dtype=np.int64)
+    counts = trajectory_data.counts()[indices]
+    offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    exit_seconds = np.concatenate([trajectory_data.exit_seconds_of(i) for i in indices])
+    cycle_lengths = np.array([row['cycle_length'] for _, row in matched])
+    green_times = np.array([row['green_time'] for _, row in matched])
+    return counts, offsets, exit_seconds, cycle_lengths, green_times
+
+def analyze_light_cycle_batched(trajectory_data, cycle_data, resolution=1):
+    """
+    与analyze_light_cycle结果相同，按周期分组后以矩阵方式一次计算所有转向
+    """
+    matched = match_cycle_data(trajectory_data, cycle_data)
+    if not matched:
+        return pd.DataFrame()
+    rows = [row for _, row in matched]
+    counts, offsets, exit_seconds, cycle_lengths, green_times = _matched_movements(trajectory_data, matched)
+
+    best_starts, max_covered = find_green_starts(offsets, exit_seconds, cycle_lengths, green_times, resolution)
+    results = [_result_row(row, best_start, int(covered), int(count))
+               for row, best_start, covered, count in zip(rows, best_starts, max_covered, counts)]
+    return pd.DataFrame(results)
+
+def _shard_green_starts(task):
+    """
+    计算一个分片内各转向的绿灯开始时间（在子进程中执行）
+    task: (offsets, 离开时间, 周期, 绿灯时长, 搜索步长, 是否按矩阵方式计算)
+    """
+    offsets, exit_seconds, cycle_lengths, green_times, resolution, batched = task
+    if batched:
+        return find_green_starts(offsets, exit_seconds, cycle_lengths, green_times, resolution)
+    best_starts = np.zeros(len(cycle_lengths))
+    max_covered = np.zeros(len(cycle_lengths), dtype=np.int64)
+    for j in range(len(cycle_lengths)):
+        relative_times = exit_seconds[offsets[j]:offsets[j + 1]] % cycle_lengths[j]
+        best_starts[j], max_covered[j] = find_green_start(relative_times, cycle_lengths[j], green_times[j],
+                                                          resolution)
+    return best_starts, max_covered
+
+def analyze_light_cycle_parallel(trajectory_data, cycle_data, resolution=1, batched=False, workers=1):
+    """
+    与analyze_light_cycle结果相同，按路口(inter_id)分片后由多个进程计算（见inter_shards.py），
+    结果按转向原来的顺序拼回
+    """
+    matched = match_cycle_data(trajectory_data, cycle_data)
+    if not matched:
+        return pd.DataFrame()
+    rows = [row for _, row in matched]
+    counts, offsets, exit_seconds, cycle_lengths, green_times = _matched_movements(trajectory_data, matched)
+
+    # 每个分片只传入本分片转向的离开时间
+    shards = split_by_inter_id([row['inter_id'] for row in rows], workers)
+    tasks = []
+    for shard in shards:
+        shard_offsets = np.zeros(len(shard) + 1, dtype=np.int64)
+        np.cumsum(counts[shard], out=shard_offsets[1:])
+        shard_exit_seconds = np.concatenate([exit_seconds[offsets[j]:offsets[j + 1]] for j in shard])
+        tasks.append((shard_offsets, shard_exit_seconds, cycle_lengths[shard], green_times[shard],
+                      resolution, batched))
+
+    best_starts = np.zeros(len(rows))
+    max_covered = np.zeros(len(rows), dtype=np.int64)
+    for shard, (shard_starts, shard_covered) in zip(shards, map_shards(_shard_green_starts, tasks, workers)):
+        best_starts[shard] = shard_starts
+        max_covered[shard] = shard_covered
+    results = [_result_row(row, best_start, int(covered), int(count))
+               for row, best_start, covered, count in zip(rows, best_starts, max_covered, counts)]
+    return pd.DataFrame(results)
+
 def main():
+    parser = argparse.ArgumentParser(description='根据轨迹离开时间推测信号灯绿灯开始时间')
+    parser.add_argument('--resolution', type=float, default=1, help='绿灯开始时间的搜索步长（秒）')
+    parser.add_argument('--batched', action='store_true', help='按周期分组，以矩阵方式一次计算所有转向')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='按路口分片并行计算的进程数（见inter_shards.py），1为单进程')
+    args = parser.parse_args()
+
     # 读取已聚类的轨迹数据
-    trajectory_data = pd.read_csv('data/clustered_trajectory.txt', sep='\t')
+    trajectory_data = load_movements('data/clustered_trajectory.npz')
     
     # 读取信号灯周期数据
-    cycle_data = pd.read_csv('data/merged_16h_timing_data.txt', sep='\t')
+    cycle_data = read_timing('data/merged_16h_timing_data.npz', columns=TIMING_COLUMNS, merged=True)
     
     # 分析信号灯信息
-    light_analysis = analyze_light_cycle(trajectory_data, cycle_data)
+    if args.workers > 1:
+        light_analysis = analyze_light_cycle_parallel(trajectory_data, cycle_data, args.resolution,
+                                                      args.batched, args.workers)
+    elif args.batched:
+        light_analysis = analyze_light_cycle_batched(trajectory_data, cycle_data, args.resolution)
+    else:
+        light_analysis = analyze_light_cycle(trajectory_data, cycle_data, args.resolution)
     
     # 保存结果
     light_analysis.to_csv('data/inferred_traffic_light_info.txt', sep='\t', index=False)
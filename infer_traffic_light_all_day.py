@@ -0,0 +1,166 @@
+"""
+全天按时段推测绿灯开始时间（滑动窗口）
+
+infer_traffic_light.py只处理16:00-17:00。这里一次读入全天的筛选结果，按转向聚合后，
+把每个转向的离开时间排序，用二分查找得到每个窗口内的车辆，再统计周期内的直方图（见online_green_start.py），
+不再对每个窗口重新读取数据。内存只与车辆数和窗口数有关，窗口长度和步长可以任意设置。
+每个窗口使用窗口起点所在小时的配时数据（filtered_DATA0329.txt中同一小时同一(nds_id, dir)的配时取均值），
+该小时没有配时数据时与complete_16h_data.py相同，使用离h时或h+1时最近（按24小时循环）的小时，实际使用的小时记录在timing_hour列中。
+
+先按全天窗口筛选轨迹：
+    python filter_trajectory_pipeline.py --method method2 --start 00:00:00 --end 23:59:59
+    python infer_traffic_light_all_day.py                             # 每小时一个窗口
+    python infer_traffic_light_all_day.py --window 3600 --step 900    # 1小时窗口，每15分钟滑动一次
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from complete_16h_data import hour_distance
+from data_schema import read_filtered_trajectory, read_timing
+from green_window import find_green_start_from_histogram
+from infer_traffic_light_method1 import map_exit_turn_to_dir, seconds_to_time
+from movement_store import MEAN_COLUMNS, MOVEMENT_KEYS, build_movements
+from timing_index import LINK_DIR_KEY, KeyIndex
+from trajectory_filters import parse_clock
+
+# 本步骤需要的列
+TRAJECTORY_COLUMNS = MOVEMENT_KEYS + ['exit_seconds'] + MEAN_COLUMNS
+TIMING_COLUMNS = ['inter_id', 'nds_id', 'dir', 'way', 'hour', 'cycle_time', 'green_time']
+
+
+def hourly_timing(timing: pd.DataFrame) -> pd.DataFrame:
+    """按(nds_id, dir, hour)合并配时数据：周期和绿灯时长取均值，路口和通行方式取第一条，按小时排序"""
+    timing = timing[timing['hour'].notna()]
+    grouped = timing.groupby(LINK_DIR_KEY + ['hour'], observed=True, sort=True)
+    merged = grouped[['cycle_time', 'green_time']].mean()
+    merged[['inter_id', 'way']] = grouped[['inter_id', 'way']].first()
+    merged = merged.reset_index()
+    merged['hour'] = merged['hour'].astype(int)
+    return merged
+
+
+def nearest_hour_rows(hours: np.ndarray, rows: np.ndarray, window_hours: np.ndarray) -> np.ndarray:
+    """
+    每个窗口小时h对应的配时行：取离h时或h+1时最近的小时（见complete_16h_data.hour_distance）
+    hours为rows各行的小时（升序），距离相同时取较早的小时
+    """
+    distance = hour_distance(hours[None, :], window_hours[:, None])
+    return rows[np.argmin(distance, axis=1)]
+
+
+def window_histograms(sorted_seconds, cycle_length, bin_width, window_starts, window):
+    """
+    每个窗口[start, start + window)内车辆的周期内直方图
+    sorted_seconds为升序的离开时间，每个窗口的范围由二分查找得到
+    返回(窗口 × 箱)的车辆数和相对时间之和
+    """
+    n_bins = int(np.ceil(cycle_length / bin_width))
+    relative_times = sorted_seconds % cycle_length
+    bins = np.minimum((relative_times // bin_width).astype(np.int64), n_bins - 1)
+    lower = np.searchsorted(sorted_seconds, window_starts, side='left')
+    upper = np.searchsorted(sorted_seconds, window_starts + window, side='left')
+
+    # 重叠的窗口中的车辆各计一次：展开为(窗口, 车辆)对后一次统计
+    lengths = upper - lower
+    owners = np.repeat(np.arange(len(window_starts)), lengths)
+    positions = np.arange(lengths.sum()) + np.repeat(lower - (np.cumsum(lengths) - lengths), lengths)
+    cells = owners * n_bins + bins[positions]
+    size = len(window_starts) * n_bins
+    counts = np.bincount(cells, minlength=size).reshape(-1, n_bins)
+    sums = np.bincount(cells, weights=relative_times[positions], minlength=size).reshape(-1, n_bins)
+    return counts, sums
+
+
+def analyze_all_day(movements, timing, start=0, end=86400, window=3600, step=3600, bin_width=1):
+    """
+    按滑动窗口推测每个转向在各时段的绿灯开始时间
+    movements: 全天的按转向聚合的轨迹数据（movement_store.MovementStore）
+    timing: 各小时的配时数据（见hourly_timing）
+    窗口为[start + i * step, start + i * step + window)，不超过end
+    """
+    n_windows = (int(end) - int(start) - int(window)) // int(step) + 1
+    if n_windows <= 0:
+        return pd.DataFrame()
+    window_starts = start + np.arange(n_windows) * int(step)
+    window_hours = (window_starts // 3600) % 24
+
+    timing_index = KeyIndex(timing, LINK_DIR_KEY)
+    timing_hours = timing['hour'].to_numpy()
+    cycle_times = timing['cycle_time'].to_numpy()
+    green_times = timing['green_time'].to_numpy()
+    columns = movements.columns
+
+    results = []
+    for i in range(len(movements)):
+        dir_value = map_exit_turn_to_dir(columns['exit_turn'][i])
+        rows = timing_index.rows((columns['nds_id'][i], dir_value))
+        if len(rows) == 0:
+            continue
+        window_rows = nearest_hour_rows(timing_hours[rows], rows, window_hours)
+        sorted_seconds = np.sort(movements.exit_seconds_of(i))
+
+        # 使用同一行配时数据的窗口一起统计直方图
+        for timing_row in pd.unique(window_rows):
+            cycle_length, green_time = cycle_times[timing_row], green_times[timing_row]
+            windows = np.flatnonzero(window_rows == timing_row)
+            counts, sums = window_histograms(sorted_seconds, cycle_length, bin_width, window_starts[windows],
+                                             int(window))
+            for k, w in enumerate(windows):
+                window_counts = counts[k]
+                vehicle_count = int(window_counts.sum())
+                if vehicle_count == 0:
+                    continue
+                best_start, max_covered = find_green_start_from_histogram(
+                    window_counts, sums[k], bin_width, cycle_length, green_time, bin_width)
+                results.append({
+                    'window_start': seconds_to_time(int(window_starts[w])),
+                    'window_end': seconds_to_time(int(window_starts[w] + window)),
+                    'timing_hour': timing_hours[timing_row],
+                    'inter_id': timing['inter_id'].iloc[timing_row],
+                    'nds_id': columns['nds_id'][i],
+                    'next_nds_id': columns['next_nds_id'][i],
+                    'dir': dir_value,
+                    'cycle_length': cycle_length,
+                    'inferred_green_start': best_start,
+                    'green_time': green_time,
+                    'vehicle_count': vehicle_count,
+                    'covered_vehicles': max_covered,
+                    'coverage_rate': max_covered / vehicle_count,  # 覆盖率
+                    'way': timing['way'].iloc[timing_row]
+                })
+
+    if not results:
+        return pd.DataFrame()
+    # 按窗口、窗口内按转向的顺序输出
+    return pd.DataFrame(results).sort_values('window_start', kind='stable').reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按滑动窗口推测全天各时段的绿灯开始时间')
+    parser.add_argument('--input', default='data/filtered_trajectory_0_23_by_light.txt',
+                        help='按全天窗口筛选后的轨迹文件')
+    parser.add_argument('--timing', default='data/filtered_DATA0329.txt', help='包含各小时的配时数据')
+    parser.add_argument('--output', default='data/inferred_traffic_light_all_day.txt', help='输出文件')
+    parser.add_argument('--start', default='00:00:00', help='第一个窗口的起点')
+    parser.add_argument('--end', default='24:00:00', help='窗口不超过此时刻')
+    parser.add_argument('--window', type=int, default=3600, help='窗口长度（秒）')
+    parser.add_argument('--step', type=int, default=3600, help='窗口滑动的步长（秒）')
+    parser.add_argument('--bin-width', type=float, default=1, help='周期内直方图的箱宽（秒），也是搜索步长')
+    args = parser.parse_args()
+
+    # 一次读入全天的轨迹，按转向聚合
+    df = read_filtered_trajectory(args.input, columns=TRAJECTORY_COLUMNS)
+    movements = build_movements(df)
+    timing = hourly_timing(read_timing(args.timing, columns=TIMING_COLUMNS))
+
+    result = analyze_all_day(movements, timing, parse_clock(args.start), parse_clock(args.end),
+                             args.window, args.step, args.bin_width)
+    result.to_csv(args.output, sep='\t', index=False)
+    print(f"转向数量: {len(movements)}，窗口结果数量: {len(result)}")
+    print(f"结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,11 @@
+import argparse
+
 import pandas as pd
 import numpy as np
-from collections import defaultdict
-from datetime import datetime
+
+from data_schema import read_filtered_trajectory, read_timing
+from inter_shards import map_shards, split_by_inter_id
+from timing_index import timing_index
 
 def map_exit_turn_to_dir(exit_turn):
     """
@@ -21,17 +25,9 @@ def map_exit_turn_to_dir(exit_turn):
     else:
         return None
 
-# 读取数据
-df = pd.read_csv('data/filtered_trajectory_16_17_by_light_method1.txt', sep='\t', dtype=str)
-# 读取信号灯周期数据
-cycle_data = pd.read_csv('data/merged_16h_timing_data.txt', sep='\t', dtype=str)
-
-# 将时间转换为秒数，方便计算
-def time_to_seconds(time_str):
-    # 解析完整的时间字符串
-    dt = datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S%z')
-    # 只返回当天的时间（秒数）
-    return dt.hour * 3600 + dt.minute * 60 + dt.second
+# 本步骤需要的列
+TRAJECTORY_COLUMNS = ['nds_id', 'next_nds_id', 'exit_seconds', 'exit_turn']
+TIMING_COLUMNS = ['inter_id', 'nds_id', 'dir', 'cycle_time']
 
 # 将秒数转换回时间字符串
 def seconds_to_time(seconds):
@@ -40,101 +36,150 @@ def seconds_to_time(seconds):
     s = seconds % 60
     return f"{h:02d}:{m:02d}:{s:02d}"
 
-# 创建一个字典来存储每个信号灯的推测时间
-inferred_times = defaultdict(list)
-removed_data = []
-
-# 保存所有next_nds_id为0的数据
-removed_data.append(df[df['next_nds_id'] == '0'])
-
-# 对每个nds_id和next_nds_id的组合进行处理
-for nds_id in df['nds_id'].unique():
-    # 获取该nds_id的所有数据
-    nds_data = df[df['nds_id'] == nds_id].copy()
-    
-    # 对每个next_nds_id分别处理
-    for next_id in nds_data['next_nds_id'].unique():
-        # 获取特定next_nds_id的数据
-        light_data = nds_data[nds_data['next_nds_id'] == next_id].copy()
-        
-        # 获取该组合的exit_turn的平均值
-        # 先将exit_turn转换为数值类型
-        light_data['exit_turn'] = pd.to_numeric(light_data['exit_turn'], errors='coerce')
-        # 计算平均值，忽略NaN值
-        exit_turn = light_data['exit_turn'].mean()
-        # 如果所有值都是NaN，则使用0
-        if pd.isna(exit_turn):
-            exit_turn = 0
-        
-        # 将exit_turn映射到dir值
-        dir = map_exit_turn_to_dir(exit_turn)
-
-        # 根据nds_id和dir值获取对应的cycle_data
-        cycle_data_dir = cycle_data[(cycle_data['nds_id'] == nds_id) & (cycle_data['dir'] == str(dir))]
-
-        # 将enter_time转换为秒
-        light_data['enter_time_seconds'] = light_data['enter_time'].apply(time_to_seconds)
-        
-        # 离开时间通过enter_time和travel_time计算
-        light_data['end_time_seconds'] = light_data['enter_time_seconds'] + pd.to_numeric(light_data['travel_time'])
-        
-        # 按时间排序
-        light_data = light_data.sort_values('end_time_seconds')
-        
-        # 计算相邻车辆离开的时间差
-        time_diffs = np.diff(light_data['end_time_seconds'])
-        
-        # 找出时间差较大的点（可能是红灯变绿灯的点）
-        # 这里假设时间差大于0.9周期的点可能是红灯变绿灯的点
-        if len(cycle_data_dir) > 0:
-            # 将cycle_time转换为数值类型
-            cycle_time = pd.to_numeric(cycle_data_dir['cycle_time'], errors='coerce')
-            threshold = 0.9 * cycle_time.mean()
-        else:
-            threshold = 30
-        potential_green_starts = []
-        
-        for i in range(len(time_diffs)):
-            if time_diffs[i] > threshold:
-                # 记录这个时间点
-                potential_green_starts.append(light_data.iloc[i + 1]['end_time_seconds'])
-        
-        # 如果potential为空
-        if len(potential_green_starts) == 0 and len(light_data) > 0:
-            # 直接记录第一个点
-            inferred_times[(nds_id, next_id, exit_turn,dir)].append(seconds_to_time(int(light_data.iloc[0]['end_time_seconds'])))
-            continue
-
-        if len(potential_green_starts) > 1:
-            for time in potential_green_starts:
-                inferred_times[(nds_id, next_id, exit_turn,dir)].append(seconds_to_time(int(time)))
-        elif len(potential_green_starts) == 1:
-            # 如果只有一个时间点，直接保存
-            inferred_times[(nds_id, next_id, exit_turn,dir)].append(seconds_to_time(int(potential_green_starts[0])))
-
-# 将结果转换为DataFrame
-results = []
-for (nds_id, next_id, exit_turn,dir), times in inferred_times.items():
-    for i, time in enumerate(times):
-        results.append({
-            'nds_id': nds_id,
-            'next_nds_id': next_id,
-            'exit_turn': exit_turn,
-            'dir': dir,
-            'phase_index': i + 1,
-            'green_start_time': time
-        })
-
-# 创建DataFrame并保存
-results_df = pd.DataFrame(results)
-results_df.to_csv('data/inferred_traffic_light_method1.txt', sep='\t', index=False, encoding='utf-8')
-
-# 处理被移除的数据
-removed_data_df = pd.concat(removed_data)
-# 找出在removed_data中但不在results_df中的nds_id
-unique_removed_nds_ids = set(removed_data_df['nds_id'].unique()) - set(results_df['nds_id'].unique())
-removed_data_df = removed_data_df[removed_data_df['nds_id'].isin(unique_removed_nds_ids)]
-
-# 打印统计信息
-print(f"总共处理了 {len(df['nds_id'].unique())} 个nds_id")
-print(f"成功推测出时间的信号灯数量: {len(results_df['nds_id'].unique())}")
\ No newline at end of file
+def detect_green_starts(groups, exit_seconds, thresholds):
+    """
+    找出每组中离开时间差大于阈值的点（可能是红灯变绿灯的点），没有找到时记录该组的第一个点
+    groups: 每辆车所属的组，exit_seconds: 离开时间（北京时间当天的秒数），thresholds: 每组的阈值
+    返回(所属的组, 离开时间, 车辆数)，按组、组内按离开时间排列，
+    车辆数为从该点到同组下一个点（或组末尾）之间离开的车辆数
+    """
+    # 一次排序：按组、组内按离开时间
+    order = np.lexsort((exit_seconds, groups))
+    sorted_groups = groups[order]
+    end_time_seconds = exit_seconds[order]
+
+    # 计算同一组内相邻车辆离开的时间差
+    same_group = sorted_groups[1:] == sorted_groups[:-1]
+    time_diffs = np.diff(end_time_seconds)
+    is_green_start = np.zeros(len(order), dtype=bool)
+    is_green_start[1:] = same_group & (time_diffs > thresholds[sorted_groups[1:]])
+    # 没有找到时间差较大的点的组直接记录第一个点
+    group_first = np.r_[True, ~same_group]
+    has_green_start = np.bincount(sorted_groups[is_green_start], minlength=len(thresholds)) > 0
+    is_green_start |= group_first & ~has_green_start[sorted_groups]
+
+    starts = np.flatnonzero(is_green_start)
+    green_groups = sorted_groups[starts]
+    ends = np.minimum(np.r_[starts[1:], len(order)], np.searchsorted(sorted_groups, green_groups, side='right'))
+    return green_groups, end_time_seconds[starts].astype(int), ends - starts
+
+def _shard_green_starts(task):
+    """在子进程中处理一个分片：task为(所属的组, 离开时间, 每组的阈值)"""
+    return detect_green_starts(*task)
+
+def load_estimated_cycles(path):
+    """读取cycle_estimation.py的输出，返回按(nds_id, next_nds_id)索引的估计周期，优先使用路口的估计"""
+    estimates = pd.read_csv(path, sep='\t')
+    cycles = estimates['inter_estimated_cycle'].fillna(estimates['estimated_cycle'])
+    return pd.Series(cycles.to_numpy(), index=pd.MultiIndex.from_frame(estimates[['nds_id', 'next_nds_id']]))
+
+def infer_green_starts(df, cycle_data, workers=1, estimated_cycles=None, with_vehicle_count=False):
+    """
+    按(nds_id, next_nds_id)分组推测绿灯开始时间
+    with_vehicle_count为True时增加vehicle_count列：该绿灯开始时间到同一转向下一个绿灯开始时间之间离开的车辆数
+    estimated_cycles: 按(nds_id, next_nds_id)索引的估计周期（见load_estimated_cycles），
+        给定时没有配时数据的组用0.9倍估计周期作为阈值，而不是固定的30秒
+    workers大于1时按路口(inter_id，由nds_id对应的配时数据得到)分片，由多个进程计算，结果顺序不变
+    """
+    # 按(nds_id, dir)索引周期数据
+    cycle_index = timing_index(cycle_data)
+
+    # 按(nds_id, next_nds_id)分组，组的顺序与逐个nds_id、next_nds_id处理时相同：
+    # 先按nds_id第一次出现的顺序，同一nds_id内按next_nds_id第一次出现的顺序
+    nds_codes = pd.factorize(df['nds_id'])[0]
+    group_codes, group_keys = pd.factorize(pd.MultiIndex.from_arrays([df['nds_id'], df['next_nds_id']]))
+    group_order = np.lexsort((np.arange(len(group_keys)), pd.Series(nds_codes).groupby(group_codes).first().to_numpy()))
+    group_rank = np.empty(len(group_keys), dtype=np.int64)
+    group_rank[group_order] = np.arange(len(group_keys))
+    groups = group_rank[group_codes]
+
+    # 获取每个组合的exit_turn的平均值，忽略NaN值，如果所有值都是NaN，则使用0
+    exit_turns = df['exit_turn'].groupby(groups).mean().fillna(0)
+    # 将exit_turn映射到dir值
+    dirs = [map_exit_turn_to_dir(exit_turn) for exit_turn in exit_turns]
+    group_nds_ids = group_keys.get_level_values(0)[group_order]
+    group_next_ids = group_keys.get_level_values(1)[group_order]
+
+    # 根据nds_id和dir值获取对应的cycle_data，时间差大于0.9周期的点可能是红灯变绿灯的点，没有周期数据时阈值为30
+    threshold_by_key = {}
+    for key in set(zip(group_nds_ids, dirs)):
+        cycle_data_dir = cycle_data.iloc[cycle_index.rows(key)]
+        threshold_by_key[key] = 0.9 * cycle_data_dir['cycle_time'].mean() if len(cycle_data_dir) > 0 else 30
+    thresholds = np.array([threshold_by_key[key] for key in zip(group_nds_ids, dirs)])
+    if estimated_cycles is not None:
+        missing = np.array([key not in cycle_index for key in zip(group_nds_ids, dirs)], dtype=bool)
+        estimates = estimated_cycles.reindex(pd.MultiIndex.from_arrays([group_nds_ids, group_next_ids])).to_numpy()
+        thresholds = np.where(missing & ~np.isnan(estimates), 0.9 * estimates, thresholds)
+
+    # 离开时间在筛选时已经计算好
+    exit_seconds = df['exit_seconds'].to_numpy()
+    if workers > 1:
+        # 同一nds_id的所有组在同一分片中，分片结果按组拼回后与单进程相同
+        inter_by_nds = cycle_data.drop_duplicates('nds_id').set_index('nds_id')['inter_id']
+        shards = split_by_inter_id(df['nds_id'].map(inter_by_nds), workers)
+        tasks = [(groups[rows], exit_seconds[rows], thresholds) for rows in shards]
+        shard_results = map_shards(_shard_green_starts, tasks, workers)
+        green_groups = np.concatenate([result[0] for result in shard_results])
+        green_seconds = np.concatenate([result[1] for result in shard_results])
+        vehicle_counts = np.concatenate([result[2] for result in shard_results])
+        order = np.argsort(green_groups, kind='stable')
+        green_groups, green_seconds, vehicle_counts = green_groups[order], green_seconds[order], vehicle_counts[order]
+    else:
+        green_groups, green_seconds, vehicle_counts = detect_green_starts(groups, exit_seconds, thresholds)
+    # 每组内的序号
+    phase_index = np.arange(len(green_groups)) - np.searchsorted(green_groups, green_groups, side='left') + 1
+
+    # 将结果转换为DataFrame
+    results = []
+    for group, index, time, count in zip(green_groups, phase_index, green_seconds, vehicle_counts):
+        result = {
+            'nds_id': group_nds_ids[group],
+            'next_nds_id': group_next_ids[group],
+            'exit_turn': exit_turns.iloc[group],
+            'dir': dirs[group],
+            'phase_index': int(index),
+            'green_start_time': seconds_to_time(int(time)),
+            'green_start_seconds': int(time)
+        }
+        if with_vehicle_count:
+            result['vehicle_count'] = int(count)
+        results.append(result)
+    return pd.DataFrame(results)
+
+def main():
+    parser = argparse.ArgumentParser(description='按相邻车辆离开时间差推测绿灯开始时间（方法1）')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='按路口分片并行计算的进程数（见inter_shards.py），1为单进程')
+    parser.add_argument('--cycle-estimates', default=None,
+                        help='cycle_estimation.py输出的估计周期，没有配时数据的转向用它代替固定阈值')
+    parser.add_argument('--vehicle-count', action='store_true',
+                        help='输出vehicle_count列（还原时可用--weight-column vehicle_count加权），默认不输出')
+    args = parser.parse_args()
+
+    # 读取数据
+    df = read_filtered_trajectory('data/filtered_trajectory_16_17_by_light_method1.txt', columns=TRAJECTORY_COLUMNS)
+    # 读取信号灯周期数据
+    cycle_data = read_timing('data/merged_16h_timing_data.npz', columns=TIMING_COLUMNS, merged=True)
+
+    removed_data = []
+
+    # 保存所有next_nds_id为0的数据
+    removed_data.append(df[df['next_nds_id'] == 0])
+
+    # 创建DataFrame并保存
+    estimated_cycles = load_estimated_cycles(args.cycle_estimates) if args.cycle_estimates else None
+    results_df = infer_green_starts(df, cycle_data, args.workers, estimated_cycles, args.vehicle_count)
+    results_df.to_csv('data/inferred_traffic_light_method1.txt', sep='\t', index=False, encoding='utf-8')
+
+    # 处理被移除的数据
+    removed_data_df = pd.concat(removed_data)
+    # 找出在removed_data中但不在results_df中的nds_id
+    unique_removed_nds_ids = set(removed_data_df['nds_id'].unique()) - set(results_df['nds_id'].unique())
+    removed_data_df = removed_data_df[removed_data_df['nds_id'].isin(unique_removed_nds_ids)]
+
+    # 打印统计信息
+    print(f"总共处理了 {len(df['nds_id'].unique())} 个nds_id")
+    print(f"成功推测出时间的信号灯数量: {len(results_df['nds_id'].unique())}")
+
+if __name__ == "__main__":
+    main()
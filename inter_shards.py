@@ -0,0 +1,46 @@
+"""
+按路口(inter_id)分片的多进程计算
+
+各路口的推测和还原互不依赖。把行按inter_id分成若干片（同一路口的行都在同一片中，
+各片的行数尽量均衡），由进程池分别计算，结果按分片顺序返回，
+调用方再按行原来的位置拼回，因此输出顺序与单进程一致。
+    shards = split_by_inter_id(inter_ids, workers)      # 每片的行位置（升序）
+    results = map_shards(func, [make_task(rows) for rows in shards], workers)
+inter_id缺失的行单独作为一个路口处理。
+"""
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+def split_by_inter_id(inter_ids, n_shards: int) -> List[np.ndarray]:
+    """
+    把行按inter_id分为不超过n_shards片，返回每片的行位置（升序）
+    按行数从多到少依次把路口分给当前行数最少的分片，结果只取决于输入
+    """
+    codes, _ = pd.factorize(pd.Series(inter_ids), use_na_sentinel=False)
+    sizes = np.bincount(codes)
+    n_shards = max(1, min(n_shards, len(sizes)))
+    shard_of_code = np.empty(len(sizes), dtype=np.int64)
+    heap = [(0, shard) for shard in range(n_shards)]
+    for code in np.argsort(-sizes, kind='stable'):
+        load, shard = heapq.heappop(heap)
+        shard_of_code[code] = shard
+        heapq.heappush(heap, (load + int(sizes[code]), shard))
+    shard_of_row = shard_of_code[codes]
+    return [np.flatnonzero(shard_of_row == shard) for shard in range(n_shards)
+            if (shard_of_row == shard).any()]
+
+
+def map_shards(func: Callable, tasks: Sequence, workers: int = 1) -> List:
+    """
+    对每个分片执行func(task)，按分片顺序返回结果；workers为1时在当前进程中依次执行
+    func必须是模块级函数，以便传给子进程
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        return [func(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+        return list(executor.map(func, tasks))
@@ -1,28 +1,46 @@
-import pandas as pd
+import argparse
+import os
 
-# 读取数据
-df = pd.read_csv('data/complete_16h_data.txt', sep='\t')
+from data_schema import MERGED_TIMING_DTYPES, read_timing, save_timing_table
 
 # 定义需要分组的列
-group_columns = ['inter_id', 'f_rid', 'nds_id', 'node_id', 'dir', 'way', 'hour']
+GROUP_COLUMNS = ['inter_id', 'f_rid', 'nds_id', 'node_id', 'dir', 'way', 'hour']
 
-# 定义需要计算平均值的列
-agg_columns = ['red_time', 'green_time', 'cycle_time']
+# 定义需要计算平均值的列，其他列保留第一个值
+MEAN_COLUMNS = ['red_time', 'green_time', 'cycle_time']
 
-# 按指定列分组并计算平均值
-df_merged = df.groupby(group_columns)[agg_columns].mean().reset_index()
 
-# 保留其他列的第一个值
-other_columns = [col for col in df.columns if col not in group_columns + agg_columns]
-df_other = df.groupby(group_columns)[other_columns].first().reset_index()
+def merge_timing(df):
+    """按GROUP_COLUMNS分组，一次聚合：MEAN_COLUMNS取平均值，其他列取第一个值，类型见data_schema.MERGED_TIMING_DTYPES"""
+    reducers = {col: 'mean' for col in MEAN_COLUMNS}
+    reducers.update({col: 'first' for col in df.columns if col not in GROUP_COLUMNS + MEAN_COLUMNS})
+    merged = df.groupby(GROUP_COLUMNS, observed=True).agg(reducers).reset_index()
+    # 与按合并后的类型读取TSV得到的类型相同
+    return merged.astype({col: dtype for col, dtype in MERGED_TIMING_DTYPES.items()
+                          if col in merged.columns and dtype != 'category'})
 
-# 合并结果
-df_final = pd.merge(df_merged, df_other, on=group_columns)
 
-# 保存结果
-df_final.to_csv('merged_16h_timing_data.txt', sep='\t', index=False)
+def main():
+    parser = argparse.ArgumentParser(description='合并同一路口、路段、方向和小时的配时数据')
+    parser.add_argument('--input', default='data/complete_16h_data.txt',
+                        help='补全后的配时数据（全天的配时表为data/complete_24h_data.txt）')
+    parser.add_argument('--output', default='data/merged_16h_timing_data.txt',
+                        help='合并后的配时数据，同时在同目录下输出同名的.npz二进制表（见data_schema.save_timing_table）')
+    args = parser.parse_args()
 
-# 打印统计信息
-print(f"原始数据条数: {len(df)}")
-print(f"合并后数据条数: {len(df_final)}")
-print(f"合并减少的数据条数: {len(df) - len(df_final)}") 
\ No newline at end of file
+    # 读取数据，列类型见data_schema.TIMING_DTYPES
+    df = read_timing(args.input)
+    df_final = merge_timing(df)
+
+    # 保存结果
+    df_final.to_csv(args.output, sep='\t', index=False)
+    save_timing_table(df_final, os.path.splitext(args.output)[0] + '.npz')
+
+    # 打印统计信息
+    print(f"原始数据条数: {len(df)}")
+    print(f"合并后数据条数: {len(df_final)}")
+    print(f"合并减少的数据条数: {len(df) - len(df_final)}")
+
+
+if __name__ == '__main__':
+    main()
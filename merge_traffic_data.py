@@ -2,6 +2,8 @@ import pandas as pd
 import numpy as np
 import json
 
+from timing_index import MOVEMENT_KEY, KeyIndex
+
 # 读取数据文件，指定nds_id和next_nds_id为字符串类型
 inferred_df = pd.read_csv('data/inferred_traffic_light_info.txt', sep='\t', 
                          dtype={'nds_id': str, 'next_nds_id': str})
@@ -14,32 +16,35 @@ reconstructed_df = reconstructed_df.rename(columns={
     'cycle_start': 'inferred_green_start'
 })
 
-def compare_data_sources(inferred_df, reconstructed_df):
-    """比较两个数据源的差异，只比较覆盖率大于0.8的记录"""
+# 按(nds_id, next_nds_id, dir)连接两个数据源：为每条inferred记录找到reconstructed中第一条相同键的记录（没有时为-1）
+reconstructed_positions = KeyIndex(reconstructed_df, MOVEMENT_KEY).positions(inferred_df)
+found = reconstructed_positions >= 0
+
+def reconstructed_column(column):
+    """每条inferred记录对应的reconstructed数据中的列，没有对应记录时为nan"""
+    values = reconstructed_df[column].to_numpy(dtype=float)
+    return np.where(found, values[np.maximum(reconstructed_positions, 0)], np.nan)
+
+def circular_difference(diff, cycle_length):
+    """周期内的有符号差异，取值范围[-cycle_length / 2, cycle_length / 2)"""
+    return (diff + cycle_length / 2) % cycle_length - cycle_length / 2
+
+def compare_data_sources(inferred_df):
+    """比较两个数据源的差异，只比较覆盖率大于0.8的记录，差异按周期内的循环距离计算"""
     # 找到两个数据源中都存在的记录
-    common_records = []
-    for _, row in inferred_df.iterrows():
-        # 只处理覆盖率大于0.8的记录
-        if row['coverage_rate'] > 0.8:
-            reconstructed_row = reconstructed_df[
-                (reconstructed_df['nds_id'] == row['nds_id']) & 
-                (reconstructed_df['next_nds_id'] == row['next_nds_id']) & 
-                (reconstructed_df['dir'] == row['dir'])
-            ]
-            if not reconstructed_row.empty:
-                common_records.append({
-                    'nds_id': row['nds_id'],
-                    'next_nds_id': row['next_nds_id'],
-                    'dir': int(row['dir']),
-                    'inferred_green_start': float(row['inferred_green_start']),
-                    'reconstructed_green_start': float(reconstructed_row.iloc[0]['inferred_green_start']),
-                })
-    
-    # 转换为DataFrame
-    comparison_df = pd.DataFrame(common_records)
+    common = (inferred_df['coverage_rate'] > 0.8).to_numpy() & found
+    comparison_df = pd.DataFrame({
+        'nds_id': inferred_df['nds_id'].to_numpy()[common],
+        'next_nds_id': inferred_df['next_nds_id'].to_numpy()[common],
+        'dir': inferred_df['dir'].to_numpy()[common].astype(int),
+        'inferred_green_start': inferred_df['inferred_green_start'].to_numpy(dtype=float)[common],
+        'reconstructed_green_start': reconstructed_column('inferred_green_start')[common],
+    })
     
-    # 计算差异
-    comparison_df['green_start_diff'] = comparison_df['reconstructed_green_start'] - comparison_df['inferred_green_start']
+    # 计算差异：绿灯开始时间是周期内的位置，相差接近一个周期的两个时间实际上很接近
+    comparison_df['green_start_diff'] = circular_difference(
+        comparison_df['reconstructed_green_start'] - comparison_df['inferred_green_start'],
+        inferred_df['cycle_length'].to_numpy(dtype=float)[common])
     
     # 计算绝对差异
     comparison_df['green_start_abs_diff'] = np.abs(comparison_df['green_start_diff'])
@@ -47,105 +52,66 @@ def compare_data_sources(inferred_df, reconstructed_df):
     return comparison_df
 
 # 比较数据源
-comparison_df = compare_data_sources(inferred_df, reconstructed_df)
+comparison_df = compare_data_sources(inferred_df)
 
 # 打印比较结果
 print("\n数据源比较结果（仅覆盖率>0.8的记录）：")
 print(f"共有 {len(comparison_df)} 条记录在两个数据源中都存在")
 
-print("\n绿灯开始时间差异统计：")
+print("\n绿灯开始时间差异统计（周期内的循环距离）：")
 print(f"平均差异: {comparison_df['green_start_diff'].mean():.2f}")
 print(f"平均绝对差异: {comparison_df['green_start_abs_diff'].mean():.2f}")
 print(f"最大绝对差异: {comparison_df['green_start_abs_diff'].max():.2f}")
 print(f"差异标准差: {comparison_df['green_start_diff'].std():.2f}")
 
 # 输出最大绝对差异的记录
-max_diff_idx = comparison_df['green_start_abs_diff'].idxmax()
-max_diff_record = comparison_df.loc[max_diff_idx]
-print("\n最大绝对差异的记录详情：")
-print(f"nds_id: {max_diff_record['nds_id']}")
-print(f"next_nds_id: {max_diff_record['next_nds_id']}")
-print(f"方向: {max_diff_record['dir']}")
-print(f"推断绿灯开始时间: {max_diff_record['inferred_green_start']}")
-print(f"重构绿灯开始时间: {max_diff_record['reconstructed_green_start']}")
-
-# 创建合并后的数据字典
-merged_data = {}
+if len(comparison_df) > 0:
+    max_diff_idx = comparison_df['green_start_abs_diff'].idxmax()
+    max_diff_record = comparison_df.loc[max_diff_idx]
+    print("\n最大绝对差异的记录详情：")
+    print(f"nds_id: {max_diff_record['nds_id']}")
+    print(f"next_nds_id: {max_diff_record['next_nds_id']}")
+    print(f"方向: {max_diff_record['dir']}")
+    print(f"推断绿灯开始时间: {max_diff_record['inferred_green_start']}")
+    print(f"重构绿灯开始时间: {max_diff_record['reconstructed_green_start']}")
 
 # 统计变量
 total_records = len(inferred_df)
-replaced_records = 0
-low_coverage_records = 0
-single_vehicle_records = 0
-found_in_reconstructed = 0
-
-# 处理inferred数据
-for _, row in inferred_df.iterrows():
-    key = f"{row['nds_id']}_{row['next_nds_id']}_{row['dir']}"
-    
-    if row['coverage_rate'] < 0.8 or row['covered_vehicles'] == 1:
-        if row['coverage_rate'] < 0.8:
-            low_coverage_records += 1
-        if row['covered_vehicles'] == 1:
-            single_vehicle_records += 1
-            
-        # 查找reconstructed中对应的数据
-        reconstructed_row = reconstructed_df[
-            (reconstructed_df['nds_id'] == row['nds_id']) & 
-            (reconstructed_df['next_nds_id'] == row['next_nds_id']) & 
-            (reconstructed_df['dir'] == row['dir'])
-        ]
-        
-        if not reconstructed_row.empty:
-            found_in_reconstructed += 1
-            replaced_records += 1
-            # 使用reconstructed的数据
-            merged_data[key] = {
-                'inter_id': str(row['inter_id']),
-                'nds_id': str(row['nds_id']),
-                'next_nds_id': str(row['next_nds_id']),
-                'dir': int(row['dir']),
-                'cycle_length': float(reconstructed_row.iloc[0]['cycle_length']),
-                'green_start': float(reconstructed_row.iloc[0]['inferred_green_start']),
-                'green_time': float(reconstructed_row.iloc[0]['green_time']),
-                'vehicle_count': int(row['vehicle_count']),
-                'covered_vehicles': int(row['covered_vehicles']),
-                'coverage_rate': float(row['coverage_rate']),
-                'way':int(row['way']),
-                'data_source': 'method1'
-            }
-        else:
-            # 如果没有找到对应的reconstructed数据，保留inferred数据
-            merged_data[key] = {
-                'inter_id': str(row['inter_id']),
-                'nds_id': str(row['nds_id']),
-                'next_nds_id': str(row['next_nds_id']),
-                'dir': int(row['dir']),
-                'cycle_length': float(row['cycle_length']),
-                'green_start': float(row['inferred_green_start']),
-                'green_time': float(row['green_time']),
-                'vehicle_count': int(row['vehicle_count']),
-                'covered_vehicles': int(row['covered_vehicles']),
-                'coverage_rate': float(row['coverage_rate']),
-                'way':int(row['way']),
-                'data_source': 'method2'
-            }
-    else:
-        # 使用inferred数据
-        merged_data[key] = {
-            'inter_id': str(row['inter_id']),
-            'nds_id': str(row['nds_id']),
-            'next_nds_id': str(row['next_nds_id']),
-            'dir': int(row['dir']),
-            'cycle_length': float(row['cycle_length']),
-            'green_start': float(row['inferred_green_start']),
-            'green_time': float(row['green_time']),
-            'vehicle_count': int(row['vehicle_count']),
-            'covered_vehicles': int(row['covered_vehicles']),
-            'coverage_rate': float(row['coverage_rate']),
-            'way':int(row['way']),
-            'data_source': 'method2'
-        }
+low_coverage = (inferred_df['coverage_rate'] < 0.8).to_numpy()
+single_vehicle = (inferred_df['covered_vehicles'] == 1).to_numpy()
+low_coverage_records = int(low_coverage.sum())
+single_vehicle_records = int(single_vehicle.sum())
+
+# 覆盖率低于0.8或只覆盖1辆车的记录，在reconstructed中有对应数据时使用reconstructed的数据
+replaced = (low_coverage | single_vehicle) & found
+found_in_reconstructed = int(replaced.sum())
+replaced_records = found_in_reconstructed
+
+cycle_length = np.where(replaced, reconstructed_column('cycle_length'), inferred_df['cycle_length'].to_numpy(dtype=float))
+green_start = np.where(replaced, reconstructed_column('inferred_green_start'),
+                       inferred_df['inferred_green_start'].to_numpy(dtype=float))
+green_time = np.where(replaced, reconstructed_column('green_time'), inferred_df['green_time'].to_numpy(dtype=float))
+
+# 创建合并后的数据，键相同的记录保留最后一条（位置按第一次出现，与依次写入字典相同）
+keys = (inferred_df['nds_id'].astype(str) + '_' + inferred_df['next_nds_id'].astype(str) + '_'
+        + inferred_df['dir'].astype(str)).to_numpy()
+rows = pd.Series(np.arange(len(keys))).groupby(keys, sort=False).last().to_numpy()
+merged_df = pd.DataFrame({
+    'inter_id': inferred_df['inter_id'].astype(str),
+    'nds_id': inferred_df['nds_id'].astype(str),
+    'next_nds_id': inferred_df['next_nds_id'].astype(str),
+    'dir': inferred_df['dir'].astype(int),
+    'cycle_length': cycle_length,
+    'green_start': green_start,
+    'green_time': green_time,
+    'vehicle_count': inferred_df['vehicle_count'].astype(int),
+    'covered_vehicles': inferred_df['covered_vehicles'].astype(int),
+    'coverage_rate': inferred_df['coverage_rate'].astype(float),
+    'way': inferred_df['way'].astype(int),
+    'data_source': np.where(replaced, 'method1', 'method2'),
+}).iloc[rows]
+merged_data = dict(zip(keys[rows], merged_df.to_dict('records')))
+merged_records = len(merged_data)
 
 # 保存为JSON文件
 with open('data/merged_traffic_light_info.json', 'w', encoding='utf-8') as f:
@@ -160,4 +126,4 @@ print(f"需要替换的记录数: {low_coverage_records + single_vehicle_records
 print(f"在reconstructed中找到的记录数: {found_in_reconstructed} ({found_in_reconstructed/total_records*100:.2f}%)")
 print(f"实际替换的记录数: {replaced_records} ({replaced_records/total_records*100:.2f}%)")
 
-print("数据合并完成！") 
\ No newline at end of file
+print("数据合并完成！")
@@ -0,0 +1,67 @@
+"""
+按转向(nds_id, next_nds_id)聚合的轨迹数据（clustered_trajectory）的存储
+
+每个转向的离开时间不再拼接成逗号分隔的字符串，而是按CSR方式保存：
+所有转向的离开时间（北京时间当天的秒数）依次放在一个int32数组里，
+offsets[i]:offsets[i + 1]为第i个转向的范围，各转向的统计值按列保存为定长数组。
+    store = load_movements('data/clustered_trajectory.npz')
+    exit_seconds = store.exit_seconds_of(0)    # 第0个转向的离开时间，零拷贝切片
+"""
+from dataclasses import dataclass
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_MOVEMENT_FILE = 'data/clustered_trajectory.npz'
+
+MOVEMENT_KEYS = ['nds_id', 'next_nds_id']
+# 每个转向保存的均值列
+MEAN_COLUMNS = ['exit_turn', 'travel_time', 'stop_time', 'link_length', 'avg_speed']
+
+
+@dataclass
+class MovementStore:
+    """按转向聚合的轨迹数据，columns为每个转向一行的定长列"""
+    columns: Dict[str, np.ndarray]
+    offsets: np.ndarray
+    exit_seconds: np.ndarray
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def exit_seconds_of(self, i: int) -> np.ndarray:
+        """第i个转向的所有离开时间"""
+        return self.exit_seconds[self.offsets[i]:self.offsets[i + 1]]
+
+    def counts(self) -> np.ndarray:
+        """每个转向的车辆数"""
+        return np.diff(self.offsets)
+
+    def to_frame(self) -> pd.DataFrame:
+        """每个转向一行的统计表（不含离开时间）"""
+        return pd.DataFrame(self.columns)
+
+
+def build_movements(df: pd.DataFrame) -> MovementStore:
+    """
+    按(nds_id, next_nds_id)聚合轨迹数据
+    df需要包含MOVEMENT_KEYS、exit_seconds和MEAN_COLUMNS，同一转向内保持原有顺序
+    """
+    df = df.sort_values(MOVEMENT_KEYS, kind='stable')
+    grouped = df.groupby(MOVEMENT_KEYS, sort=False)
+    summary = grouped[MEAN_COLUMNS].mean().reset_index()
+    offsets = np.zeros(len(summary) + 1, dtype=np.int64)
+    np.cumsum(grouped.size().to_numpy(), out=offsets[1:])
+    columns = {col: summary[col].to_numpy() for col in summary.columns}
+    return MovementStore(columns, offsets, df['exit_seconds'].to_numpy(dtype=np.int32))
+
+
+def save_movements(store: MovementStore, path: str = DEFAULT_MOVEMENT_FILE):
+    np.savez(path, offsets=store.offsets, exit_seconds=store.exit_seconds, **store.columns)
+
+
+def load_movements(path: str = DEFAULT_MOVEMENT_FILE) -> MovementStore:
+    with np.load(path) as data:
+        columns = {col: data[col] for col in MOVEMENT_KEYS + MEAN_COLUMNS}
+        return MovementStore(columns, data['offsets'], data['exit_seconds'])
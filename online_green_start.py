@@ -0,0 +1,167 @@
+"""
+在线（流式）推测绿灯开始时间
+
+infer_traffic_light.py需要完整的一小时轨迹文件。这里每个转向(nds_id, next_nds_id, dir)只保存
+周期内的直方图：第k个箱为[k * bin_width, (k + 1) * bin_width)秒，记录落在箱内的车辆数和相对时间之和，
+轨迹按小批次不断加入，随时可以由直方图得到当前的最佳绿灯开始时间和覆盖率（见green_window.py）。
+每个转向的内存只与周期内的箱数有关，与经过的车辆数无关。
+    estimator = OnlineGreenStartEstimator(cycle_data)
+    for batch in batches:                 # 包含nds_id、next_nds_id、exit_turn、exit_seconds列
+        estimator.update(batch)
+        report = estimator.report()       # 列与inferred_traffic_light_info.txt相同
+
+与infer_traffic_light.py的区别：转向方向由每条轨迹自己的exit_turn确定（不是整个转向的平均值），
+离开时间为整秒、周期为整数且箱宽为1秒时，同一转向的结果与按完整文件推测相同。
+"""
+import argparse
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from data_schema import read_filtered_trajectory, read_timing
+from green_window import find_green_start_from_histogram
+from timing_index import timing_index
+
+# 本步骤需要的列
+TRAJECTORY_COLUMNS = ['nds_id', 'next_nds_id', 'exit_turn', 'exit_seconds']
+TIMING_COLUMNS = ['inter_id', 'nds_id', 'dir', 'way', 'cycle_time', 'green_time']
+
+RESULT_COLUMNS = ['inter_id', 'nds_id', 'next_nds_id', 'dir', 'cycle_length', 'inferred_green_start',
+                  'green_time', 'vehicle_count', 'covered_vehicles', 'coverage_rate', 'way']
+
+
+def exit_turn_dirs(exit_turns) -> np.ndarray:
+    """
+    逐条将exit_turn映射到dir值（与map_exit_turn_to_dir相同），无法确定方向时为-1
+    dir: 0-直行, 1-左转, 2-右转, 7-掉头
+    """
+    exit_turns = np.asarray(exit_turns, dtype=float)
+    return np.select([np.abs(exit_turns) < 30,
+                      (exit_turns > 30) & (exit_turns < 150),
+                      (exit_turns < -30) & (exit_turns > -150),
+                      np.abs(exit_turns) > 150],
+                     [0, 1, 2, 7], default=-1)
+
+
+@dataclass
+class MovementHistogram:
+    """一个转向的配时信息和周期内的直方图"""
+    inter_id: int
+    cycle_length: float
+    green_time: float
+    way: object
+    counts: np.ndarray
+    sums: np.ndarray
+
+    def add(self, exit_seconds: np.ndarray, bin_width: float):
+        relative_times = exit_seconds % self.cycle_length
+        bins = np.minimum((relative_times // bin_width).astype(np.int64), len(self.counts) - 1)
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+        self.sums += np.bincount(bins, weights=relative_times, minlength=len(self.counts))
+
+
+class OnlineGreenStartEstimator:
+    """
+    按小批次加入轨迹，随时给出每个转向的绿灯开始时间
+    cycle_data: 信号灯周期数据，需要TIMING_COLUMNS中的列
+    bin_width: 直方图的箱宽（秒），也是绿灯开始时间的搜索步长
+    """
+
+    def __init__(self, cycle_data: pd.DataFrame, bin_width: float = 1):
+        self.cycle_data = cycle_data
+        self.cycle_index = timing_index(cycle_data)
+        self.bin_width = bin_width
+        self.movements: Dict[Tuple[int, int, int], MovementHistogram] = {}
+        # 没有配时数据或无法确定方向的轨迹数
+        self.unmatched = 0
+
+    def _new_movement(self, nds_id, dir_value) -> Optional[MovementHistogram]:
+        position = self.cycle_index.first((nds_id, dir_value))
+        if position is None:
+            return None
+        cycle_length = self.cycle_data['cycle_time'].iloc[position]
+        n_bins = int(np.ceil(cycle_length / self.bin_width))
+        return MovementHistogram(
+            inter_id=self.cycle_data['inter_id'].iloc[position],
+            cycle_length=cycle_length,
+            green_time=self.cycle_data['green_time'].iloc[position],
+            way=self.cycle_data['way'].iloc[position],
+            counts=np.zeros(n_bins, dtype=np.int64),
+            sums=np.zeros(n_bins))
+
+    def update(self, batch: pd.DataFrame):
+        """加入一批轨迹（需要nds_id、next_nds_id、exit_turn、exit_seconds列）"""
+        dirs = exit_turn_dirs(batch['exit_turn'])
+        exit_seconds = batch['exit_seconds'].to_numpy()
+        keys = pd.DataFrame({'nds_id': batch['nds_id'].to_numpy(), 'next_nds_id': batch['next_nds_id'].to_numpy(),
+                             'dir': dirs})
+        for key, rows in keys.groupby(['nds_id', 'next_nds_id', 'dir'], sort=False).indices.items():
+            key = tuple(int(value) for value in key)
+            movement = self.movements.get(key)
+            if movement is None:
+                movement = self._new_movement(key[0], key[2]) if key[2] >= 0 else None
+                if movement is None:
+                    self.unmatched += len(rows)
+                    continue
+                self.movements[key] = movement
+            movement.add(exit_seconds[rows], self.bin_width)
+
+    def estimate(self, key: Tuple[int, int, int]) -> Optional[dict]:
+        """某个转向当前的推测结果，没有数据时为None"""
+        movement = self.movements.get(key)
+        if movement is None:
+            return None
+        vehicle_count = int(movement.counts.sum())
+        best_start, max_covered = find_green_start_from_histogram(
+            movement.counts, movement.sums, self.bin_width, movement.cycle_length, movement.green_time,
+            self.bin_width)
+        return {
+            'inter_id': movement.inter_id,
+            'nds_id': key[0],
+            'next_nds_id': key[1],
+            'dir': key[2],
+            'cycle_length': movement.cycle_length,
+            'inferred_green_start': best_start,
+            'green_time': movement.green_time,
+            'vehicle_count': vehicle_count,
+            'covered_vehicles': max_covered,
+            'coverage_rate': max_covered / vehicle_count,  # 覆盖率
+            'way': movement.way
+        }
+
+    def report(self) -> pd.DataFrame:
+        """所有转向当前的推测结果，按转向第一次出现的顺序"""
+        return pd.DataFrame([self.estimate(key) for key in self.movements], columns=RESULT_COLUMNS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按小批次读取轨迹，在线推测绿灯开始时间')
+    parser.add_argument('--input', default='data/filtered_trajectory_16_17_by_light.txt', help='筛选后的轨迹文件')
+    parser.add_argument('--timing', default='data/merged_16h_timing_data.txt', help='合并后的配时数据')
+    parser.add_argument('--output', default='data/online_inferred_traffic_light_info.txt', help='最终结果文件')
+    parser.add_argument('--batch-size', type=int, default=10000, help='每批轨迹的行数')
+    parser.add_argument('--bin-width', type=float, default=1, help='周期内直方图的箱宽（秒）')
+    parser.add_argument('--report-every', type=int, default=10, help='每处理多少批输出一次当前的统计')
+    args = parser.parse_args()
+
+    cycle_data = read_timing(args.timing, columns=TIMING_COLUMNS, merged=True)
+    estimator = OnlineGreenStartEstimator(cycle_data, args.bin_width)
+
+    for i, batch in enumerate(read_filtered_trajectory(args.input, columns=TRAJECTORY_COLUMNS,
+                                                       chunksize=args.batch_size)):
+        estimator.update(batch)
+        if (i + 1) % args.report_every:
+            continue
+        report = estimator.report()
+        print(f"第{i + 1}批: 转向数 {len(report)}，平均覆盖度 {report['coverage_rate'].mean():.2%}，"
+              f"未匹配轨迹 {estimator.unmatched}")
+
+    report = estimator.report()
+    report.to_csv(args.output, sep='\t', index=False)
+    print(f"结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
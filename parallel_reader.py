@@ -0,0 +1,70 @@
+"""
+多进程按字节范围并行读取原始轨迹文件
+
+将文件按字节切分为若干段，每段的起止位置都对齐到行首，由进程池分别解析和处理，
+结果按文件中的先后顺序返回，因此输出顺序与单进程逐块读取一致。
+要求文件中没有跨行的字段（原始轨迹文件为不带引号的制表符分隔文本）。
+"""
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from data_schema import read_trajectory
+
+# 每段的默认大小，段数多于进程数时各进程的负载更均衡
+DEFAULT_RANGE_SIZE = 64 * 1024 * 1024
+
+
+def split_byte_ranges(path: str, range_size: int = DEFAULT_RANGE_SIZE) -> List[Tuple[int, int]]:
+    """将文件（不含表头）切分为对齐到行首的字节范围[start, end)"""
+    file_size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        f.readline()  # 跳过表头
+        start = f.tell()
+        while start < file_size:
+            end = start + range_size
+            if end >= file_size:
+                end = file_size
+            else:
+                f.seek(end)
+                f.readline()  # 移动到下一行行首
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def read_byte_range(path: str, start: int, end: int, columns: Optional[List[str]] = None):
+    """解析文件中[start, end)范围内的轨迹数据"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return read_trajectory(io.BytesIO(data), columns=columns, has_header=False)
+
+
+def _process_range(path, start, end, columns, func):
+    return func(read_byte_range(path, start, end, columns))
+
+
+def parallel_map_ranges(path: str, func: Callable, workers: Optional[int] = None,
+                        columns: Optional[List[str]] = None,
+                        range_size: int = DEFAULT_RANGE_SIZE) -> Iterator:
+    """
+    在进程池中对每段数据执行func(chunk)，按文件顺序逐个返回结果
+    func必须是模块级函数（或functools.partial），以便传给子进程
+    """
+    workers = workers or os.cpu_count()
+    ranges = split_byte_ranges(path, range_size)
+    # 同时在处理中的段数有上限，避免结果堆积占用内存
+    max_pending = workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for start, end in ranges:
+            pending.append(executor.submit(_process_range, path, start, end, columns, func))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,87 @@
+"""
+流水线阶段的声明和指纹
+
+Stage声明阶段的脚本、参数、输入文件和输出文件，stage_fingerprint对以下内容计算指纹：
+- 阶段的命令（脚本和参数）
+- 脚本及其导入的本仓库模块的源码（见local_dependencies）
+- 所有输入文件的内容（FileHashCache按文件大小和修改时间缓存哈希）
+run_pipeline.py用它跳过输入没有变化的阶段，filter_trajectory_pipeline.py用它判断已处理的日期是否需要重新处理。
+本模块不导入run_pipeline.py，修改流程（STAGES）不会改变各脚本的指纹。
+"""
+import ast
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@dataclass
+class Stage:
+    name: str
+    script: str
+    inputs: List[str]
+    outputs: List[str]
+    args: List[str] = field(default_factory=list)
+    # 不在默认流程中的阶段（需要额外的输入数据），只能通过--only执行
+    default: bool = True
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(8 * 1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileHashCache:
+    """按(大小, 修改时间)缓存文件内容哈希"""
+
+    def __init__(self, entries: Optional[Dict[str, dict]] = None):
+        self.entries = entries or {}
+
+    def hash(self, path: str) -> str:
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['sha256']
+        sha256 = _file_sha256(path)
+        self.entries[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+        return sha256
+
+
+def local_dependencies(script: str, seen: Optional[Set[str]] = None) -> Set[str]:
+    """脚本及其（递归）导入的本仓库模块文件"""
+    if seen is None:
+        seen = set()
+    if script in seen:
+        return seen
+    seen.add(script)
+    with open(os.path.join(REPO_DIR, script), 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            module_file = name.split('.')[0] + '.py'
+            if os.path.exists(os.path.join(REPO_DIR, module_file)):
+                local_dependencies(module_file, seen)
+    return seen
+
+
+def stage_fingerprint(stage: Stage, hashes: FileHashCache) -> str:
+    """计算阶段的指纹：命令、源码和输入文件内容"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([stage.script] + stage.args).encode('utf-8'))
+    for source in sorted(local_dependencies(stage.script)):
+        digest.update(f'source:{source}:{hashes.hash(os.path.join(REPO_DIR, source))}'.encode('utf-8'))
+    for path in stage.inputs:
+        digest.update(f'input:{path}:{hashes.hash(path)}'.encode('utf-8'))
+    return digest.hexdigest()
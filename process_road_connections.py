@@ -1,7 +1,9 @@
-import pandas as pd
+import argparse
 import numpy as np
+import pandas as pd
 import json
-from collections import defaultdict
+
+from data_schema import read_trajectory
 
 def map_exit_turn_to_dir(exit_turn):
     """
@@ -21,69 +23,127 @@ def map_exit_turn_to_dir(exit_turn):
     else:
         return None
 
-# 用于存储结果的字典
-result_dict = defaultdict(lambda: {'exit_turns': [], 'count': 0})
+# 本步骤需要的列，类型见data_schema.TRAJECTORY_DTYPES
+COLUMNS = ['nds_id', 'next_nds_id', 'exit_turn']
+
+# 可合并的部分统计量：行数、有效角度数、均值、离差平方和（Welford/Chan合并）、最小值、最大值
+# turn_count为行数（包括exit_turn缺失的行），均值等只由有效角度计算
+STAT_COLUMNS = ['rows', 'count', 'mean', 'm2', 'min', 'max']
+
+def partial_turn_stats(chunk):
+    """
+    计算一个数据块内每个(nds_id, next_nds_id)的部分统计量，去除next_nds_id为0或为空的行
+    返回(原始行数, 以(nds_id, next_nds_id)为索引的统计量)
+    """
+    turns = chunk.loc[chunk['next_nds_id'].fillna(0) != 0, COLUMNS]
+    exit_turn = turns['exit_turn'].astype('float64')
+    grouped = exit_turn.groupby([turns['nds_id'], turns['next_nds_id']])
+    stats = grouped.agg(['size', 'count', 'mean', 'min', 'max']).rename(columns={'size': 'rows'})
+    stats['m2'] = grouped.var(ddof=0) * stats['count']
+    return len(chunk), stats[STAT_COLUMNS]
+
+def merge_turn_stats(partials):
+    """一次合并多份部分统计量（Chan合并），内存只与(nds_id, next_nds_id)组合数和份数有关"""
+    both = pd.concat(partials)
+    levels = list(range(both.index.nlevels))
+    grouped = both.groupby(level=levels)
+    count = grouped['count'].sum()
+    # 没有有效角度的部分均值为nan，求和时跳过；全部没有时均值仍为nan
+    mean = (both['count'] * both['mean']).groupby(level=levels).sum() / count.where(count > 0)
+    # 各部分均值与合并后均值的偏差
+    delta = both['mean'].to_numpy() - mean.reindex(both.index).to_numpy()
+    m2 = (both['m2'] + both['count'] * delta ** 2).groupby(level=levels).sum()
+    return pd.DataFrame({
+        'rows': grouped['rows'].sum(),
+        'count': count,
+        'mean': mean,
+        'm2': m2,
+        'min': grouped['min'].min(),
+        'max': grouped['max'].max(),
+    })
+
+def collect_turn_stats(results):
+    """
+    按二叉树合并各块的部分统计量：合并过相同块数的两份结果才合并，
+    每份统计量只参与O(log 块数)次分组，最后剩下的几份一次合并
+    """
+    # 栈中为(已合并的块数, 统计量)，块数自底向上递减
+    stack = []
+    total_rows = 0
+    for chunk_rows, partial in results:
+        total_rows += chunk_rows
+        print(f"处理第 {total_rows} 行")
+        merged, size = partial, 1
+        while stack and stack[-1][0] == size:
+            merged, size = merge_turn_stats([stack.pop()[1], merged]), size * 2
+        stack.append((size, merged))
+    if not stack:
+        return None
+    return merge_turn_stats([stats for _, stats in stack])
+
+def build_connections(stats):
+    """将统计量整理为以from_road为主键的连接关系"""
+    results = {}
+    if stats is None:
+        return results
+    for (nds_id, next_nds_id), rows, count, avg_turn, m2, min_turn, max_turn in zip(
+            stats.index, stats['rows'], stats['count'], stats['mean'], stats['m2'], stats['min'], stats['max']):
+        from_road = str(nds_id)
+        dir_value = map_exit_turn_to_dir(avg_turn)
+        
+        # 创建路口连接关系
+        connection = {
+            'from_road': from_road,
+            'next_road': str(next_nds_id),
+            'avg_turn_angle': float(avg_turn),  # 确保是Python原生类型
+            'turn_count': int(rows),
+            'dir': int(dir_value) if dir_value is not None else None
+        }
+        
+        # 如果有多个样本，添加标准差（无偏估计）和极值
+        if rows > 1:
+            connection.update({
+                'turn_std': float(np.sqrt(m2 / (count - 1))) if count > 1 else float('nan'),
+                'min_turn': float(min_turn),
+                'max_turn': float(max_turn)
+            })
+        
+        # 使用from_road作为主键
+        if from_road not in results:
+            results[from_road] = []
+        results[from_road].append(connection)
+    return results
 
-# 定义数据类型
-dtype_dict = {
-    'nds_id': 'str',
-    'next_nds_id': 'str',
-    'exit_turn': 'float64'
-}
+def main():
+    parser = argparse.ArgumentParser(description='统计路段间的转向关系')
+    parser.add_argument('--dataset', default=None,
+                        help='Parquet数据集目录（见trajectory_store.py），指定后只读取需要的三列')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='并行解析原始文件的进程数（见parallel_reader.py），1为单进程')
+    args = parser.parse_args()
 
-# 分块读取数据
-chunk_size = 1000000  # 每次读取100万行
-total_rows = 0
-for chunk in pd.read_csv('data/trajectory_20250329.txt', 
-                        sep='\t', 
-                        chunksize=chunk_size,
-                        dtype=dtype_dict,
-                        low_memory=False):
-    total_rows += len(chunk)
-    print(f"处理第 {total_rows} 行")
-    # 对每个chunk进行处理
-    for _, row in chunk.iterrows():
-        # 去除next_nds_id为0的行
-        if row['next_nds_id'] != '0':
-            key = (row['nds_id'], row['next_nds_id'])
-            result_dict[key]['exit_turns'].append(float(row['exit_turn']))  # 确保转换为float
-            result_dict[key]['count'] += 1
+    # 分块读取数据
+    chunk_size = 1000000  # 每次读取100万行
+    input_file = 'data/trajectory_20250329.txt'
+    if args.dataset:
+        from trajectory_store import iter_trajectory_batches
+        results = map(partial_turn_stats, iter_trajectory_batches(args.dataset, columns=COLUMNS, batch_size=chunk_size))
+    elif args.workers > 1:
+        from parallel_reader import parallel_map_ranges
+        results = parallel_map_ranges(input_file, partial_turn_stats, workers=args.workers, columns=COLUMNS)
+    else:
+        results = map(partial_turn_stats, read_trajectory(input_file, columns=COLUMNS, chunksize=chunk_size))
 
-# 将结果转换为字典格式
-results = {}
-for (from_road, next_road), data in result_dict.items():
-    exit_turns = np.array(data['exit_turns'])  # 转换为numpy数组
-    avg_turn = np.mean(exit_turns)
-    turn_std = np.std(exit_turns, ddof=1)  # 使用无偏估计
-    dir_value = map_exit_turn_to_dir(avg_turn)
-    
-    # 创建路口连接关系
-    connection = {
-        'from_road': from_road,
-        'next_road': next_road,
-        'avg_turn_angle': float(avg_turn),  # 确保是Python原生类型
-        'turn_count': int(data['count']),
-        'dir': int(dir_value) if dir_value is not None else None
-    }
-    
-    # 如果有多个样本，添加标准差和极值
-    if len(exit_turns) > 1:
-        connection.update({
-            'turn_std': float(turn_std),
-            'min_turn': float(np.min(exit_turns)),
-            'max_turn': float(np.max(exit_turns))
-        })
-    
-    # 使用from_road作为主键
-    if from_road not in results:
-        results[from_road] = []
-    results[from_road].append(connection)
+    # 将结果转换为字典格式
+    connections = build_connections(collect_turn_stats(results))
 
-# 保存为JSON文件
-with open('data/intersection_turns.json', 'w', encoding='utf-8') as f:
-    json.dump(results, f, ensure_ascii=False, indent=2)
+    # 保存为JSON文件
+    with open('data/intersection_turns.json', 'w', encoding='utf-8') as f:
+        json.dump(connections, f, ensure_ascii=False, indent=2)
 
-# 打印处理完成的信息
-print(f"\n处理完成，共处理了 {len(results)} 个路口的连接关系")
-print(f"结果已保存到 data/intersection_turns.json")
+    # 打印处理完成的信息
+    print(f"\n处理完成，共处理了 {len(connections)} 个路口的连接关系")
+    print(f"结果已保存到 data/intersection_turns.json")
 
+if __name__ == "__main__":
+    main()
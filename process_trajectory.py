@@ -1,25 +1,16 @@
-import pandas as pd
-from datetime import datetime, timedelta
+from data_schema import read_filtered_trajectory
+from movement_store import DEFAULT_MOVEMENT_FILE, MEAN_COLUMNS, MOVEMENT_KEYS, build_movements, save_movements
 
-# 读取数据
-df = pd.read_csv('data/filtered_trajectory_16_17_by_light.txt', sep='\t')
-
-# 计算离开时间
-df['exit_time'] = pd.to_datetime(df['enter_time']) + pd.to_timedelta(df['travel_time'], unit='s')
+# 本步骤需要的列
+COLUMNS = MOVEMENT_KEYS + ['exit_seconds'] + MEAN_COLUMNS
 
-# 按nds_id和next_nds_id分组
-grouped = df.groupby(['nds_id', 'next_nds_id'])
+# 读取数据
+df = read_filtered_trajectory('data/filtered_trajectory_16_17_by_light.txt', columns=COLUMNS)
 
-# 计算每个组的统计信息
-result = grouped.agg({
-    'exit_time': lambda x: ','.join(x.astype(str)),  # 保留所有离开时间
-    'exit_turn': 'mean',   # 计算平均转向角度
-    'travel_time': 'mean', # 计算平均行驶时间
-    'stop_time': 'mean',   # 计算平均停车时间
-    'link_length': 'mean', # 计算平均路段长度
-    'avg_speed': 'mean'    # 计算平均速度
-}).reset_index()
+# 按nds_id和next_nds_id分组：保留所有离开时间（北京时间当天的秒数），
+# 计算平均转向角度、行驶时间、停车时间、路段长度和速度
+movements = build_movements(df)
 
-# 保存结果
-result.to_csv('data/clustered_trajectory.txt', sep='\t', index=False)
-print("处理完成，结果已保存到 clustered_trajectory.txt") 
\ No newline at end of file
+# 保存结果，存储格式见movement_store.py
+save_movements(movements, DEFAULT_MOVEMENT_FILE)
+print(f"处理完成，共 {len(movements)} 个转向，结果已保存到 {DEFAULT_MOVEMENT_FILE}")
@@ -0,0 +1,192 @@
+"""
+按顺序执行整个处理流程，跳过输入没有变化的阶段
+
+每个阶段声明自己的脚本、参数、输入文件和输出文件。运行前对以下内容计算指纹：
+- 阶段的命令（脚本和参数）
+- 脚本及其导入的本仓库模块的源码
+- 所有输入文件的内容（按文件大小和修改时间缓存哈希，未变化的大文件不会重复计算）
+指纹与上次成功运行时相同且输出文件都存在时跳过该阶段（阶段声明和指纹的计算见pipeline_stages.py）。
+上游阶段重新运行但输出内容没有变化时，下游阶段同样会被跳过。
+
+用法：
+    python run_pipeline.py                      # 执行所有默认阶段
+    python run_pipeline.py --list               # 列出所有阶段
+    python run_pipeline.py --only infer_method2 merge_traffic_data
+    python run_pipeline.py --force              # 忽略缓存，全部重新执行
+    python run_pipeline.py --dry-run            # 只显示哪些阶段需要执行
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import List
+
+from pipeline_stages import REPO_DIR, FileHashCache, Stage, stage_fingerprint
+
+STATE_FILE = 'data/.pipeline_state.json'
+
+
+STAGES = [
+    # 信号灯数据分析
+    Stage('filter_data_by_link', 'filter_data_by_link.py',
+          inputs=['filtered_links_cleaned.json', 'DATA0329.txt'],
+          outputs=['data/filtered_DATA0329.txt', 'removed_nds_ids.txt']),
+    Stage('analyze_traffic_data', 'analyze_traffic_data.py',
+          inputs=['data/filtered_DATA0329.txt'],
+          outputs=['traffic_light_16.txt', 'data/analysis_results.txt', 'data/analysis_stats.json']),
+    Stage('complete_16h_data', 'complete_16h_data.py',
+          inputs=['data/filtered_DATA0329.txt'],
+          outputs=['data/complete_16h_data.txt', 'data/complete_24h_data.txt']),
+    Stage('merge_timing_data', 'merge_timing_data.py',
+          inputs=['data/complete_16h_data.txt'],
+          outputs=['data/merged_16h_timing_data.txt', 'data/merged_16h_timing_data.npz']),
+    # 轨迹数据处理
+    Stage('filter_trajectory_method1', 'filter_trajectory_pipeline.py', args=['--method', 'method1'],
+          inputs=['data/trajectory_20250329.txt', 'data/filtered_links_cleaned.json',
+                  'data/merged_16h_timing_data.txt'],
+          outputs=['data/filtered_trajectory_16_17_by_light_method1.txt',
+                   'data/filtered_trajectory_16_17_removed_by_link_method1.txt',
+                   'data/filtered_trajectory_16_17_removed_by_light_method1.txt']),
+    Stage('filter_trajectory_method2', 'filter_trajectory_pipeline.py', args=['--method', 'method2'],
+          inputs=['data/trajectory_20250329.txt', 'data/filtered_links_cleaned.json',
+                  'data/merged_16h_timing_data.txt'],
+          outputs=['data/filtered_trajectory_16_17_by_light.txt',
+                   'data/filtered_trajectory_16_17_removed_by_link.txt',
+                   'data/filtered_trajectory_16_17_removed_by_light.txt']),
+    # 相位推测方法1
+    Stage('infer_method1', 'infer_traffic_light_method1.py',
+          inputs=['data/filtered_trajectory_16_17_by_light_method1.txt', 'data/merged_16h_timing_data.npz'],
+          outputs=['data/inferred_traffic_light_method1.txt']),
+    Stage('reconstruct_method1', 'traffic_light_reconstruction.py',
+          inputs=['data/merged_16h_timing_data.txt', 'data/inferred_traffic_light_method1.txt'],
+          outputs=['data/reconstructed_method1.txt', 'data/unused_cycle_data.txt', 'data/unused_phase_data.txt']),
+    # 相位推测方法2
+    Stage('process_trajectory', 'process_trajectory.py',
+          inputs=['data/filtered_trajectory_16_17_by_light.txt'],
+          outputs=['data/clustered_trajectory.npz']),
+    Stage('estimate_cycles', 'cycle_estimation.py',
+          inputs=['data/clustered_trajectory.npz', 'data/merged_16h_timing_data.txt'],
+          outputs=['data/estimated_cycle_lengths.txt']),
+    Stage('infer_method2', 'infer_traffic_light.py',
+          inputs=['data/clustered_trajectory.npz', 'data/merged_16h_timing_data.npz'],
+          outputs=['data/inferred_traffic_light_info.txt', 'data/coverage_statistics.txt']),
+    # 全天按时段推测（需要全天的筛选结果，不在默认流程中）
+    Stage('filter_trajectory_all_day', 'filter_trajectory_pipeline.py',
+          args=['--method', 'method2', '--start', '00:00:00', '--end', '23:59:59'],
+          inputs=['data/trajectory_20250329.txt', 'data/filtered_links_cleaned.json',
+                  'data/merged_16h_timing_data.txt'],
+          outputs=['data/filtered_trajectory_0_23_by_light.txt'],
+          default=False),
+    Stage('infer_all_day', 'infer_traffic_light_all_day.py',
+          inputs=['data/filtered_trajectory_0_23_by_light.txt', 'data/filtered_DATA0329.txt'],
+          outputs=['data/inferred_traffic_light_all_day.txt'],
+          default=False),
+    # 合并相位数据
+    Stage('merge_traffic_data', 'merge_traffic_data.py',
+          inputs=['data/inferred_traffic_light_info.txt', 'data/reconstructed_method1.txt'],
+          outputs=['data/merged_traffic_light_info.json']),
+    Stage('inter_id_group', 'inter_id_group.py',
+          inputs=['data/merged_traffic_light_info.json'],
+          outputs=['data/grouped_traffic_light_info.json']),
+    # 信号灯冲突处理
+    Stage('traffic_light_optimizer', 'traffic_light_optimizer.py',
+          inputs=['data/grouped_traffic_light_info.json'],
+          outputs=['data/optimized_traffic_light_info.json', 'data/phase_conflicts.txt']),
+    # 推测道路连接关系
+    Stage('process_road_connections', 'process_road_connections.py',
+          inputs=['data/trajectory_20250329.txt'],
+          outputs=['data/intersection_turns.json']),
+    # 相位推测方法3
+    Stage('filter_inters_full_info', 'filter_inters_full_info_by_signal_info.py',
+          inputs=['data/inters_full_info.json'],
+          outputs=['data/processed_signal_info.json', 'data/final_signal_info.json'],
+          default=False),
+]
+
+
+def load_state(path: str = STATE_FILE) -> dict:
+    if not os.path.exists(path):
+        return {'stages': {}, 'files': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(state: dict, path: str = STATE_FILE):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run_stages(stages: List[Stage], force: bool = False, dry_run: bool = False) -> List[str]:
+    """依次执行各阶段，返回实际执行的阶段名"""
+    state = load_state()
+    hashes = FileHashCache(state.get('files'))
+    executed = []
+    for stage in stages:
+        missing = [path for path in stage.inputs if not os.path.exists(path)]
+        if missing and not dry_run:
+            raise FileNotFoundError(f"阶段 {stage.name} 缺少输入文件: {', '.join(missing)}")
+        if missing:
+            print(f"[需要执行] {stage.name}（缺少输入: {', '.join(missing)}）")
+            executed.append(stage.name)
+            continue
+
+        fingerprint = stage_fingerprint(stage, hashes)
+        outputs_exist = all(os.path.exists(path) for path in stage.outputs)
+        if not force and outputs_exist and state['stages'].get(stage.name) == fingerprint:
+            print(f"[跳过] {stage.name}：输入未变化")
+            continue
+
+        if dry_run:
+            print(f"[需要执行] {stage.name}")
+            executed.append(stage.name)
+            continue
+
+        print(f"[执行] {stage.name}: python {' '.join([stage.script] + stage.args)}")
+        subprocess.run([sys.executable, os.path.join(REPO_DIR, stage.script)] + stage.args, check=True)
+        missing_outputs = [path for path in stage.outputs if not os.path.exists(path)]
+        if missing_outputs:
+            raise RuntimeError(f"阶段 {stage.name} 没有生成输出文件: {', '.join(missing_outputs)}")
+
+        state['stages'][stage.name] = fingerprint
+        state['files'] = hashes.entries
+        save_state(state)
+        executed.append(stage.name)
+
+    state['files'] = hashes.entries
+    if not dry_run:
+        save_state(state)
+    return executed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按顺序执行处理流程，跳过输入没有变化的阶段')
+    parser.add_argument('--only', nargs='+', default=None, help='只执行指定的阶段（按流程顺序）')
+    parser.add_argument('--force', action='store_true', help='忽略缓存，重新执行所有选中的阶段')
+    parser.add_argument('--dry-run', action='store_true', help='只显示需要执行的阶段')
+    parser.add_argument('--list', action='store_true', help='列出所有阶段')
+    args = parser.parse_args()
+
+    if args.list:
+        for stage in STAGES:
+            flag = '' if stage.default else '（不在默认流程中）'
+            print(f"{stage.name}: python {' '.join([stage.script] + stage.args)}{flag}")
+        return
+
+    if args.only:
+        unknown = set(args.only) - {stage.name for stage in STAGES}
+        if unknown:
+            parser.error(f"未知的阶段: {', '.join(sorted(unknown))}")
+        stages = [stage for stage in STAGES if stage.name in args.only]
+    else:
+        stages = [stage for stage in STAGES if stage.default]
+
+    executed = run_stages(stages, force=args.force, dry_run=args.dry_run)
+    print(f"\n共 {len(stages)} 个阶段，{'需要' if args.dry_run else '实际'}执行 {len(executed)} 个")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+按键建立的哈希索引，替代循环中的整表布尔筛选
+
+各阶段在循环里用df[(df['nds_id'] == x) & (df['dir'] == y)]查找配时数据或推测结果，
+每次查找都要扫描整张表。KeyIndex只在建立时扫描一次，之后：
+    index = timing_index(cycle_data)               # 按(nds_id, dir)索引配时数据
+    rows = index.rows((nds_id, dir_val))           # 所有匹配行的位置，O(1)
+    row = index.first((nds_id, dir_val))           # 第一条匹配行的位置，没有时为None
+    positions = index.positions(df[['nds_id', 'dir']])   # 批量查找，没有匹配时为-1
+    unused = anti_join(df, used_keys, ['nds_id', 'dir'])  # 键不在used_keys中的行
+匹配行的位置按原表中的顺序排列，与布尔筛选后取iloc[0]的结果一致；键中有缺失值的行不参与匹配。
+"""
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# 配时数据按路段和转向方向索引
+LINK_DIR_KEY = ['nds_id', 'dir']
+# 推测结果按转向(nds_id -> next_nds_id)和方向索引
+MOVEMENT_KEY = ['nds_id', 'next_nds_id', 'dir']
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+
+def _key_arrays(frame: pd.DataFrame, columns: List[str]):
+    """键列的取值，分类列换成类别本身的取值"""
+    arrays = []
+    for col in columns:
+        values = frame[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+        arrays.append(values)
+    return arrays
+
+
+class KeyIndex:
+    """frame按columns建立的索引，查找结果为行的位置（可用于frame.iloc）"""
+
+    def __init__(self, frame: pd.DataFrame, columns: List[str]):
+        self.frame = frame
+        self.columns = list(columns)
+        keys = pd.DataFrame(dict(zip(self.columns, _key_arrays(frame, self.columns))))
+        valid = keys.notna().all(axis=1).to_numpy()
+        positions = np.flatnonzero(valid)
+        keys = keys[valid]
+        # 每个键第一次出现的位置，用于批量查找
+        first = ~keys.duplicated(keep='first').to_numpy()
+        self._first_index = pd.MultiIndex.from_frame(keys[first])
+        self._first_positions = positions[first]
+        # 每个键所有匹配行的位置在第一次逐个查找时才建立，只做批量查找时不需要
+        self._keys = keys
+        self._positions = positions
+        self._row_lookup = None
+
+    @property
+    def _rows(self):
+        if self._row_lookup is None:
+            grouped = self._keys.groupby(self.columns, sort=False).indices
+            self._row_lookup = {key: self._positions[idx] for key, idx in grouped.items()}
+        return self._row_lookup
+
+    def __len__(self):
+        return len(self._first_positions)
+
+    def __contains__(self, key: Tuple) -> bool:
+        return self._normalize(key) in self._rows
+
+    def _normalize(self, key):
+        return key[0] if len(self.columns) == 1 else tuple(key)
+
+    def rows(self, key: Tuple) -> np.ndarray:
+        """所有匹配行的位置"""
+        return self._rows.get(self._normalize(key), _EMPTY)
+
+    def first(self, key: Tuple) -> Optional[int]:
+        """第一条匹配行的位置，没有匹配时为None"""
+        rows = self.rows(key)
+        return int(rows[0]) if len(rows) else None
+
+    def positions(self, keys: pd.DataFrame) -> np.ndarray:
+        """批量查找keys中每一行第一条匹配行的位置，没有匹配时为-1"""
+        if len(self._first_positions) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        query = pd.MultiIndex.from_arrays(_key_arrays(keys, self.columns))
+        found = self._first_index.get_indexer(query)
+        return np.where(found >= 0, self._first_positions[found], -1)
+
+
+def timing_index(cycle_data: pd.DataFrame) -> KeyIndex:
+    """按(nds_id, dir)索引配时数据"""
+    return KeyIndex(cycle_data, LINK_DIR_KEY)
+
+
+def anti_join(frame: pd.DataFrame, keys: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    """frame中按columns比较、在keys中没有匹配的行（保持原顺序），键中有缺失值的行视为没有匹配"""
+    return frame[KeyIndex(keys, columns).positions(frame) < 0]
@@ -1,8 +1,12 @@
+import argparse
 import json
 from typing import List, Dict, Tuple, Set
 from dataclasses import dataclass
 from datetime import datetime
 
+import numpy as np
+import pandas as pd
+
 @dataclass
 class Phase:
     inter_id: str
@@ -18,6 +22,69 @@ class Phase:
     way: int
     data_source: str
 
+# 定义二维冲突关系 (way, dir) -> Set[(way, dir)]
+CONFLICTING_COMBINATIONS = {
+    # way 0 的冲突关系
+    (0, 0): {  # 直行
+        (0, 1), (0, 7),  # 同向的左转、掉头
+        (1, 0), (1, 1),  (1, 7)  # 正交道路的所有方向
+    },
+    (0, 1): {  # 左转
+        (0, 0), (0, 7),  # 同向的直行、掉头
+        (1, 0), (1, 1),  (1, 7)  # 正交道路的所有方向
+    },
+    (0, 2): {  # 右转
+    },
+    (0, 7): {  # 掉头
+        (0, 0), (0, 1),  # 同向的直行、左转
+        (1, 0), (1, 1),  (1, 7)  # 正交道路的直行、左转、右转、掉头
+    },
+
+    # way 1 的冲突关系
+    (1, 0): {  # 直行
+        (1, 1), (1, 7),  # 同向的左转、掉头
+        (0, 0), (0, 1),  (0, 7)  # 正交道路的所有方向
+    },
+    (1, 1): {  # 左转
+        (1, 0), (1, 7),  # 同向的直行、掉头
+        (0, 0), (0, 1),  (0, 7)  # 正交道路的所有方向
+    },
+    (1, 2): {  # 右转
+    },
+    (1, 7): {  # 掉头
+        (1, 0), (1, 1),  # 同向的直行、左转
+        (0, 0), (0, 1), (0, 7)  # 正交道路的直行、左转、右转、掉头
+    }
+}
+
+def compile_conflict_masks(conflicting_combinations: Dict[Tuple[int, int], Set[Tuple[int, int]]]):
+    """
+    把冲突关系编译为位掩码查找表
+    返回(每个(way, dir)组合的编号, 每个编号冲突的组合的位掩码)，不在冲突关系中的组合没有编号，与任何相位都不冲突
+    """
+    combinations = sorted(set(conflicting_combinations) | set().union(*conflicting_combinations.values()))
+    codes = {combo: code for code, combo in enumerate(combinations)}
+    masks = [0] * len(combinations)
+    for combo, others in conflicting_combinations.items():
+        for other in others:
+            masks[codes[combo]] |= 1 << codes[other]
+    return codes, masks
+
+def green_windows(green_start: float, green_time: float, cycle_length: float) -> List[Tuple[float, float]]:
+    """
+    绿灯时段在[0, cycle_length)上的区间[begin, end)，跨过周期末尾时拆为两段
+    绿灯时长不小于周期时为整个周期，绿灯时长不大于0时为绿灯开始时刻一点(begin == end)
+    """
+    start = green_start % cycle_length
+    if green_time >= cycle_length:
+        return [(0.0, cycle_length)]
+    if green_time <= 0:
+        return [(start, start)]
+    end = start + green_time
+    if end > cycle_length:
+        return [(start, cycle_length), (0.0, end - cycle_length)]
+    return [(start, end)]
+
 class TrafficLightOptimizer:
     def __init__(self, phases: List[Phase]):
         self.phases = phases
@@ -28,74 +95,56 @@ class TrafficLightOptimizer:
         for phase in self.phases:
             phase.cycle_length = self.cycle_length
         
-        # 定义二维冲突关系 (way, dir) -> Set[(way, dir)]
-        self.conflicting_combinations = {
-            # way 0 的冲突关系
-            (0, 0): {  # 直行
-                (0, 1), (0, 7),  # 同向的左转、掉头
-                (1, 0), (1, 1),  (1, 7)  # 正交道路的所有方向
-            },
-            (0, 1): {  # 左转
-                (0, 0), (0, 7),  # 同向的直行、掉头
-                (1, 0), (1, 1),  (1, 7)  # 正交道路的所有方向
-            },
-            (0, 2): {  # 右转   
-            },
-            (0, 7): {  # 掉头
-                (0, 0), (0, 1),  # 同向的直行、左转
-                (1, 0), (1, 1),  (1, 7)  # 正交道路的直行、左转、右转、掉头
-            },
-            
-            # way 1 的冲突关系
-            (1, 0): {  # 直行
-                (1, 1), (1, 7),  # 同向的左转、掉头
-                (0, 0), (0, 1),  (0, 7)  # 正交道路的所有方向
-            },
-            (1, 1): {  # 左转
-                (1, 0), (1, 7),  # 同向的直行、掉头
-                (0, 0), (0, 1),  (0, 7)  # 正交道路的所有方向
-            },
-            (1, 2): {  # 右转
-            },
-            (1, 7): {  # 掉头
-                (1, 0), (1, 1),  # 同向的直行、左转
-                (0, 0), (0, 1), (0, 7)  # 正交道路的直行、左转、右转、掉头
-            }
-        }
+        # 二维冲突关系 (way, dir) -> Set[(way, dir)]，检测时使用编译后的位掩码
+        self.conflicting_combinations = CONFLICTING_COMBINATIONS
+        self.combination_codes, self.conflict_masks = compile_conflict_masks(self.conflicting_combinations)
 
     def detect_conflicts(self) -> List[Tuple[Phase, Phase]]:
-        """检测相位冲突"""
-        conflicts = []
-        for i, phase1 in enumerate(self.phases):
-            for phase2 in self.phases[i+1:]:
-                if self._is_conflicting(phase1, phase2):
-                    conflicts.append((phase1, phase2))
-        return conflicts
-
-    def _is_conflicting(self, phase1: Phase, phase2: Phase) -> bool:
-        """判断两个相位是否冲突"""
-        # 获取两个相位的way和dir组合
-        combo1 = (phase1.way, phase1.dir)
-        combo2 = (phase2.way, phase2.dir)
-        
-        # 检查是否存在冲突关系
-        if combo1 in self.conflicting_combinations and combo2 in self.conflicting_combinations[combo1]:
-            # 计算两个相位的绿灯结束时间
-            end1 = phase1.green_start + phase1.green_time
-            end2 = phase2.green_start + phase2.green_time
-
-            # 考虑周期循环
-            if end1 > self.cycle_length:
-                end1 -= self.cycle_length
-            if end2 > self.cycle_length:
-                end2 -= self.cycle_length
-
-            # 检查时间重叠
-            if phase1.green_start <= phase2.green_start < end1:
-                return True
-            if phase2.green_start <= phase1.green_start < end2:
-                return True
-        return False
+        """
+        检测相位冲突：绿灯时段有重叠且(way, dir)冲突的两个相位
+        在循环时间轴上按端点排序扫描（跨过周期末尾的绿灯时段拆为两段），
+        每个相位开始时只与当前绿灯中、且位掩码表明有冲突的相位比较
+        返回的相位对按相位在列表中的顺序排列
+        """
+        # 事件：(时刻, 类型, 相位序号)，同一时刻先处理结束（区间为左闭右开），只有一点的相位最后处理
+        END, START, POINT = 0, 1, 2
+        events = []
+        for index, phase in enumerate(self.phases):
+            if (phase.way, phase.dir) not in self.combination_codes:
+                continue
+            if not (np.isfinite(phase.green_start) and np.isfinite(phase.green_time)):
+                continue
+            for begin, end in green_windows(phase.green_start, phase.green_time, self.cycle_length):
+                if end > begin:
+                    events.append((begin, START, index))
+                    events.append((end, END, index))
+                else:
+                    events.append((begin, POINT, index))
+        events.sort()
+
+        pairs = set()
+        active = {}                                   # 当前绿灯中的相位序号 -> 组合编号
+        active_counts = [0] * len(self.conflict_masks)  # 当前绿灯中每个组合的相位数
+        active_bits = 0                               # 当前绿灯中有相位的组合
+        for _, kind, index in events:
+            phase = self.phases[index]
+            code = self.combination_codes[(phase.way, phase.dir)]
+            if kind == END:
+                del active[index]
+                active_counts[code] -= 1
+                if active_counts[code] == 0:
+                    active_bits &= ~(1 << code)
+                continue
+            mask = self.conflict_masks[code]
+            if mask & active_bits:
+                for other, other_code in active.items():
+                    if mask >> other_code & 1:
+                        pairs.add((min(index, other), max(index, other)))
+            if kind == START:
+                active[index] = code
+                active_counts[code] += 1
+                active_bits |= 1 << code
+        return [(self.phases[i], self.phases[j]) for i, j in sorted(pairs)]
 
     def optimize_phases(self) -> List[Phase]:
         """优化相位时间安排"""
@@ -302,9 +351,91 @@ def save_phases_to_json(phases_by_intersection: Dict[str, List[Phase]], file_pat
     with open(file_path, 'w') as f:
         json.dump(data, f, indent=2)
 
+# 冲突表中每个相位的列
+CONFLICT_PHASE_COLUMNS = ['nds_id', 'next_nds_id', 'way', 'dir', 'green_start', 'green_time']
+
+def detect_conflicts_batch(phases_by_intersection: Dict[str, List[Phase]]) -> pd.DataFrame:
+    """
+    一次检测所有路口的相位冲突，结果与对每个路口调用TrafficLightOptimizer.detect_conflicts相同
+    每个路口的周期取该路口相位的最长周期（与TrafficLightOptimizer相同）
+    把每个相位的绿灯开始时刻s放在s和s + 周期两处，绿灯时段为[s, s + 绿灯时长)（最长为一个周期），
+    两个相位的绿灯时段重叠，当且仅当其中一个的开始时刻落在另一个的绿灯时段内：
+    按(路口, 时刻)排序后用二分查找找出每个绿灯时段内的所有开始时刻，再用冲突关系的位掩码查找表筛选
+    返回冲突表，每行一对冲突的相位：inter_id、phase1、phase2（相位在该路口列表中的序号，phase1 < phase2）
+    以及两个相位的CONFLICT_PHASE_COLUMNS（后缀_1、_2）
+    """
+    codes, masks = compile_conflict_masks(CONFLICTING_COMBINATIONS)
+    # 查找表：table[c1, c2]为两个组合是否冲突，最后一个编号为不在冲突关系中的组合
+    table = np.zeros((len(masks) + 1, len(masks) + 1), dtype=bool)
+    for code, mask in enumerate(masks):
+        table[code, :len(masks)] = [(mask >> other) & 1 for other in range(len(masks))]
+
+    phases = [phase for phase_list in phases_by_intersection.values() for phase in phase_list]
+    sizes = np.array([len(phase_list) for phase_list in phases_by_intersection.values()], dtype=np.int64)
+    inters = np.repeat(np.arange(len(sizes)), sizes)
+    positions = np.arange(len(phases)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    columns = ['inter_id', 'phase1', 'phase2'] + [f'{col}_{k}' for k in (1, 2) for col in CONFLICT_PHASE_COLUMNS]
+    if len(phases) == 0:
+        return pd.DataFrame(columns=columns)
+
+    combination_codes = np.array([codes.get((phase.way, phase.dir), len(masks)) for phase in phases])
+    cycle_lengths = np.array([phase.cycle_length for phase in phases], dtype=float)
+    inter_cycle_lengths = np.full(len(sizes), -np.inf)
+    np.maximum.at(inter_cycle_lengths, inters, cycle_lengths)
+    cycle_lengths = inter_cycle_lengths[inters]
+    green_starts = np.array([phase.green_start for phase in phases], dtype=float)
+    green_times = np.array([phase.green_time for phase in phases], dtype=float)
+    valid = np.isfinite(green_starts) & np.isfinite(green_times) & (combination_codes < len(masks))
+    starts = np.mod(green_starts, cycle_lengths)
+    ends = starts + np.clip(green_times, 0, cycle_lengths)
+
+    # 每个有效相位的开始时刻放在s和s + 周期两处，时刻转换为整数名次，使(路口, 时刻)可以合成一个整数键
+    rows = np.flatnonzero(valid)
+    points = np.concatenate([rows, rows])
+    point_times = np.concatenate([starts[rows], starts[rows] + cycle_lengths[rows]])
+    ranks = np.unique(np.concatenate([point_times, starts[rows], ends[rows]]), return_inverse=True)[1]
+    n_ranks = ranks.max(initial=0) + 1
+    point_ranks, start_ranks, end_ranks = np.split(ranks, [len(points), len(points) + len(rows)])
+    point_keys = inters[points] * n_ranks + point_ranks
+    order = np.argsort(point_keys, kind='stable')
+    sorted_keys = point_keys[order]
+
+    # 每个绿灯时段[s, e)内的开始时刻
+    low = np.searchsorted(sorted_keys, inters[rows] * n_ranks + start_ranks, side='left')
+    high = np.searchsorted(sorted_keys, inters[rows] * n_ranks + end_ranks, side='left')
+    counts = high - low
+    first = np.repeat(rows, counts)
+    rank = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    second = points[order[np.repeat(low, counts) + rank]]
+    keep = (first != second) & table[combination_codes[first], combination_codes[second]]
+    pairs = np.unique(np.stack([np.minimum(first[keep], second[keep]), np.maximum(first[keep], second[keep])], axis=1),
+                      axis=0).reshape(-1, 2)
+
+    inter_ids = list(phases_by_intersection.keys())
+    conflicts = pd.DataFrame({
+        'inter_id': [inter_ids[inter] for inter in inters[pairs[:, 0]]],
+        'phase1': positions[pairs[:, 0]],
+        'phase2': positions[pairs[:, 1]],
+    })
+    for k, column in ((1, pairs[:, 0]), (2, pairs[:, 1])):
+        for col in CONFLICT_PHASE_COLUMNS:
+            conflicts[f'{col}_{k}'] = [getattr(phases[i], col) for i in column]
+    return conflicts[columns]
+
 def main():
+    parser = argparse.ArgumentParser(description='检测并处理各路口的相位冲突')
+    parser.add_argument('--conflicts-output', default='data/phase_conflicts.txt',
+                        help='所有路口的冲突表（优化前），为空时不输出')
+    args = parser.parse_args()
+
     # 加载数据
     phases_by_intersection = load_phases_from_json('data/grouped_traffic_light_info.json')
+
+    # 一次检测所有路口的冲突
+    conflicts = detect_conflicts_batch(phases_by_intersection)
+    conflict_counts = conflicts['inter_id'].value_counts()
+    if args.conflicts_output:
+        conflicts.to_csv(args.conflicts_output, sep='\t', index=False)
     
     # 处理每个路口
     for inter_id, phases in phases_by_intersection.items():
@@ -313,10 +444,10 @@ def main():
         optimizer = TrafficLightOptimizer(phases)
         
         # 检测冲突
-        conflicts = optimizer.detect_conflicts()
-        print(f"检测到 {len(conflicts)} 个相位冲突")
+        n_conflicts = int(conflict_counts.get(inter_id, 0))
+        print(f"检测到 {n_conflicts} 个相位冲突")
         
-        if len(conflicts) > 0:
+        if n_conflicts > 0:
             # 优化相位
             optimized_phases = optimizer.optimize_phases()
             # 更新该路口的相位数据
@@ -327,4 +458,4 @@ def main():
     print("相位优化完成，结果已保存到 optimized_traffic_light_info.json")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
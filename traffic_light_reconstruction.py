@@ -1,140 +1,164 @@
+import argparse
+
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-from collections import defaultdict
+
+from data_schema import read_timing
+from inter_shards import map_shards, split_by_inter_id
+from timing_index import LINK_DIR_KEY, KeyIndex, anti_join
+
+# 推测结果中确定所属转向的列，用于统计未使用的推测结果
+PHASE_KEY = ['nds_id', 'next_nds_id', 'exit_turn']
+# 周期数据的键，用于统计未使用的周期数据
+CYCLE_KEY = ['inter_id', 'nds_id', 'dir']
 
 def load_data():
-    # 读取信号灯周期数据
-    cycle_data = pd.read_csv('data/merged_16h_timing_data.txt', sep='\t')
-    
+    # 读取信号灯周期数据（未使用的周期数据需要完整输出，因此读取所有列）
+    cycle_data = read_timing('data/merged_16h_timing_data.txt', merged=True)
+
     # 读取信号灯推测绿灯开始时间数据
     phase_data = pd.read_csv('data/inferred_traffic_light_method1.txt', sep='\t')
-    
+
     return cycle_data, phase_data
 
-def find_best_cycle_start(phase_times, cycle_time):
+def circular_cycle_starts(phase_seconds, cycle_times, segments, n_segments, weights=None):
     """
-    用模周期下的单位圆均值方法，寻找最优周期起点。
+    用模周期下的单位圆均值方法，一次计算多组样本的最优周期起点。
+    phase_seconds: 绿灯开始时间（北京时间当天的秒数）数组
+    cycle_times: 每个样本所在组的周期时长
+    segments: 每个样本所在组的编号（0 ~ n_segments-1）
+    weights: 每个样本的权重（如该相位的车辆数），为None时等权
+    返回每组起点在周期内的偏移秒数，没有样本的组为0
     """
-    if not phase_times:
-        return None
-
-    # 转为秒值（从午夜开始）
-    seconds_list = [(t - datetime.combine(t.date(), datetime.min.time())).total_seconds() for t in phase_times]
-    
     # 映射到单位圆（单位周期为2π）
-    angles = [2 * np.pi * (s % cycle_time) / cycle_time for s in seconds_list]
-    
-    # 求单位向量平均方向
-    sin_sum = np.sum(np.sin(angles))
-    cos_sum = np.sum(np.cos(angles))
-    
+    angles = 2 * np.pi * (np.asarray(phase_seconds) % cycle_times) / cycle_times
+    if weights is None:
+        weights = np.ones(len(angles))
+
+    # 按组求单位向量的（加权）和
+    sin_sum = np.bincount(segments, weights=weights * np.sin(angles), minlength=n_segments)
+    cos_sum = np.bincount(segments, weights=weights * np.cos(angles), minlength=n_segments)
+
     mean_angle = np.arctan2(sin_sum, cos_sum)  # 返回值范围 [-π, π]
-    if mean_angle < 0:
-        mean_angle += 2 * np.pi  # 映射到 [0, 2π]
+    mean_angle = np.where(mean_angle < 0, mean_angle + 2 * np.pi, mean_angle)  # 映射到 [0, 2π]
 
     # 反推回起点在周期内的偏移秒数
-    offset_in_cycle = (cycle_time * mean_angle) / (2 * np.pi)
-
-    return offset_in_cycle
-
-def reconstruct_traffic_light(cycle_data, phase_data):
-    # 创建结果DataFrame
-    result = []
-    
-    # 用于统计未使用的数据
-    used_cycle_keys = set()  # 记录已使用的cycle_data的键
-    used_phase_keys = set()  # 记录已使用的phase_data的键
-    
-    # 遍历每个路口
-    for inter_id in cycle_data['inter_id'].unique():
-        # 获取该路口的cycle_data和phase_data
-        inter_cycle_data = cycle_data[cycle_data['inter_id'] == inter_id]
-        inter_phase_data = phase_data[phase_data['nds_id'].isin(inter_cycle_data['nds_id'])]
-        
-        # 遍历每个方向
-        for _, cycle_row in inter_cycle_data.iterrows():
-            nds_id = cycle_row['nds_id']
-            dir_value = cycle_row['dir']
-            cycle_time = cycle_row['cycle_time']
-            green_time = cycle_row['green_time']
-            red_time = cycle_row['red_time']
-            way=cycle_row['way']
-            
-            # 记录cycle_data的键
-            cycle_key = (inter_id, nds_id, dir_value)
-
-            # 获取这个方向相关的phase_data
-            phase_data_dir = inter_phase_data[
-                (inter_phase_data['nds_id'] == nds_id) & 
-                (inter_phase_data['dir'] == dir_value)
-            ]
-            
-            # 获取该方向的绿灯开始时间
-            phase_times = phase_data_dir['green_start_time'].tolist()
-
-            if not phase_times:
-                # 跳过数据
-                
-                continue
-                
-            next_nds_id = str(phase_data_dir['next_nds_id'].iloc[0])
-            
-            # 记录phase_data的键
-            phase_key = (nds_id, next_nds_id, phase_data_dir['exit_turn'].iloc[0])
-            used_phase_keys.add(phase_key)
-            
-            # 将时间字符串转换为datetime对象
-            phase_times = [datetime.strptime(t, '%H:%M:%S') for t in phase_times]
-            
-            # 找出最合理的周期起始点
-            cycle_start = find_best_cycle_start(phase_times, cycle_time)
-            if not cycle_start:
-                continue
-            
-            first_cycle_start = cycle_start%cycle_time
-            
-            # 储存结果，只需要周期起始时间和周期时长
-            result.append({
-                'inter_id': inter_id,
-                'nds_id': nds_id,
-                'next_nds_id': next_nds_id,
-                'dir': dir_value,
-                'cycle_start': first_cycle_start,
-                'cycle_time': cycle_time,
-                'green_time': green_time,
-                'red_time': red_time,
-                'way': way
-            })
-            used_cycle_keys.add(cycle_key)
-    
-    # 统计未使用的数据
-    unused_cycle_data = []
-    for _, row in cycle_data.iterrows():
-        key = (row['inter_id'], row['nds_id'], row['dir'])
-        if key not in used_cycle_keys:
-            unused_cycle_data.append(row)
-    
-    unused_phase_data = []
-    for _, row in phase_data.iterrows():
-        key = (row['nds_id'], str(row['next_nds_id']), row['exit_turn'])
-        if key not in used_phase_keys:
-            unused_phase_data.append(row)
-    
-    return pd.DataFrame(result), pd.DataFrame(unused_cycle_data), pd.DataFrame(unused_phase_data)
+    segment_cycle_times = np.zeros(n_segments)
+    segment_cycle_times[segments] = cycle_times
+    return (segment_cycle_times * mean_angle) / (2 * np.pi)
+
+def find_best_cycle_start(phase_seconds, cycle_time, weights=None):
+    """
+    单个方向的最优周期起点，phase_seconds为绿灯开始时间（北京时间当天的秒数）数组
+    """
+    if len(phase_seconds) == 0:
+        return None
+    n = len(phase_seconds)
+    return circular_cycle_starts(phase_seconds, np.full(n, cycle_time, dtype=float),
+                                 np.zeros(n, dtype=np.int64), 1, weights)[0]
+
+def _reconstruct_inters(task):
+    """
+    还原一组路口的信号（可在子进程中执行）
+    task: (周期数据, 推测的绿灯开始时间, 权重列)，周期数据已按路口第一次出现的顺序排列，index为结果排序用的序号
+    返回(结果, 已使用的周期数据的键, 已使用的推测结果的键)，结果的index为对应周期数据的序号
+    """
+    cycle_data, phase_data, weight_column = task
+    # 按(nds_id, dir)对推测结果分组，以该组第一条推测结果的位置作为组号
+    phase_index = KeyIndex(phase_data, LINK_DIR_KEY)
+    phase_groups = phase_index.positions(phase_data)
+    cycle_groups = phase_index.positions(cycle_data)
+
+    # 没有推测结果的方向跳过
+    matched = np.flatnonzero(cycle_groups >= 0)
+    groups = cycle_groups[matched]
+
+    # 把每个方向对应的推测结果展开为样本：推测结果按组号排列后，每组是连续的一段
+    valid = np.flatnonzero(phase_groups >= 0)
+    sorted_phases = valid[np.argsort(phase_groups[valid], kind='stable')]
+    group_sizes = np.bincount(phase_groups[valid], minlength=len(phase_data))
+    group_offsets = np.cumsum(group_sizes) - group_sizes
+    counts = group_sizes[groups]
+    segments = np.repeat(np.arange(len(matched)), counts)
+    rank = np.arange(len(segments)) - np.repeat(np.cumsum(counts) - counts, counts)
+    samples = sorted_phases[np.repeat(group_offsets[groups], counts) + rank]
+
+    # 找出最合理的周期起始点，绿灯开始时间为当天的秒数
+    cycle_time = cycle_data['cycle_time'].to_numpy(dtype=float)[matched]
+    weights = phase_data[weight_column].to_numpy(dtype=float)[samples] if weight_column else None
+    cycle_start = circular_cycle_starts(phase_data['green_start_seconds'].to_numpy()[samples],
+                                        cycle_time[segments], segments, len(matched), weights)
+
+    # 每个方向记录该组第一条推测结果所属的转向
+    used_phase_keys = phase_data.iloc[groups][PHASE_KEY]
+    # 起点恰好为0时与原先的逐个方向计算一致，不输出结果
+    kept = cycle_start != 0
+    rows = cycle_data.iloc[matched[kept]]
+
+    # 储存结果，只需要周期起始时间和周期时长
+    result = pd.DataFrame({
+        'inter_id': rows['inter_id'],
+        'nds_id': rows['nds_id'],
+        'next_nds_id': phase_data['next_nds_id'].iloc[groups[kept]].astype(str).to_numpy(),
+        'dir': rows['dir'],
+        'cycle_start': cycle_start[kept] % cycle_time[kept],
+        'cycle_time': rows['cycle_time'],
+        'green_time': rows['green_time'],
+        'red_time': rows['red_time'],
+        'way': rows['way']
+    }, index=rows.index)
+    return result, rows[CYCLE_KEY], used_phase_keys
+
+def reconstruct_traffic_light(cycle_data, phase_data, workers=1, weight_column=None):
+    """
+    还原每个路口的信号，weight_column为推测结果中作为样本权重的列（如vehicle_count），为None时等权
+    workers大于1时按路口(inter_id)分片，由多个进程计算（见inter_shards.py）
+    """
+    # 按路口第一次出现的顺序排列周期数据，index为结果的序号，分片结果按序号拼回后与单进程相同
+    ordered = cycle_data.iloc[np.argsort(pd.factorize(cycle_data['inter_id'])[0], kind='stable')]
+    ordered = ordered.reset_index(drop=True)
+    if workers > 1:
+        tasks = []
+        for rows in split_by_inter_id(ordered['inter_id'], workers):
+            shard_cycle_data = ordered.iloc[rows]
+            # 只传入本分片路段的推测结果
+            tasks.append((shard_cycle_data, phase_data[phase_data['nds_id'].isin(shard_cycle_data['nds_id'])],
+                          weight_column))
+    else:
+        tasks = [(ordered, phase_data, weight_column)]
+    shard_results = map_shards(_reconstruct_inters, tasks, workers)
+    result = pd.concat([frame for frame, _, _ in shard_results]).sort_index().reset_index(drop=True)
+    used_cycle_keys = pd.concat([keys for _, keys, _ in shard_results])
+    used_phase_keys = pd.concat([keys for _, _, keys in shard_results])
+
+    # 统计未使用的数据：键不在已使用的键中的行
+    unused_cycle_data = anti_join(cycle_data, used_cycle_keys, CYCLE_KEY)
+    unused_phase_data = anti_join(phase_data, used_phase_keys, PHASE_KEY)
+
+    return result, unused_cycle_data, unused_phase_data
 
 def main():
+    parser = argparse.ArgumentParser(description='由方法1推测的绿灯开始时间还原信号周期起点')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='按路口分片并行计算的进程数（见inter_shards.py），1为单进程')
+    parser.add_argument('--weight-column', default=None,
+                        help='推测结果中作为样本权重的列（如vehicle_count），默认等权')
+    args = parser.parse_args()
+
     # 加载数据
     cycle_data, phase_data = load_data()
-    
+    if args.weight_column and args.weight_column not in phase_data.columns:
+        parser.error(f"推测结果中没有列 {args.weight_column}（vehicle_count需要infer_traffic_light_method1.py --vehicle-count）")
+
     # 还原信号灯信号并获取未使用的数据
-    reconstructed_signals, unused_cycle_data, unused_phase_data = reconstruct_traffic_light(cycle_data, phase_data)
-    
+    reconstructed_signals, unused_cycle_data, unused_phase_data = reconstruct_traffic_light(
+        cycle_data, phase_data, args.workers, args.weight_column)
+
     # 保存结果
     reconstructed_signals.to_csv('data/reconstructed_method1.txt', sep='\t', index=False)
     unused_cycle_data.to_csv('data/unused_cycle_data.txt', sep='\t', index=False)
     unused_phase_data.to_csv('data/unused_phase_data.txt', sep='\t', index=False)
-    
+
     # 打印统计信息
     print(f"总周期数据条数: {len(cycle_data)}")
     print(f"未使用的周期数据条数: {len(unused_cycle_data)}")
@@ -145,4 +169,4 @@ def main():
     print(f"相位数据利用率: {(len(phase_data) - len(unused_phase_data)) / len(phase_data) * 100:.2f}%")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
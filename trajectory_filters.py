@@ -0,0 +1,110 @@
+"""
+轨迹数据的列式筛选引擎
+
+离开时间按整数秒（UTC时间戳）计算，时间窗口和各方法的筛选条件都用数组比较完成，
+不再逐行构造datetime/timedelta。
+"""
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# 北京时间相对UTC的偏移（秒），Asia/Shanghai没有夏令时，直接用固定偏移
+LOCAL_UTC_OFFSET = 8 * 3600
+SECONDS_PER_DAY = 24 * 3600
+
+
+@dataclass(frozen=True)
+class FilterProfile:
+    """一套轨迹筛选规则"""
+    name: str
+    # 等待时间的开区间 (下界, 上界)，None表示不限制
+    stop_time_range: Optional[Tuple[float, float]]
+    # 筛去next_nds_id为0的数据
+    require_next_link: bool
+    # 筛去stop_time等于travel_time的数据
+    exclude_full_stop: bool
+    # 输出文件名后缀
+    output_suffix: str
+
+
+# 方法1：
+# 1. 筛选出时间窗口内离开的数据
+# 2. 筛去等待时间小于等于1或大于等于600的数据
+# 3. 筛去next_nds_id为0的数据
+# 4. 筛去stop_time等于travel_time的数据
+#
+# 方法2：
+# 1. 筛选出时间窗口内离开的数据
+# 2. 筛去next_nds_id为0的数据
+# 3. 筛去stop_time等于travel_time的数据
+FILTER_PROFILES = {
+    'method1': FilterProfile(name='method1', stop_time_range=(1, 600), require_next_link=True,
+                             exclude_full_stop=True, output_suffix='_method1'),
+    'method2': FilterProfile(name='method2', stop_time_range=None, require_next_link=True,
+                             exclude_full_stop=True, output_suffix=''),
+}
+
+
+def parse_clock(clock_str: str) -> int:
+    """将HH:MM[:SS]格式的时间转换为当天的秒数"""
+    parts = [int(p) for p in clock_str.split(':')]
+    if len(parts) == 2:
+        parts.append(0)
+    h, m, s = parts
+    return h * 3600 + m * 60 + s
+
+
+def exit_epoch_seconds(chunk: pd.DataFrame) -> np.ndarray:
+    """计算离开时间的UTC时间戳（秒），enter_time为UTC时间戳"""
+    enter = chunk['enter_time'].to_numpy(dtype=np.int64)
+    travel = np.floor(chunk['travel_time'].to_numpy(dtype=np.float64))
+    # travel_time缺失时无法得到离开时间，用-1标记
+    travel = np.where(np.isfinite(travel), travel, -1).astype(np.int64)
+    return enter + travel
+
+
+def local_seconds_of_day(epoch_seconds: np.ndarray) -> np.ndarray:
+    """UTC时间戳转换为北京时间当天的秒数"""
+    return (epoch_seconds + LOCAL_UTC_OFFSET) % SECONDS_PER_DAY
+
+
+def exit_seconds_of_day(chunk: pd.DataFrame) -> np.ndarray:
+    """离开时间在北京时间当天的秒数（int32），推测和还原阶段统一使用这一时间表示"""
+    return local_seconds_of_day(exit_epoch_seconds(chunk)).astype(np.int32)
+
+
+def time_window_mask(seconds_of_day: np.ndarray, window_start: int, window_end: int) -> np.ndarray:
+    """离开时间是否在[window_start, window_end]闭区间内，支持跨零点的窗口"""
+    if window_start <= window_end:
+        return (seconds_of_day >= window_start) & (seconds_of_day <= window_end)
+    return (seconds_of_day >= window_start) | (seconds_of_day <= window_end)
+
+
+def profile_mask(chunk: pd.DataFrame, profile: FilterProfile) -> np.ndarray:
+    """按筛选方案计算除时间窗口以外的条件"""
+    mask = np.ones(len(chunk), dtype=bool)
+    if profile.require_next_link:
+        # next_nds_id为空时同样没有下一路段
+        mask &= chunk['next_nds_id'].fillna(0).to_numpy() != 0
+    stop_time = chunk['stop_time'].to_numpy(dtype=np.float64)
+    if profile.exclude_full_stop:
+        mask &= stop_time != chunk['travel_time'].to_numpy(dtype=np.float64)
+    if profile.stop_time_range is not None:
+        low, high = profile.stop_time_range
+        mask &= (stop_time > low) & (stop_time < high)
+    return mask
+
+
+def filter_mask(chunk: pd.DataFrame, profile: FilterProfile, window_start: int, window_end: int) -> np.ndarray:
+    """计算一个数据块的完整筛选结果"""
+    exit_epoch = exit_epoch_seconds(chunk)
+    in_window = time_window_mask(local_seconds_of_day(exit_epoch), window_start, window_end)
+    in_window &= chunk['travel_time'].notna().to_numpy()
+    return in_window & profile_mask(chunk, profile)
+
+
+def to_local_datetime(enter_time: pd.Series) -> pd.Series:
+    """将UTC时间戳转换为北京时间，输出格式与原有文件保持一致"""
+    return pd.to_datetime(enter_time, unit='s', utc=True).dt.tz_convert('Asia/Shanghai')
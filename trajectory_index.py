@@ -0,0 +1,170 @@
+"""
+按nds_id索引的内存映射二进制轨迹存储
+
+每个数值列保存为一个定长的.npy文件，记录按(nds_id, next_nds_id, 离开时间)排序，
+links.npy保存所有nds_id，link_offsets.npy保存每个nds_id的记录范围。
+查询时用np.load(mmap_mode='r')打开，返回的是文件上的零拷贝视图：
+    index = TrajectoryIndex('data/trajectory_index')
+    records = index.link(123456)                  # 一个路段的所有记录
+    records = index.movement(123456, 654321)      # 一个转向的所有记录，按离开时间排序
+
+构建时先统计每个nds_id的记录数，再把记录按计数排序的方式直接写到最终位置，
+最后分块对每个路段内部排序，内存占用只与块大小有关，不需要把整个文件读入内存。
+
+用法：
+    python trajectory_index.py --input data/trajectory_20250329.txt --output data/trajectory_index
+    python trajectory_index.py --dataset data/trajectory_parquet --output data/trajectory_index
+"""
+import argparse
+import os
+import shutil
+from typing import Dict
+
+import numpy as np
+
+from data_schema import read_trajectory
+from trajectory_filters import exit_epoch_seconds
+
+DEFAULT_INDEX_DIR = 'data/trajectory_index'
+
+# 存储的定长列及其类型，整数列中缺失的值（如travel_time）保存为-1，浮点数列保存为nan
+INDEX_COLUMNS = {
+    'nds_id': np.int64,
+    'next_nds_id': np.int64,
+    'enter_time': np.int64,    # UTC时间戳（秒）
+    'exit_epoch': np.int64,    # 离开时间，UTC时间戳（秒）
+    'travel_time': np.int32,
+    'stop_time': np.int32,
+    'exit_turn': np.float32,
+    'link_length': np.float32,
+    'avg_speed': np.float32,
+}
+
+# 从原始数据读取的列（exit_epoch由enter_time和travel_time计算）
+SOURCE_COLUMNS = [col for col in INDEX_COLUMNS if col != 'exit_epoch']
+
+
+def _iter_chunks(input_file=None, dataset_dir=None, chunk_size=1000000):
+    """读取构建索引需要的列，补充exit_epoch"""
+    if dataset_dir:
+        from trajectory_store import iter_trajectory_batches
+        yield from iter_trajectory_batches(dataset_dir, columns=list(INDEX_COLUMNS), batch_size=chunk_size)
+        return
+    for chunk in read_trajectory(input_file, columns=SOURCE_COLUMNS, chunksize=chunk_size):
+        chunk['exit_epoch'] = exit_epoch_seconds(chunk)
+        yield chunk
+
+
+def build_index(index_dir=DEFAULT_INDEX_DIR, input_file=None, dataset_dir=None,
+                chunk_size=1000000, sort_block_rows=20000000):
+    """构建内存映射存储，返回记录总数"""
+    # 第一遍：统计每个nds_id的记录数
+    counts = None
+    for chunk in _iter_chunks(input_file, dataset_dir, chunk_size):
+        chunk_counts = chunk['nds_id'].value_counts()
+        counts = chunk_counts if counts is None else counts.add(chunk_counts, fill_value=0)
+    if counts is None:
+        raise ValueError("轨迹数据为空，无法构建索引")
+    counts = counts.sort_index().astype(np.int64)
+    links = counts.index.to_numpy(dtype=np.int64)
+    offsets = np.zeros(len(links) + 1, dtype=np.int64)
+    np.cumsum(counts.to_numpy(), out=offsets[1:])
+    total_rows = int(offsets[-1])
+
+    if os.path.exists(index_dir):
+        shutil.rmtree(index_dir)
+    os.makedirs(index_dir)
+    np.save(os.path.join(index_dir, 'links.npy'), links)
+    np.save(os.path.join(index_dir, 'link_offsets.npy'), offsets)
+    columns = {
+        col: np.lib.format.open_memmap(os.path.join(index_dir, f'{col}.npy'), mode='w+',
+                                       dtype=dtype, shape=(total_rows,))
+        for col, dtype in INDEX_COLUMNS.items()
+    }
+
+    # 第二遍：按nds_id把记录写到各自的范围内
+    cursor = offsets[:-1].copy()
+    for chunk in _iter_chunks(input_file, dataset_dir, chunk_size):
+        link_idx = np.searchsorted(links, chunk['nds_id'].to_numpy(dtype=np.int64))
+        order = np.argsort(link_idx, kind='stable')
+        sorted_idx = link_idx[order]
+        # 块内每条记录在同一nds_id中的序号
+        group_start = np.r_[0, np.flatnonzero(np.diff(sorted_idx)) + 1]
+        group_sizes = np.diff(np.r_[group_start, len(sorted_idx)])
+        rank = np.arange(len(sorted_idx)) - np.repeat(group_start, group_sizes)
+        positions = cursor[sorted_idx] + rank
+        for col, dtype in INDEX_COLUMNS.items():
+            na_value = -1 if np.issubdtype(dtype, np.integer) else np.nan
+            columns[col][positions] = chunk[col].to_numpy(dtype=dtype, na_value=na_value)[order]
+        cursor[sorted_idx[group_start]] += group_sizes
+        print(f"已写入 {int((cursor - offsets[:-1]).sum())} / {total_rows} 条记录")
+
+    # 第三遍：分块将每个路段内的记录按(next_nds_id, 离开时间)排序
+    block_first = 0
+    while block_first < len(links):
+        block_last = int(np.searchsorted(offsets, offsets[block_first] + sort_block_rows, side='right')) - 1
+        block_last = min(max(block_last, block_first + 1), len(links))
+        start, end = offsets[block_first], offsets[block_last]
+        local_link = np.repeat(np.arange(block_last - block_first), np.diff(offsets[block_first:block_last + 1]))
+        order = np.lexsort((columns['exit_epoch'][start:end], columns['next_nds_id'][start:end], local_link))
+        for col in INDEX_COLUMNS:
+            columns[col][start:end] = columns[col][start:end][order]
+        block_first = block_last
+
+    for mm in columns.values():
+        mm.flush()
+    return total_rows
+
+
+class TrajectoryIndex:
+    """以内存映射方式打开的轨迹存储，查询结果为零拷贝视图"""
+
+    def __init__(self, index_dir: str = DEFAULT_INDEX_DIR):
+        self.index_dir = index_dir
+        self.links = np.load(os.path.join(index_dir, 'links.npy'))
+        self.offsets = np.load(os.path.join(index_dir, 'link_offsets.npy'))
+        self.columns = {
+            col: np.load(os.path.join(index_dir, f'{col}.npy'), mmap_mode='r')
+            for col in INDEX_COLUMNS
+        }
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _link_range(self, nds_id):
+        i = int(np.searchsorted(self.links, nds_id))
+        if i == len(self.links) or self.links[i] != nds_id:
+            return 0, 0
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def _slice(self, start, end) -> Dict[str, np.ndarray]:
+        return {col: values[start:end] for col, values in self.columns.items()}
+
+    def link(self, nds_id: int) -> Dict[str, np.ndarray]:
+        """返回一个路段的所有记录（按next_nds_id、离开时间排序）"""
+        return self._slice(*self._link_range(nds_id))
+
+    def movement(self, nds_id: int, next_nds_id: int) -> Dict[str, np.ndarray]:
+        """返回一个转向(nds_id -> next_nds_id)的所有记录（按离开时间排序）"""
+        start, end = self._link_range(nds_id)
+        next_ids = self.columns['next_nds_id'][start:end]
+        lo = start + int(np.searchsorted(next_ids, next_nds_id, side='left'))
+        hi = start + int(np.searchsorted(next_ids, next_nds_id, side='right'))
+        return self._slice(lo, hi)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='构建按nds_id索引的内存映射轨迹存储')
+    parser.add_argument('--input', default='data/trajectory_20250329.txt', help='原始轨迹文件')
+    parser.add_argument('--dataset', default=None, help='Parquet数据集目录（见trajectory_store.py），指定后从数据集读取')
+    parser.add_argument('--output', default=DEFAULT_INDEX_DIR, help='存储目录')
+    parser.add_argument('--chunk-size', type=int, default=1000000, help='每次读取的行数')
+    args = parser.parse_args()
+
+    total_rows = build_index(args.output, input_file=args.input, dataset_dir=args.dataset,
+                             chunk_size=args.chunk_size)
+    print(f"构建完成，共 {total_rows} 条记录，结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+原始轨迹文件的列式缓存（Parquet）
+
+一次性将data/trajectory_20250329.txt转换为按离开时间小时分区的Parquet数据集：
+    data/trajectory_parquet/exit_hour=16/part-0.parquet
+之后各脚本只读取需要的列和小时分区，不必重新解析整个文本文件。
+
+多天的数据放在同一个目录下（见data_partitions.py）时，每天写入单独的day=YYYYMMDD分区：
+    data/trajectory_parquet/day=20250329/exit_hour=16/part-0.parquet
+已转换的日期记录在数据集目录的_processed_days.json中，再次运行只转换新到的日期。
+
+用法：
+    python trajectory_store.py --input data/trajectory_20250329.txt --output data/trajectory_parquet
+    python trajectory_store.py --data-dir data/raw --output data/trajectory_parquet
+"""
+import argparse
+import os
+import shutil
+from typing import Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from data_partitions import (DAY_PARTITION_COLUMN, discover_days, mark_day_processed, pending_days,
+                             reset_day_dir, trajectory_file)
+from data_schema import read_trajectory, trajectory_dtypes
+from trajectory_filters import exit_epoch_seconds, local_seconds_of_day
+
+DEFAULT_DATASET_DIR = 'data/trajectory_parquet'
+PARTITION_COLUMN = 'exit_hour'
+INGEST_STAGE = 'ingest'
+
+
+def _arrow_type(dtype):
+    """将data_schema中的列类型转换为Arrow类型"""
+    if dtype == 'str':
+        return pa.string()
+    # pandas的可空整数类型（如Int64）对应同宽度的Arrow整数类型
+    return pa.from_numpy_dtype(np.dtype(dtype.lower()))
+
+
+def _ingest_schema():
+    fields = [pa.field(col, _arrow_type(dtype)) for col, dtype in trajectory_dtypes().items()]
+    fields.append(pa.field('exit_epoch', pa.int64()))
+    return pa.schema(fields)
+
+
+def ingest_trajectory(input_file: str, dataset_dir: str = DEFAULT_DATASET_DIR, chunk_size: int = 1000000,
+                      day: Optional[str] = None) -> int:
+    """
+    将原始轨迹文本转换为按小时分区的Parquet数据集，返回写入的行数
+    指定day时只重写该日期的分区，其他日期的数据保持不变
+    """
+    if day is not None:
+        dataset_dir = reset_day_dir(dataset_dir, day)
+    else:
+        if os.path.exists(dataset_dir):
+            shutil.rmtree(dataset_dir)
+        os.makedirs(dataset_dir)
+
+    schema = _ingest_schema()
+    writers = {}
+    total_rows = 0
+    try:
+        for chunk in read_trajectory(input_file, chunksize=chunk_size):
+            exit_epoch = exit_epoch_seconds(chunk)
+            chunk['exit_epoch'] = exit_epoch
+            exit_hour = local_seconds_of_day(exit_epoch) // 3600
+
+            for hour in np.unique(exit_hour):
+                part = chunk[exit_hour == hour]
+                writer = writers.get(hour)
+                if writer is None:
+                    part_dir = os.path.join(dataset_dir, f'{PARTITION_COLUMN}={int(hour)}')
+                    os.makedirs(part_dir)
+                    writer = pq.ParquetWriter(os.path.join(part_dir, 'part-0.parquet'), schema)
+                    writers[hour] = writer
+                writer.write_table(pa.Table.from_pandas(part, schema=schema, preserve_index=False))
+
+            total_rows += len(chunk)
+            print(f"已转换 {total_rows} 行数据")
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return total_rows
+
+
+def window_hours(window_start: int, window_end: int) -> List[int]:
+    """时间窗口[window_start, window_end]（当天秒数）涉及的小时分区"""
+    start_hour = window_start // 3600
+    end_hour = window_end // 3600
+    if start_hour <= end_hour:
+        return list(range(start_hour, end_hour + 1))
+    return list(range(start_hour, 24)) + list(range(0, end_hour + 1))
+
+
+def _dataset_filter(hours: Optional[List[int]], days: Optional[List[str]] = None):
+    conditions = []
+    if hours is not None:
+        conditions.append(ds.field(PARTITION_COLUMN).isin([int(h) for h in hours]))
+    if days is not None:
+        conditions.append(ds.field(DAY_PARTITION_COLUMN).isin([int(d) for d in days]))
+    if not conditions:
+        return None
+    result = conditions[0]
+    for condition in conditions[1:]:
+        result = result & condition
+    return result
+
+
+def iter_trajectory_batches(dataset_dir: str = DEFAULT_DATASET_DIR, columns: Optional[List[str]] = None,
+                            hours: Optional[List[int]] = None, batch_size: int = 1000000,
+                            days: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """按批读取Parquet数据集，只加载指定的列、小时分区和日期分区"""
+    dataset = ds.dataset(dataset_dir, format='parquet', partitioning='hive')
+    for batch in dataset.to_batches(columns=columns, filter=_dataset_filter(hours, days), batch_size=batch_size):
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def load_trajectory(dataset_dir: str = DEFAULT_DATASET_DIR, columns: Optional[List[str]] = None,
+                    hours: Optional[List[int]] = None, days: Optional[List[str]] = None) -> pd.DataFrame:
+    """一次性读取Parquet数据集中指定的列、小时分区和日期分区"""
+    dataset = ds.dataset(dataset_dir, format='parquet', partitioning='hive')
+    return dataset.to_table(columns=columns, filter=_dataset_filter(hours, days)).to_pandas()
+
+
+def ingest_new_days(data_dir: str, dataset_dir: str = DEFAULT_DATASET_DIR, chunk_size: int = 1000000) -> List[str]:
+    """转换数据目录中还没有转换过的日期，返回本次转换的日期"""
+    os.makedirs(dataset_dir, exist_ok=True)
+    days = pending_days(dataset_dir, INGEST_STAGE, discover_days(data_dir))
+    for day in days:
+        print(f"开始转换 {day} 的数据")
+        total_rows = ingest_trajectory(trajectory_file(data_dir, day), dataset_dir, chunk_size, day=day)
+        mark_day_processed(dataset_dir, INGEST_STAGE, day, {'rows': total_rows})
+    return days
+
+
+def main():
+    parser = argparse.ArgumentParser(description='将原始轨迹文件转换为按小时分区的Parquet数据集')
+    parser.add_argument('--input', default='data/trajectory_20250329.txt', help='原始轨迹文件')
+    parser.add_argument('--data-dir', default=None,
+                        help='按日期存放原始轨迹文件的目录，指定后只转换新到的日期')
+    parser.add_argument('--output', default=DEFAULT_DATASET_DIR, help='Parquet数据集目录')
+    parser.add_argument('--chunk-size', type=int, default=1000000, help='每次读取的行数')
+    args = parser.parse_args()
+
+    if args.data_dir:
+        days = ingest_new_days(args.data_dir, args.output, args.chunk_size)
+        if days:
+            print(f"转换完成，本次转换了 {len(days)} 天的数据: {', '.join(days)}")
+        else:
+            print("没有新的日期需要转换")
+        return
+
+    total_rows = ingest_trajectory(args.input, args.output, args.chunk_size)
+    print(f"转换完成，共 {total_rows} 行数据，结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()